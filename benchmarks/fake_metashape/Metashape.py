@@ -0,0 +1,513 @@
+#----------------------------------------
+# Stand-in for the Metashape python module
+#----------------------------------------
+# Implements the part of the Metashape api that is used by the helpers, so that the helpers can be run (e.g. by the
+# benchmarks) without a Metashape installation and license. Nothing is calculated: every processing method sleeps for
+# its simulated duration while reporting its progress and adds its simulated output size to the chunk. The document
+# is stored as a small json file (.psx) and a data file with the size of all outputs (.files folder), so that saving
+# and copying the datasets costs about as much disk io as with Metashape.
+#
+# The simulation is configured with configure() or the FAKE_METASHAPE_CONFIG environment variable (json), which is
+# also used by the worker processes of a dataset pool:
+#   durations     -> Simulated seconds per processing method (e.g. {"buildModel": 2.0})
+#   time_scale    -> Factor for all durations (e.g. 0 to measure the orchestration only)
+#   output_sizes  -> Simulated output bytes per processing method (stored in the document data file)
+#   face_counts   -> Face count of the built model per face count constant
+#   progress_steps-> Amount of progress callbacks per processing method
+#
+# Use it by putting the fake_metashape folder in front of the python path (see benchmarks/run_benchmarks.py).
+#----------------------------------------
+import json
+import os
+import threading
+import time
+
+# Default simulation (about the relative durations of a real dataset, in seconds)
+DEFAULT_CONFIG = {
+    "durations": {
+        "addPhotos":       0.05,
+        "matchPhotos":     0.5,
+        "alignCameras":    0.3,
+        "optimizeCameras": 0.05,
+        "buildDepthMaps":  1.0,
+        "buildModel":      1.0,
+        "smoothModel":     0.05,
+        "decimateModel":   0.1,
+        "buildUV":         0.1,
+        "buildTexture":    0.5,
+        "exportModel":     0.1,
+    },
+    "time_scale": 1.0,
+    "output_sizes": {
+        "matchPhotos":    2 * 1024 * 1024,
+        "buildDepthMaps": 16 * 1024 * 1024,
+        "buildModel":     8 * 1024 * 1024,
+        "buildTexture":   4 * 1024 * 1024,
+        "exportModel":    8 * 1024 * 1024,
+    },
+    "face_counts": {
+        "LowFaceCount":    20000,
+        "MediumFaceCount": 60000,
+        "HighFaceCount":   200000,
+    },
+    "progress_steps": 10,
+}
+
+# Current simulation and the measured time of the process (read by the benchmarks)
+config = json.loads(json.dumps(DEFAULT_CONFIG))
+statistics = {
+    "simulated_time": 0.0,
+    "save_count":     0,
+    "save_time":      0.0,
+    "open_count":     0,
+    "open_time":      0.0,
+}
+statistics_lock = threading.Lock()
+
+
+def configure(**simulation) -> None:
+    """
+    This function changes the simulation of this process and of the worker processes started afterwards.
+    Dictionaries (durations, output_sizes, face_counts) are merged with the current values.
+    """
+    for key, value in simulation.items():
+        if isinstance(value, dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    os.environ["FAKE_METASHAPE_CONFIG"] = json.dumps(config)
+
+
+def reset_statistics() -> None:
+    with statistics_lock:
+        for key in statistics:
+            statistics[key] = 0 if isinstance(statistics[key], int) else 0.0
+
+
+def add_statistic(key: str, value) -> None:
+    with statistics_lock:
+        statistics[key] += value
+
+
+# Load the simulation of the parent process
+if "FAKE_METASHAPE_CONFIG" in os.environ:
+    for config_key, config_value in json.loads(os.environ["FAKE_METASHAPE_CONFIG"]).items():
+        config[config_key] = config_value
+
+
+#----------------------------------------
+# Constants
+#----------------------------------------
+
+# Filter modes
+NoFiltering         = "NoFiltering"
+MildFiltering       = "MildFiltering"
+ModerateFiltering   = "ModerateFiltering"
+AggressiveFiltering = "AggressiveFiltering"
+
+# Face counts
+LowFaceCount    = "LowFaceCount"
+MediumFaceCount = "MediumFaceCount"
+HighFaceCount   = "HighFaceCount"
+CustomFaceCount = "CustomFaceCount"
+
+# Data sources
+DepthMapsData  = "DepthMapsData"
+PointCloudData = "PointCloudData"
+TiePointsData  = "TiePointsData"
+ModelData      = "ModelData"
+
+# Mapping modes
+GenericMapping    = "GenericMapping"
+OrthophotoMapping = "OrthophotoMapping"
+
+# Image formats
+ImageFormatPNG  = "ImageFormatPNG"
+ImageFormatJPEG = "ImageFormatJPEG"
+ImageFormatTIFF = "ImageFormatTIFF"
+
+# Model formats
+ModelFormatOBJ  = "ModelFormatOBJ"
+ModelFormatPLY  = "ModelFormatPLY"
+ModelFormatGLTF = "ModelFormatGLTF"
+
+
+class Application():
+    def __init__(self) -> None:
+        self.version = "2.0.2"
+
+
+app = Application()
+
+
+#----------------------------------------
+# Basic types
+#----------------------------------------
+
+class Vector(list):
+    pass
+
+
+class CoordinateSystem():
+    def __init__(self, wkt: str = "") -> None:
+        self.wkt = wkt
+
+
+class Calibration():
+    def __init__(self) -> None:
+        self.f      = 0.0
+        self.width  = 0
+        self.height = 0
+
+
+class Reference():
+    def __init__(self) -> None:
+        self.location = None
+        self.enabled  = False
+
+
+class Sensor():
+    def __init__(self, key: int) -> None:
+        self.key        = key
+        self.user_calib = None
+
+
+class Camera():
+    def __init__(self, key: int, label: str, photo_path: str, sensor: Sensor) -> None:
+        self.key        = key
+        self.label      = label
+        self.photo_path = photo_path
+        self.sensor     = sensor
+        self.reference  = Reference()
+        self.transform  = None
+        self.enabled    = True
+
+
+class Model():
+    def __init__(self, face_count: int) -> None:
+        # Only the amount of faces is simulated
+        self.faces    = range(face_count)
+        self.vertices = range(face_count // 2)
+        self.has_uv   = False
+        self.textures = []
+
+
+class DepthMaps():
+    def __init__(self, camera_count: int) -> None:
+        self.camera_count = camera_count
+
+
+#----------------------------------------
+# Chunk and document
+#----------------------------------------
+
+class Chunk():
+    def __init__(self, document, label: str = "Chunk 1") -> None:
+        self.document = document
+        self.label    = label
+        self.crs      = None
+        self.cameras  = []
+        self.sensors  = []
+        # Simulated size of all outputs of the chunk (bytes)
+        self.output_sizes = {}
+        self.tie_points = None
+        self.depth_maps = None
+        self.model      = None
+
+
+    def remove(self, items) -> None:
+        # Removing the depth maps or the tie points removes their data from the document
+        for item in items if isinstance(items, list) else [items]:
+            if item is not None and item is self.depth_maps:
+                self.depth_maps = None
+                self.output_sizes.pop("buildDepthMaps", None)
+            elif item is not None and item is self.tie_points:
+                self.tie_points = None
+                self.output_sizes.pop("matchPhotos", None)
+
+
+    def simulate(self, method_name: str, progress=None) -> None:
+        """
+        This method sleeps for the simulated duration of the processing method and reports the progress.
+        """
+        duration = config["durations"].get(method_name, 0.0) * config["time_scale"]
+        steps    = max(1, config["progress_steps"])
+        for step in range(steps):
+            if duration > 0:
+                time.sleep(duration / steps)
+            if progress is not None:
+                progress(100 * (step + 1) / steps)
+        add_statistic("simulated_time", duration)
+
+        # Add the simulated output to the chunk
+        if method_name in config["output_sizes"]:
+            self.output_sizes[method_name] = config["output_sizes"][method_name]
+
+
+    def addPhotos(self, filenames, progress=None, **kwargs) -> None:
+        sensor = Sensor(len(self.sensors))
+        self.sensors.append(sensor)
+        for filename in filenames:
+            label = os.path.splitext(os.path.basename(filename))[0]
+            self.cameras.append(Camera(len(self.cameras), label, filename, sensor))
+        self.simulate("addPhotos", progress)
+
+
+    def updateTransform(self) -> None:
+        pass
+
+
+    def matchPhotos(self, progress=None, pairs=None, **kwargs) -> None:
+        self.simulate("matchPhotos", progress)
+        self.tie_points = {"pairs": len(pairs) if pairs else None}
+
+
+    def alignCameras(self, progress=None, **kwargs) -> None:
+        if self.tie_points is None:
+            raise RuntimeError("Empty tie points")
+        self.simulate("alignCameras", progress)
+        for camera in self.cameras:
+            camera.transform = [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0]
+
+
+    def optimizeCameras(self, progress=None, **kwargs) -> None:
+        self.simulate("optimizeCameras", progress)
+
+
+    def buildDepthMaps(self, progress=None, **kwargs) -> None:
+        if not any(camera.transform is not None for camera in self.cameras):
+            raise RuntimeError("No aligned cameras")
+        self.simulate("buildDepthMaps", progress)
+        self.depth_maps = DepthMaps(len(self.cameras))
+
+
+    def buildModel(self, face_count=HighFaceCount, source_data=DepthMapsData, progress=None, face_count_custom=200000, **kwargs) -> None:
+        if source_data == DepthMapsData and self.depth_maps is None:
+            raise RuntimeError("Empty depth maps")
+        self.simulate("buildModel", progress)
+        if face_count == CustomFaceCount:
+            self.model = Model(face_count_custom)
+        else:
+            self.model = Model(config["face_counts"].get(face_count, 200000))
+
+
+    def smoothModel(self, progress=None, **kwargs) -> None:
+        self.require_model()
+        self.simulate("smoothModel", progress)
+
+
+    def decimateModel(self, face_count: int, progress=None, **kwargs) -> None:
+        self.require_model()
+        self.simulate("decimateModel", progress)
+        self.model = Model(min(face_count, len(self.model.faces)))
+        if "buildModel" in self.output_sizes:
+            self.output_sizes["buildModel"] = int(self.output_sizes["buildModel"] * len(self.model.faces) / config["face_counts"]["HighFaceCount"])
+
+
+    def buildUV(self, progress=None, **kwargs) -> None:
+        self.require_model()
+        self.simulate("buildUV", progress)
+        self.model.has_uv = True
+
+
+    def buildTexture(self, texture_size: int = 8192, progress=None, **kwargs) -> None:
+        self.require_model()
+        if not self.model.has_uv:
+            raise RuntimeError("Model has no UV")
+        self.simulate("buildTexture", progress)
+        self.model.textures = [texture_size]
+
+
+    def exportModel(self, path: str, progress=None, save_texture: bool = True, **kwargs) -> None:
+        self.require_model()
+        self.simulate("exportModel", progress)
+
+        # Write the simulated model file (and texture) so that the exports cost disk io
+        export_size = config["output_sizes"].get("exportModel", 0)
+        write_file(path, export_size)
+        if save_texture and len(self.model.textures) > 0:
+            write_file(f"{os.path.splitext(path)[0]}.png", config["output_sizes"].get("buildTexture", 0))
+
+
+    def copy(self, items=None, keypoints: bool = True):
+        # Copy the chunk into the same document
+        chunk = Chunk(self.document, f"{self.label} Copy")
+        chunk.crs          = self.crs
+        chunk.cameras      = list(self.cameras)
+        chunk.sensors      = list(self.sensors)
+        chunk.tie_points   = self.tie_points
+        chunk.depth_maps   = self.depth_maps
+        chunk.model        = Model(len(self.model.faces)) if self.model is not None else None
+        chunk.output_sizes = dict(self.output_sizes)
+        if chunk.model is not None:
+            chunk.model.has_uv   = self.model.has_uv
+            chunk.model.textures = list(self.model.textures)
+        self.document.chunks.append(chunk)
+        return chunk
+
+
+    def require_model(self) -> None:
+        if self.model is None:
+            raise RuntimeError("Empty model")
+
+
+    def get_state(self) -> dict:
+        # State of the chunk that is stored in the document
+        return {
+            "label":        self.label,
+            "cameras":      [[camera.label, camera.photo_path, camera.transform is not None] for camera in self.cameras],
+            "tie_points":   self.tie_points is not None,
+            "depth_maps":   self.depth_maps is not None,
+            "face_count":   len(self.model.faces) if self.model is not None else None,
+            "has_uv":       self.model.has_uv if self.model is not None else False,
+            "output_sizes": self.output_sizes,
+        }
+
+
+    def set_state(self, state: dict) -> None:
+        # Restore the chunk from the stored state
+        self.label   = state["label"]
+        self.sensors = [Sensor(0)]
+        self.cameras = []
+        for key, (label, photo_path, aligned) in enumerate(state["cameras"]):
+            camera = Camera(key, label, photo_path, self.sensors[0])
+            camera.transform = [1.0] if aligned else None
+            self.cameras.append(camera)
+        self.tie_points   = {} if state["tie_points"] else None
+        self.depth_maps   = DepthMaps(len(self.cameras)) if state["depth_maps"] else None
+        self.model        = Model(state["face_count"]) if state["face_count"] is not None else None
+        if self.model is not None:
+            self.model.has_uv = state["has_uv"]
+        self.output_sizes = state["output_sizes"]
+
+
+class Document():
+    def __init__(self) -> None:
+        self.path   = ""
+        self.chunks = []
+        self.chunk  = None
+        self.read_only = False
+
+
+    def addChunk(self) -> Chunk:
+        chunk = Chunk(self, f"Chunk {len(self.chunks) + 1}")
+        self.chunks.append(chunk)
+        self.chunk = chunk
+        return chunk
+
+
+    def remove(self, items) -> None:
+        # Remove chunks from the document
+        items = items if isinstance(items, list) else [items]
+        self.chunks = [chunk for chunk in self.chunks if chunk not in items]
+        if self.chunk not in self.chunks:
+            self.chunk = self.chunks[0] if len(self.chunks) > 0 else None
+
+
+    def open(self, path: str, read_only: bool = False, ignore_lock: bool = False, **kwargs) -> None:
+        start_time = time.time()
+        if not os.path.isfile(path):
+            raise OSError(f"Can't open file: {path}")
+        lock_file_path = get_lock_file_path(path)
+        if not read_only and not ignore_lock and os.path.isfile(lock_file_path):
+            raise OSError(f"Can't open file: {path} (document is locked)")
+
+        # Read the document and its data (the data is read to simulate the io)
+        with open(path, "r") as psx_file:
+            state = json.load(psx_file)
+        data_file_path = get_data_file_path(path)
+        if os.path.isfile(data_file_path):
+            with open(data_file_path, "rb") as data_file:
+                while data_file.read(1024 * 1024):
+                    pass
+
+        self.path      = path
+        self.read_only = read_only
+        self.chunks    = []
+        for chunk_state in state["chunks"]:
+            chunk = Chunk(self)
+            chunk.set_state(chunk_state)
+            self.chunks.append(chunk)
+        self.chunk = self.chunks[state["active_chunk"]] if state["active_chunk"] is not None else None
+
+        # Lock the document while it is opened
+        if not read_only:
+            write_file(lock_file_path, 0)
+        add_statistic("open_count", 1)
+        add_statistic("open_time", time.time() - start_time)
+
+
+    def save(self, path: str = None, **kwargs) -> None:
+        start_time = time.time()
+        if path is not None:
+            self.path = path
+        if self.path == "":
+            raise OSError("Document has no path")
+        if self.read_only:
+            raise OSError("Document is opened read only")
+
+        # Write the data of all chunks first and the document afterwards
+        data_size = sum(sum(chunk.output_sizes.values()) for chunk in self.chunks)
+        write_file(get_data_file_path(self.path), data_size)
+        state = {
+            "chunks":       [chunk.get_state() for chunk in self.chunks],
+            "active_chunk": self.chunks.index(self.chunk) if self.chunk is not None else None,
+        }
+        write_file(self.path, json.dumps(state))
+
+        # Lock the document while it is opened
+        write_file(get_lock_file_path(self.path), 0)
+        add_statistic("save_count", 1)
+        add_statistic("save_time", time.time() - start_time)
+
+
+class Tasks():
+    class BuildModel():
+        def __init__(self) -> None:
+            self.face_count  = HighFaceCount
+            self.source_data = DepthMapsData
+            self.parameters  = {}
+
+        def __setitem__(self, key: str, value) -> None:
+            # Tweaks
+            self.parameters[key] = value
+
+        def __getitem__(self, key: str):
+            return self.parameters[key]
+
+        def apply(self, object: Chunk, progress=None) -> None:
+            object.buildModel(face_count=self.face_count, source_data=self.source_data, progress=progress)
+
+
+#----------------------------------------
+# Files
+#----------------------------------------
+
+def get_files_folder_path(psx_file_path: str) -> str:
+    return f"{os.path.splitext(psx_file_path)[0]}.files"
+
+
+def get_lock_file_path(psx_file_path: str) -> str:
+    return os.path.join(get_files_folder_path(psx_file_path), "lock")
+
+
+def get_data_file_path(psx_file_path: str) -> str:
+    return os.path.join(get_files_folder_path(psx_file_path), "0", "data.zip")
+
+
+def write_file(path: str, content) -> None:
+    """
+    This function writes the content (text or an amount of zero bytes) into the file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if isinstance(content, str):
+        with open(path, "w") as file:
+            file.write(content)
+        return
+
+    block = bytes(min(content, 1024 * 1024))
+    with open(path, "wb") as file:
+        remaining_size = content
+        while remaining_size > 0:
+            file.write(block[:remaining_size])
+            remaining_size -= len(block)
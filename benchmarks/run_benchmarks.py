@@ -0,0 +1,423 @@
+#----------------------------------------
+# Orchestration benchmarks
+#----------------------------------------
+# Runs the calculation and the export helper end to end over synthetic datasets with the fake Metashape module
+# (benchmarks/fake_metashape). Metashape itself is simulated, so the results show the time the helpers spend around
+# Metashape: discovery, the overhead of every stage (logging, hooks, checkpoints, run history), saving the documents
+# and the throughput in datasets per hour.
+#
+# Examples:
+#   python benchmarks/run_benchmarks.py
+#   python benchmarks/run_benchmarks.py --datasets 20 --images 100 --time-scale 0 --save-policy every_stage
+#   python benchmarks/run_benchmarks.py --workers 2 --json results.json
+#----------------------------------------
+import argparse
+import datetime
+import json
+import math
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from typing import Callable, Dict, List
+
+import numpy as np
+
+# The fake Metashape module has to be found before an installed Metashape module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), 'fake_metashape')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+import Metashape
+from settings.settings import settings
+from settings.settings_validator import SettingsValidator
+from logger import Logger
+from data.dataset_helper import DatasetHelper
+from data.dataset import HelperMode
+from data.dataset_scheduler import DatasetScheduler
+from metashape_helper import MetashapeHelper
+from disk_admission import DiskAdmission
+from eta_model import EtaModel, EtaTracker
+from run_history import RunHistory, get_run_history_file_path
+
+
+#----------------------------------------
+# Synthetic datasets
+#----------------------------------------
+
+def create_png(width: int, height: int, random_generator: np.random.Generator) -> bytes:
+    # Create a png with noise (compresses about as badly as a real photo)
+    pixels = random_generator.integers(0, 256, size=(height, width * 3), dtype=np.uint8)
+    raw_data = np.hstack([np.zeros((height, 1), dtype=np.uint8), pixels]).tobytes()
+
+    def create_chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + create_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + create_chunk(b'IDAT', zlib.compress(raw_data, 1))
+        + create_chunk(b'IEND', b'')
+    )
+
+
+def create_pdf(text_lines: List[str]) -> bytes:
+    # Create a one page pdf with the text lines (like the scan information of the scanner)
+    content = "BT /F1 12 Tf 72 720 Td " + " ".join(f"({text_line}) Tj 0 -14 Td" for text_line in text_lines) + " ET"
+    pdf_objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(content)} >>\nstream\n{content}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = "%PDF-1.4\n"
+    offsets = []
+    for object_number, pdf_object in enumerate(pdf_objects, 1):
+        offsets.append(len(pdf))
+        pdf += f"{object_number} 0 obj\n{pdf_object}\nendobj\n"
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(pdf_objects) + 1}\n0000000000 65535 f \n" + "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    pdf += f"trailer\n<< /Size {len(pdf_objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF"
+    return pdf.encode()
+
+
+def create_dataset(input_folder: str, dataset_name: str, image_count: int, image_size: tuple, random_generator: np.random.Generator) -> None:
+    """
+    This function creates a dataset like the ones of the scanner: images on rings around the insect, the camera
+    positions and the scan information.
+    """
+    dataset_path = os.path.join(input_folder, dataset_name)
+    image_folder_path = os.path.join(dataset_path, settings.get('image_folder_path'))
+    os.makedirs(image_folder_path)
+
+    ring_count = max(1, round(math.sqrt(image_count / 4)))
+    cam_pos_rows = ["name x y z"]
+    for image_number in range(image_count):
+        # Position of the camera on its ring
+        elevation = -70 + 140 * (image_number % ring_count) / max(1, ring_count - 1)
+        azimuth   = 360 * (image_number // ring_count) / math.ceil(image_count / ring_count)
+        image_name = f"image_{image_number + 1:04d}_{elevation:g}_{azimuth:.1f}"
+        with open(os.path.join(image_folder_path, f"{image_name}.png"), 'wb') as image_file:
+            image_file.write(create_png(image_size[0], image_size[1], random_generator))
+
+        x = 100 * math.cos(math.radians(elevation)) * math.cos(math.radians(azimuth))
+        y = 100 * math.cos(math.radians(elevation)) * math.sin(math.radians(azimuth))
+        z = 100 * math.sin(math.radians(elevation))
+        cam_pos_rows.append(f"{image_name} {x:.3f} {y:.3f} {z:.3f}")
+
+    with open(os.path.join(dataset_path, settings.get('cam_pos_file_path')), 'w') as cam_pos_file:
+        cam_pos_file.write("\n".join(cam_pos_rows) + "\n")
+    with open(os.path.join(dataset_path, settings.get('scan_info_file_path')), 'wb') as scan_info_file:
+        scan_info_file.write(create_pdf(["Camera Constant/f [px]: 12345.6", f"Num Images: {image_count}"]))
+
+
+#----------------------------------------
+# Measurements
+#----------------------------------------
+
+class BenchmarkLabel():
+    def configure(self, **kwargs) -> None:
+        pass
+
+
+class BenchmarkWindow():
+    """
+    Window without gui (the helpers update it like the HelperWindow). Counts the progress updates.
+    """
+    def __init__(self) -> None:
+        self.current_dataset_name_dynamic_label = BenchmarkLabel()
+        self.progress_update_count = 0
+
+    def update_datasets_done(self, step: float, processed_datasets: int, available_datasets: int) -> None:
+        pass
+
+    def set_datasets_done(self, processed_datasets: int, available_datasets: int) -> None:
+        pass
+
+    def update_batch_eta(self, batch_eta: str) -> None:
+        pass
+
+    def update_task_info(self, task_name: str, current_task: int, task_amount: int) -> None:
+        pass
+
+    def update_current_dataset_task_progress(self, value: float) -> None:
+        self.progress_update_count += 1
+
+    def reset_current_dataset_task_progressbar(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class BenchmarkMessagebox():
+    @staticmethod
+    def showinfo(title: str, message: str) -> None:
+        pass
+
+
+class StageTimer():
+    """
+    Measures every stage of the helpers in this process: the wall time from the first before hook to the last after
+    hook, the simulated Metashape time and the save time in between. The rest is the overhead of the helper.
+    """
+    def __init__(self) -> None:
+        self.stage_times: Dict[str, List[dict]] = {}
+        self.start_time = 0.0
+        self.start_statistics = {}
+
+    def start_stage(self, stage, parameters, stage_number, stage_amount) -> None:
+        self.start_time = time.perf_counter()
+        self.start_statistics = dict(Metashape.statistics)
+
+    def finish_stage(self, stage, parameters, elapsed_time) -> None:
+        wall_time      = time.perf_counter() - self.start_time
+        simulated_time = Metashape.statistics['simulated_time'] - self.start_statistics['simulated_time']
+        save_time      = Metashape.statistics['save_time'] - self.start_statistics['save_time']
+        self.stage_times.setdefault(stage.name, []).append({
+            'wall_time':      wall_time,
+            'simulated_time': simulated_time,
+            'save_time':      save_time,
+            'overhead':       wall_time - simulated_time - save_time,
+        })
+
+    def create_helper_class(self):
+        # Metashape helper whose stage runners are timed (the timer hooks surround all other hooks)
+        stage_timer = self
+
+        class TimedMetashapeHelper(MetashapeHelper):
+            def createStageRunner(self):
+                stage_runner = super().createStageRunner()
+                stage_runner.before_stage_hooks.insert(0, stage_timer.start_stage)
+                stage_runner.after_stage_hooks.append(stage_timer.finish_stage)
+                return stage_runner
+
+        return TimedMetashapeHelper
+
+
+def measure(function: Callable, timings: List[float]) -> Callable:
+    # Wrap the function and append the wall time of every call to the timings
+    def measured_function(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - start_time)
+    return measured_function
+
+
+def run_helper(helper_module, helper_mode: HelperMode, input_folder: str, output_folder: str, logger: Logger, stage_timer: StageTimer) -> dict:
+    """
+    This function runs the calculate() or export() function of the helper script like the helper does (without gui)
+    and returns its measurements.
+    """
+    dataset_helper = DatasetHelper(logger, input_folder, output_folder, helper_mode)
+
+    # Measure the discovery with empty caches and with the caches of the first discovery (before the helper runs)
+    discovery_times = []
+    dataset_helper.get_available_datasets = measure(dataset_helper.get_available_datasets, discovery_times)
+    dataset_helper.get_available_datasets()
+    dataset_helper.get_available_datasets()
+
+    # Set the globals of the helper script like its main block
+    errors = []
+    helper_module.logger             = logger
+    helper_module.window             = BenchmarkWindow()
+    helper_module.messagebox         = BenchmarkMessagebox
+    helper_module.close_helper       = lambda: None
+    helper_module.show_error_popup   = errors.append
+    helper_module.MetashapeHelper    = stage_timer.create_helper_class()
+    helper_module.dataset_helper     = dataset_helper
+    helper_module.available_datasets = []
+    helper_module.processed_datasets = []
+    helper_module.dataset_pool       = None
+    helper_module.scratch_stager     = None
+    helper_module.job_queue          = None
+    run_history_file_path = get_run_history_file_path()
+    eta_model = EtaModel(RunHistory(run_history_file_path) if os.path.isfile(run_history_file_path) else None)
+    helper_module.eta_tracker        = EtaTracker(eta_model, helper_module.window, logger, helper_mode)
+    helper_module.dataset_scheduler  = DatasetScheduler(eta_model, helper_mode, logger)
+    helper_module.disk_admission     = DiskAdmission(eta_model, helper_mode, logger, input_folder)
+    helper_module.start_time         = datetime.datetime.now()
+    if settings.get('use_scratch_staging'):
+        helper_module.scratch_stager = helper_module.ScratchStager(dataset_helper, logger)
+        if settings.get('parallel_worker_count') == 1:
+            helper_module.disk_admission = DiskAdmission(eta_model, helper_mode, logger, settings.get('scratch_folder_path'), helper_module.scratch_stager)
+
+    # Run the helper
+    Metashape.reset_statistics()
+    start_time = time.perf_counter()
+    if helper_mode == HelperMode.CALCULATION:
+        helper_module.calculate()
+    else:
+        helper_module.export()
+    wall_time = time.perf_counter() - start_time
+    if len(errors) > 0:
+        raise RuntimeError(f"The {helper_mode.name.lower()} helper failed: {errors[0]}")
+
+    # Metashape runs in the worker processes if several datasets are processed at the same time (not measured)
+    processed_dataset_count = len(helper_module.processed_datasets)
+    statistics = Metashape.statistics if settings.get('parallel_worker_count') == 1 else dict.fromkeys(Metashape.statistics)
+    return {
+        'datasets':            processed_dataset_count,
+        'wall_time':           wall_time,
+        'discovery_time_cold': discovery_times[0],
+        'discovery_time_warm': discovery_times[1],
+        'simulated_time':      statistics['simulated_time'],
+        'save_count':          statistics['save_count'],
+        'save_time':           statistics['save_time'],
+        'open_time':           statistics['open_time'],
+        'progress_updates':    helper_module.window.progress_update_count,
+        'datasets_per_hour':   3600 * processed_dataset_count / wall_time if wall_time > 0 else None,
+    }
+
+
+def summarize_stage_times(stage_timer: StageTimer) -> Dict[str, dict]:
+    # Average the measurements of every stage
+    stage_summary = {}
+    for stage_name, stage_times in stage_timer.stage_times.items():
+        stage_summary[stage_name] = {'runs': len(stage_times)}
+        for key in ['wall_time', 'simulated_time', 'save_time', 'overhead']:
+            stage_summary[stage_name][key] = sum(stage_time[key] for stage_time in stage_times) / len(stage_times)
+    return stage_summary
+
+
+#----------------------------------------
+# Report
+#----------------------------------------
+
+def print_table(title: str, header: List[str], rows: List[List[str]]) -> None:
+    print(title)
+    print("=" * len(title))
+    column_widths = [max(len(row[column]) for row in [header] + rows) for column in range(len(header))]
+    for row in [header, ['-' * width for width in column_widths]] + rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, column_widths)).rstrip())
+    print()
+
+
+def print_results(results: dict) -> None:
+    milliseconds = lambda seconds: f"{1000 * seconds:.1f} ms" if seconds is not None else "-"
+    seconds      = lambda seconds: f"{seconds:.2f} s" if seconds is not None else "-"
+
+    helper_rows = []
+    for helper_name in ['calculation', 'export']:
+        helper_results = results[helper_name]
+        helper_rows.append([
+            helper_name,
+            str(helper_results['datasets']),
+            seconds(helper_results['wall_time']),
+            seconds(helper_results['simulated_time']),
+            milliseconds(helper_results['discovery_time_cold']),
+            milliseconds(helper_results['discovery_time_warm']),
+            f"{helper_results['save_count'] if helper_results['save_count'] is not None else '-'} / {milliseconds(helper_results['save_time'])}",
+            f"{helper_results['datasets_per_hour']:.0f}",
+        ])
+    print_table(
+        "Helpers",
+        ['Helper', 'Datasets', 'Wall time', 'Simulated', 'Discovery (cold)', 'Discovery (warm)', 'Saves / time', 'Datasets per hour'],
+        helper_rows
+    )
+
+    if len(results['stages']) > 0:
+        print_table(
+            "Stages (average per dataset)",
+            ['Stage', 'Runs', 'Wall time', 'Simulated', 'Save', 'Overhead'],
+            [
+                [
+                    stage_name, str(stage['runs']), milliseconds(stage['wall_time']), milliseconds(stage['simulated_time']),
+                    milliseconds(stage['save_time']), milliseconds(stage['overhead'])
+                ]
+                for stage_name, stage in results['stages'].items()
+            ]
+        )
+    else:
+        print("Metashape and the stages are not measured when the datasets are processed by worker processes (--workers > 1)\n")
+
+
+#----------------------------------------
+# Main
+#----------------------------------------
+
+def run_benchmarks(arguments: argparse.Namespace) -> dict:
+    work_folder = arguments.work_folder or tempfile.mkdtemp(prefix='metashape_helper_benchmark_')
+    try:
+        # Create the folders of the helpers
+        folders = {}
+        for folder_name in ['Logs', 'Cache', 'Scratch', 'Jobs', '1_SCANNED', '2_CALCULATED', '3_UNPINNED', '4_EXPORTED']:
+            folders[folder_name] = os.path.join(work_folder, folder_name)
+            os.makedirs(folders[folder_name], exist_ok=True)
+
+        # Use the benchmark folders and options
+        settings.update({
+            'log_output_folder_path':         folders['Logs'],
+            'cache_folder_path':              folders['Cache'],
+            'scratch_folder_path':            folders['Scratch'],
+            'job_queue_folder_path':          folders['Jobs'],
+            'calculation_input_folder_path':  folders['1_SCANNED'],
+            'calculation_output_folder_path': folders['2_CALCULATED'],
+            'export_input_folder_path':       folders['3_UNPINNED'],
+            'export_output_folder_path':      folders['4_EXPORTED'],
+            'use_folder_prefix':              True,
+            'folder_prefixes':                ['ETHZ-ENT'],
+            'fused_export_prefixes':          [],
+            'use_watch_mode':                 False,
+            'use_job_queue':                  False,
+            'use_scratch_staging':            arguments.scratch,
+            'parallel_worker_count':          arguments.workers,
+            'save_policy':                    arguments.save_policy,
+        })
+        SettingsValidator().validate()
+
+        # Configure the simulated Metashape (also used by the worker processes)
+        Metashape.configure(time_scale=arguments.time_scale)
+
+        # Create the synthetic datasets
+        print(f"Creating {arguments.datasets} dataset(s) with {arguments.images} images ({arguments.image_size[0]}x{arguments.image_size[1]}) in '{work_folder}'...\n")
+        random_generator = np.random.default_rng(0)
+        for dataset_number in range(arguments.datasets):
+            create_dataset(folders['1_SCANNED'], f"ETHZ-ENT{dataset_number + 1:07d}", arguments.images, arguments.image_size, random_generator)
+
+        stage_timer = StageTimer()
+        results = {'arguments': {key: value for key, value in vars(arguments).items() if key != 'json'}}
+
+        # Calculate all datasets
+        import calculate as calculation_script
+        logger = Logger("benchmark.log")
+        results['calculation'] = run_helper(calculation_script, HelperMode.CALCULATION, folders['1_SCANNED'], folders['2_CALCULATED'], logger, stage_timer)
+
+        # Unpin all datasets (move them to the export input folder) and export them
+        for dataset_name in os.listdir(folders['2_CALCULATED']):
+            shutil.move(os.path.join(folders['2_CALCULATED'], dataset_name), folders['3_UNPINNED'])
+        import export as export_script
+        results['export'] = run_helper(export_script, HelperMode.EXPORT, folders['3_UNPINNED'], folders['4_EXPORTED'], logger, stage_timer)
+
+        results['stages'] = summarize_stage_times(stage_timer)
+        return results
+    finally:
+        # Remove the temporary folder (a given work folder is kept to check the logs)
+        if arguments.work_folder is None:
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs the calculation and export helpers over synthetic datasets with a simulated Metashape.")
+    parser.add_argument('--datasets', type=int, default=5, help="Amount of synthetic datasets (default: 5)")
+    parser.add_argument('--images', type=int, default=40, help="Images per dataset (default: 40)")
+    parser.add_argument('--image-size', type=int, nargs=2, default=[640, 480], metavar=('WIDTH', 'HEIGHT'), help="Image size (default: 640 480)")
+    parser.add_argument('--time-scale', type=float, default=0.1, help="Factor for the simulated Metashape durations, 0 measures the helpers only (default: 0.1)")
+    parser.add_argument('--workers', type=int, default=1, help="parallel_worker_count (default: 1)")
+    parser.add_argument('--save-policy', default='auto', choices=['every_stage', 'expensive_stages', 'end', 'auto'], help="save_policy (default: auto)")
+    parser.add_argument('--scratch', action='store_true', help="Use the scratch staging")
+    parser.add_argument('--work-folder', default=None, help="Folder for the datasets and logs (default: temporary folder, removed afterwards)")
+    parser.add_argument('--json', default=None, help="Write the results into this json file")
+    arguments = parser.parse_args()
+
+    results = run_benchmarks(arguments)
+    print_results(results)
+
+    if arguments.json is not None:
+        with open(arguments.json, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
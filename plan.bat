@@ -0,0 +1,2 @@
+@echo off
+python scripts/plan.py %*
\ No newline at end of file
@@ -0,0 +1,2 @@
+@echo off
+python scripts/report.py %*
\ No newline at end of file
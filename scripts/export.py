@@ -2,26 +2,43 @@ import datetime
 import os
 import sys
 import threading
+import time
 import tkinter as tk
 from tkinter import messagebox
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
 from data.dataset_helper import DatasetHelper
 from data.dataset import HelperMode
+from data.dataset_scheduler import DatasetScheduler
+from data.dataset_watcher import DatasetWatcher
+from data.job_queue import JobQueue
+from data.scratch_stager import ScratchStager
+from dataset_pool import DatasetPool
+from disk_admission import DiskAdmission
+from eta_model import EtaModel, EtaTracker
 from gui.helper_window import HelperWindow
 from settings.settings import settings
 from settings.settings_validator import SettingsValidator
 from logger import Logger
 from metashape_helper import MetashapeHelper
+from run_history import RunHistory, get_run_history_file_path
 
 def export():
-    # Make the available_datasets, processed_datasets, and the start_time available locally
-    global dataset_helper, available_datasets, processed_datasets, start_time
+    # Make the available_datasets, processed_datasets, the dataset_pool and the start_time available locally
+    global dataset_helper, available_datasets, processed_datasets, dataset_pool, start_time
 
     try:
+        # Process the datasets as soon as they are ready if the watch mode is used
+        if settings.get('use_watch_mode'):
+            watch_datasets()
+            return
+
         # Get the available datasets
         available_datasets = dataset_helper.get_available_datasets()
 
+        # Order the datasets by the scheduling policy
+        available_datasets = dataset_scheduler.order(available_datasets)
+
         # Raise an exception if there are no available datasets
         if len(available_datasets) == 0:
             raise ValueError(f"No datasets available!")
@@ -32,30 +49,48 @@ def export():
         # Calculate the progressbar steps
         window.update_datasets_done(0, len(processed_datasets), len(available_datasets))
 
-        # Loop through every available dataset
-        for dataset in available_datasets:
-            # Log the dataset name
-            logger.log(dataset.name)
-
-            # Display the current dataset name in the gui
-            window.current_dataset_name_dynamic_label.configure(text=dataset.name)
-
-            # Create a metashape helper for the dataset and export the the current dataset
-            metashape_helper = MetashapeHelper(dataset, window, logger)
-            metashape_helper.export()
-
-            # Move the dataset to the output folder
-            dataset_helper.move_dataset(dataset)
-
-            # Delete the dataset helper
-            del metashape_helper
-
-            # Add the exported dataset to the processed dataset list
-            processed_datasets.append(dataset)
-
-            # Update the datasets done progressbar
-            window.update_datasets_done(datasets_done_progressbar_step, len(processed_datasets), len(available_datasets))
+        # Predict the duration of all datasets
+        eta_tracker.add_datasets(available_datasets)
+
+        if settings.get('parallel_worker_count') > 1:
+            # Export several datasets at the same time in worker processes
+            dataset_pool = DatasetPool(dataset_helper, window, logger, 'export', job_queue, eta_tracker, disk_admission)
+            dataset_pool.run(available_datasets, finish_dataset)
+        else:
+            # Loop through every available dataset. Datasets without enough free disk space are deferred and tried again
+            # after the other datasets.
+            pending_datasets = list(available_datasets)
+            while len(pending_datasets) > 0:
+                deferred_datasets = []
+                for dataset_number, dataset in enumerate(pending_datasets):
+                    if not disk_admission.admit(dataset):
+                        deferred_datasets.append(dataset)
+                        release_prefetched_dataset(dataset)
+                        continue
+
+                    # Export the dataset and move it to the output folder (the next dataset is staged meanwhile if it fits
+                    # on the disk together with this dataset)
+                    next_dataset = pending_datasets[dataset_number + 1] if dataset_number + 1 < len(pending_datasets) else None
+                    if next_dataset is not None and not disk_admission.fits(next_dataset, disk_admission.get_reserved_bytes([dataset])):
+                        next_dataset = None
+                    export_dataset(dataset, next_dataset)
+                    eta_tracker.finish_dataset(dataset.name)
+
+                    # Update the datasets done progressbar
+                    window.update_datasets_done(datasets_done_progressbar_step, len(processed_datasets), len(available_datasets))
+
+                # Stop if none of the deferred datasets fits (they stay in the input folder for the next run)
+                if len(deferred_datasets) == len(pending_datasets):
+                    logger.log(f"Deferred {len(deferred_datasets)} dataset(s) because of missing disk space: {', '.join(dataset.name for dataset in deferred_datasets)}")
+                    for dataset in deferred_datasets:
+                        eta_tracker.finish_dataset(dataset.name)
+                    break
+                pending_datasets = deferred_datasets
         
+        # Wait until the results of all staged datasets have been written back
+        if scratch_stager is not None:
+            scratch_stager.wait()
+
         # Log the processed dataset amount
         log_processed_datasets(show_message_box=True)
 
@@ -66,6 +101,132 @@ def export():
         show_error_popup(e)
 
 
+def watch_datasets():
+    # Make the available_datasets and processed_datasets available locally
+    global dataset_helper, available_datasets, processed_datasets
+
+    # Start watching the input folder, datasets are queued as soon as they are complete and stable
+    dataset_watcher = DatasetWatcher(dataset_helper, logger, dataset_scheduler)
+    dataset_watcher.start()
+
+    # Process the queued datasets until the helper is closed
+    while True:
+        dataset = dataset_watcher.get_next_dataset()
+
+        # Put the dataset back if there is not enough free disk space (another dataset may fit or space may be freed)
+        if not disk_admission.admit(dataset):
+            dataset_watcher.requeue(dataset)
+            time.sleep(settings.get('watch_poll_interval'))
+            continue
+
+        available_datasets.append(dataset)
+        window.set_datasets_done(len(processed_datasets), len(available_datasets))
+        eta_tracker.add_datasets([dataset])
+
+        # Export the dataset and move it to the output folder
+        export_dataset(dataset)
+        eta_tracker.finish_dataset(dataset.name)
+
+        # Forget the dataset if it stays in the input folder (rejected or claimed by another helper), it is queued again
+        # when its files change
+        if dataset not in processed_datasets:
+            dataset_watcher.reject(dataset)
+
+        # Update the datasets done progressbar
+        window.set_datasets_done(len(processed_datasets), len(available_datasets))
+
+
+def export_dataset(dataset, next_dataset=None):
+    # Make the processed_datasets and the scratch_stager available locally
+    global dataset_helper, processed_datasets, scratch_stager, job_queue
+
+    # Log the dataset name
+    logger.log(dataset.name)
+
+    # Claim the dataset, skip it if another helper processes it or has already processed it
+    if job_queue is not None:
+        if not job_queue.claim(dataset):
+            logger.log("   Claimed by another helper")
+            return
+        if not os.path.isdir(dataset.basepath):
+            logger.log("   Already processed by another helper")
+            job_queue.release(dataset)
+            return
+
+    # Display the current dataset name in the gui
+    window.current_dataset_name_dynamic_label.configure(text=dataset.name)
+
+    # Copy the dataset to the local scratch folder and start copying the next dataset while this one is exportd
+    staged_dataset = dataset
+    if scratch_stager is not None:
+        staged_dataset = scratch_stager.stage(dataset)
+        if next_dataset is not None and (job_queue is None or job_queue.claim(next_dataset)):
+            scratch_stager.prefetch(next_dataset)
+
+    # Record that the document is opened under the claim (its lock is removed if this helper crashes)
+    if job_queue is not None:
+        job_queue.mark_document_opened(dataset)
+
+    # Create a metashape helper for the dataset and export the the current dataset
+    metashape_helper = MetashapeHelper(staged_dataset, window, logger)
+    eta_tracker.attach(metashape_helper, dataset.name)
+    metashape_helper.export()
+
+    # Move the dataset to the output folder (staged datasets are moved after their results have been written back)
+    if scratch_stager is not None:
+        scratch_stager.write_back(staged_dataset, dataset, lambda: move_dataset(dataset))
+    else:
+        move_dataset(dataset)
+
+    # Delete the dataset helper
+    del metashape_helper
+
+    # Add the exported dataset to the processed dataset list
+    processed_datasets.append(dataset)
+
+
+def release_prefetched_dataset(dataset):
+    # Make the scratch_stager and the job_queue available locally
+    global scratch_stager, job_queue
+
+    # A deferred dataset may have been claimed and copied to the scratch folder as the next dataset
+    if scratch_stager is not None:
+        scratch_stager.cancel_prefetch(dataset)
+    if job_queue is not None:
+        job_queue.release(dataset)
+
+
+def move_dataset(dataset):
+    # Make the dataset_helper and the job_queue available locally
+    global dataset_helper, job_queue
+
+    # Leave the dataset if another helper took over its claim (it processes the dataset again)
+    if job_queue is not None and not job_queue.has_claim(dataset):
+        logger.log(f"{dataset.name}: Not moved because the job claim has been lost")
+        return
+
+    # Move the dataset to the output folder and release its claim
+    dataset_helper.move_dataset(dataset)
+    if job_queue is not None:
+        job_queue.release(dataset)
+
+
+def finish_dataset(dataset, error_type, error_message):
+    # Make the processed_datasets and the job_queue available locally
+    global dataset_helper, available_datasets, processed_datasets, job_queue
+
+    # Move the exported dataset to the output folder (datasets with an error stay in the input folder)
+    if error_type is None:
+        move_dataset(dataset)
+        processed_datasets.append(dataset)
+    elif job_queue is not None:
+        job_queue.release(dataset)
+
+    # Update the datasets done progressbar and the ETA
+    window.update_datasets_done(100/len(available_datasets), len(processed_datasets), len(available_datasets))
+    eta_tracker.finish_dataset(dataset.name)
+
+
 def log_processed_datasets(show_message_box: bool):
     # Make the logger, processed_datasets, available_datasets, and the start_time available locally
     global logger, processed_datasets, available_datasets, start_time
@@ -106,11 +267,15 @@ def on_window_close():
 
 
 def close_helper():
-    # Make the logger and the window available locally
-    global logger, window
+    # Make the logger, the window and the dataset_pool available locally
+    global logger, window, dataset_pool
 
     logger.log("Export helper exited!")
 
+    # Stop the worker processes
+    if dataset_pool is not None:
+        dataset_pool.terminate()
+
     # Close the window
     window.close()
 
@@ -138,6 +303,9 @@ if __name__ == '__main__':
     available_datasets = []
     processed_datasets = []
 
+    # Worker pool (only used if several datasets are processed at the same time)
+    dataset_pool = None
+
     try:
         # Create the logger --> Write all logs into the log file folder -> export.log file
         logger = Logger("export.log")
@@ -161,10 +329,37 @@ if __name__ == '__main__':
         export_output_folder_path = settings.get('export_output_folder_path')
         dataset_helper = DatasetHelper(logger, export_input_folder_path, export_output_folder_path, HelperMode.EXPORT)
 
+        # Create the scratch stager if the datasets are processed on a local copy
+        scratch_stager = ScratchStager(dataset_helper, logger) if settings.get('use_scratch_staging') else None
+
+        # Create the job queue if several helpers (e.g. on different workstations) process the same input folder
+        job_queue = None
+        if settings.get('use_job_queue'):
+            job_queue = JobQueue(settings.get('job_queue_folder_path'), HelperMode.EXPORT, logger)
+            dataset_helper.job_queue = job_queue
+
         # Create the gui of the helper and add what
         window = HelperWindow("Export helper")
         window.master.protocol("WM_DELETE_WINDOW", on_window_close)
 
+        # Create the ETA tracker which predicts the remaining time from the run history
+        run_history_file_path = get_run_history_file_path()
+        eta_model = EtaModel(RunHistory(run_history_file_path) if os.path.isfile(run_history_file_path) else None)
+        eta_tracker = EtaTracker(eta_model, window, logger, HelperMode.EXPORT)
+
+        # Create the scheduler which decides in which order the datasets are processed
+        dataset_scheduler = DatasetScheduler(eta_model, HelperMode.EXPORT, logger)
+
+        # Create the disk admission which defers datasets without enough free disk space. The documents are written to
+        # the scratch folder if it is used (the dataset pool always processes the datasets in place). The running copies
+        # of the scratch stager are reserved as well.
+        disk_admission_folder_path = export_input_folder_path
+        if scratch_stager is not None and settings.get('parallel_worker_count') == 1:
+            disk_admission_folder_path = settings.get('scratch_folder_path')
+        disk_admission = DiskAdmission(
+            eta_model, HelperMode.EXPORT, logger, disk_admission_folder_path, scratch_stager if settings.get('parallel_worker_count') == 1 else None
+        )
+
         # Store the start time of the export
         start_time = datetime.datetime.now()
 
@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+from types import SimpleNamespace
+from typing import List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+from data.dataset_helper import DatasetHelper
+from data.dataset import Dataset, HelperMode
+from data.dataset_scheduler import DatasetScheduler
+from disk_admission import DiskAdmission
+from eta_model import EtaModel, get_planned_stage_names
+from logger import Logger
+from parameter_planner import ParameterPlanner
+from report import format_bytes, format_duration, format_value, print_table
+from run_history import RunHistory, get_run_history_file_path
+from settings.settings import settings
+from settings.settings_validator import SettingsValidator
+from stages.metashape_stages import stage_registry
+
+
+def plan_dataset(dataset: Dataset, incompleteness_reasons: List[str], helper_mode: HelperMode, eta_model: EtaModel, disk_admission: DiskAdmission) -> dict:
+    """
+    This function returns what the helper would do with the dataset: its completeness, the stages with their effective
+    parameters and the predicted time and disk usage. Metashape is not needed, the stages are only resolved.
+    """
+    image_width, image_height = dataset.image_size if dataset.image_size is not None else (0, 0)
+    dataset_plan = {
+        'name':                      dataset.name,
+        'complete':                  len(incompleteness_reasons) == 0,
+        'incompleteness_reasons':    incompleteness_reasons,
+        'order':                     None,
+        'image_count':               len(dataset.images),
+        'image_size':                list(dataset.image_size) if dataset.image_size is not None else None,
+        'megapixels':                image_width * image_height / 1e6,
+        'fused_export':              dataset.uses_fused_export(),
+        'parameter_plan':            None,
+        'stages':                    [],
+        'predicted_time':            None,
+        'predicted_disk_usage':      None,
+        'predicted_peak_disk_usage': None,
+    }
+    if not dataset_plan['complete']:
+        return dataset_plan
+
+    # The matching and depth map parameters are planned like at the start of the calculation
+    helper = SimpleNamespace(dataset=dataset, parameter_plan=None)
+    if helper_mode == HelperMode.CALCULATION:
+        helper.parameter_plan, reasons = ParameterPlanner(dataset).plan()
+        dataset_plan['parameter_plan'] = {'parameters': helper.parameter_plan, 'reasons': reasons}
+
+    # Resolve the stages like MetashapeHelper and predict their durations from the run history
+    predicted_durations = dict(eta_model.predict_dataset(dataset, helper_mode))
+    for stage in stage_registry.resolve(get_planned_stage_names(dataset, helper_mode), helper):
+        dataset_plan['stages'].append({
+            'name':           stage.name,
+            'label':          stage.label,
+            'parameters':     stage.get_parameters(helper),
+            'predicted_time': predicted_durations.get(stage.name),
+        })
+    stage_durations = [stage['predicted_time'] for stage in dataset_plan['stages']]
+    dataset_plan['predicted_time'] = sum(stage_durations) if None not in stage_durations else None
+    dataset_plan['predicted_disk_usage'] = eta_model.predict_disk_usage(dataset, helper_mode)
+    dataset_plan['predicted_peak_disk_usage'] = disk_admission.estimate_peak_disk_usage(dataset)
+    return dataset_plan
+
+
+def create_plan(input_folder_path: str, helper_mode: HelperMode, logger: Logger) -> dict:
+    """
+    This function evaluates every dataset in the input folder and returns the plan of the whole folder. The complete
+    datasets are listed in the order they would be processed, followed by the incomplete datasets.
+    """
+    # The run history is used for the predictions (everything is unknown without it)
+    run_history_file_path = get_run_history_file_path()
+    eta_model = EtaModel(RunHistory(run_history_file_path) if os.path.isfile(run_history_file_path) else None)
+
+    # Evaluate the datasets like the helpers (the output folder is not used)
+    dataset_helper = DatasetHelper(logger, input_folder_path, input_folder_path, helper_mode)
+    evaluated_datasets = dataset_helper.evaluate_datasets()
+
+    # Order the complete datasets like the scheduler of the helpers
+    complete_datasets = [dataset for dataset, incompleteness_reasons in evaluated_datasets if len(incompleteness_reasons) == 0]
+    ordered_datasets  = DatasetScheduler(eta_model, helper_mode, logger).order(complete_datasets)
+    dataset_order     = {dataset.name: order for order, dataset in enumerate(ordered_datasets, 1)}
+
+    # The peak disk usage is estimated like the disk admission of the helpers
+    disk_admission = DiskAdmission(eta_model, helper_mode, logger, input_folder_path)
+
+    dataset_plans = []
+    for dataset, incompleteness_reasons in evaluated_datasets:
+        dataset_plan = plan_dataset(dataset, incompleteness_reasons, helper_mode, eta_model, disk_admission)
+        dataset_plan['order'] = dataset_order.get(dataset.name)
+        dataset_plans.append(dataset_plan)
+    dataset_plans.sort(key=lambda dataset_plan: (dataset_plan['order'] is None, dataset_plan['order'] or 0, dataset_plan['name']))
+
+    # Sum up the predictions of the complete datasets (the time is split between the parallel workers)
+    planned_datasets = [dataset_plan for dataset_plan in dataset_plans if dataset_plan['complete']]
+    predicted_times = [dataset_plan['predicted_time'] for dataset_plan in planned_datasets]
+    predicted_disk_usages = [dataset_plan['predicted_disk_usage'] for dataset_plan in planned_datasets]
+    worker_count = max(1, min(settings.get('parallel_worker_count'), len(planned_datasets)))
+    return {
+        'input_folder':         input_folder_path,
+        'helper_mode':          helper_mode.name.lower(),
+        'schedule_policy':      settings.get('schedule_policy'),
+        'complete_datasets':    len(planned_datasets),
+        'incomplete_datasets':  len(dataset_plans) - len(planned_datasets),
+        'predicted_time':       sum(predicted_times) / worker_count if None not in predicted_times else None,
+        'predicted_disk_usage': sum(predicted_disk_usages) if None not in predicted_disk_usages else None,
+        'free_disk_space':      shutil.disk_usage(input_folder_path).free,
+        'datasets':             dataset_plans,
+    }
+
+
+def format_parameters(parameters: dict) -> str:
+    # Format the parameters compactly (lists like the tweaks are shortened)
+    formatted_parameters = []
+    for parameter_name, parameter_value in parameters.items():
+        if isinstance(parameter_value, (list, tuple)) and len(str(parameter_value)) > 40:
+            parameter_value = f"[{len(parameter_value)} items]"
+        formatted_parameters.append(f"{parameter_name}={parameter_value}")
+    return ", ".join(formatted_parameters)
+
+
+def print_plan(plan: dict) -> None:
+    # Overview of all datasets in the order they would be processed
+    print_table(
+        f"Plan of '{plan['input_folder']}' ({plan['helper_mode']}, {plan['schedule_policy']})",
+        ['#', 'Dataset', 'Status', 'Images', 'Megapixels', 'Stages', 'Time', 'Disk', 'Peak disk'],
+        [
+            [
+                format_value(dataset_plan['order']), dataset_plan['name'], 'complete' if dataset_plan['complete'] else 'incomplete',
+                str(dataset_plan['image_count']), f"{dataset_plan['megapixels']:.1f}", str(len(dataset_plan['stages'])),
+                format_duration(dataset_plan['predicted_time']), format_bytes(dataset_plan['predicted_disk_usage']),
+                format_bytes(dataset_plan['predicted_peak_disk_usage'])
+            ]
+            for dataset_plan in plan['datasets']
+        ],
+        empty_message="No datasets found"
+    )
+
+    # Why the incomplete datasets would be skipped
+    incomplete_dataset_plans = [dataset_plan for dataset_plan in plan['datasets'] if not dataset_plan['complete']]
+    if len(incomplete_dataset_plans) > 0:
+        print("Incomplete datasets")
+        print("===================")
+        for dataset_plan in incomplete_dataset_plans:
+            print(f"{dataset_plan['name']}: {'; '.join(dataset_plan['incompleteness_reasons'])}")
+        print()
+
+    # Stages and effective parameters of every complete dataset
+    for dataset_plan in plan['datasets']:
+        if not dataset_plan['complete']:
+            continue
+        print_table(
+            f"{dataset_plan['order']}. {dataset_plan['name']}" + (" (fused export)" if dataset_plan['fused_export'] else ""),
+            ['#', 'Stage', 'Time', 'Parameters'],
+            [
+                [str(stage_number), stage['name'], format_duration(stage['predicted_time']), format_parameters(stage['parameters'])]
+                for stage_number, stage in enumerate(dataset_plan['stages'], 1)
+            ],
+            empty_message="No stages"
+        )
+        if dataset_plan['parameter_plan'] is not None:
+            for reason in dataset_plan['parameter_plan']['reasons']:
+                print(f"  {reason}")
+            print()
+
+    # Totals of the batch
+    print(f"Complete datasets:    {plan['complete_datasets']} ({plan['incomplete_datasets']} incomplete)")
+    print(f"Predicted time:       {format_duration(plan['predicted_time'])} ({settings.get('parallel_worker_count')} parallel worker(s))")
+    print(f"Predicted disk usage: {format_bytes(plan['predicted_disk_usage'])} (free: {format_bytes(plan['free_disk_space'])})")
+    if plan['predicted_time'] is None or plan['predicted_disk_usage'] is None:
+        print("Unknown predictions need a run history with every stage (see use_run_history)")
+
+
+if __name__ == "__main__":
+    # Read the arguments
+    parser = argparse.ArgumentParser(description="Shows what the calculation or export helper would do with the datasets without running Metashape.")
+    parser.add_argument('--mode', choices=['calculation', 'export'], default='calculation', help="Plan the calculation or the export (default: calculation)")
+    parser.add_argument('--folder', default=None, help="Plan this folder instead of the input folder of the helper")
+    parser.add_argument('--json', action='store_true', help="Print the plan as json")
+    arguments = parser.parse_args()
+
+    # Validate the settings (Metashape is not imported)
+    SettingsValidator().validate(check_metashape_version=False)
+
+    # Plan the input folder of the helper (or the given folder)
+    helper_mode = HelperMode[arguments.mode.upper()]
+    input_folder_path = arguments.folder
+    if input_folder_path is None:
+        input_folder_path = settings.get(f'{arguments.mode}_input_folder_path')
+    plan = create_plan(input_folder_path, helper_mode, Logger("plan.log"))
+
+    if arguments.json:
+        print(json.dumps(plan, indent=2, default=str))
+    else:
+        print_plan(plan)
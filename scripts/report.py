@@ -0,0 +1,134 @@
+import argparse
+import datetime
+import os
+import sys
+from typing import List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+from run_history import RunHistory, get_run_history_file_path
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    # Format a duration as h:mm:ss
+    if seconds is None:
+        return "-"
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+def format_bytes(value: Optional[float]) -> str:
+    # Format a byte amount with a binary unit
+    if value is None:
+        return "-"
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(value) < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TiB"
+
+
+def format_value(value) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.1f}"
+    return str(value)
+
+
+def print_table(title: str, header: List[str], rows: List[List[str]], empty_message: str = "No runs recorded") -> None:
+    # Print the rows as a table with aligned columns
+    print(title)
+    print("=" * len(title))
+    if len(rows) == 0:
+        print(f"{empty_message}\n")
+        return
+    column_widths = [max(len(row[column]) for row in [header] + rows) for column in range(len(header))]
+    for row in [header, ['-' * width for width in column_widths]] + rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, column_widths)).rstrip())
+    print()
+
+
+def print_report(run_history: RunHistory, days: int, dataset_name: Optional[str], limit: int) -> None:
+    since = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat(timespec='seconds')
+
+    # Where does the time go? Stages sorted by their total wall time.
+    print_table(
+        f"Stages of the last {days} day(s)",
+        ['Stage', 'Runs', 'Avg time', 'Total time', 'Avg cpu time', 'Max peak memory', 'Avg read', 'Avg write'],
+        [
+            [
+                row['stage_name'], str(row['runs']), format_duration(row['wall_time']), format_duration(row['total_wall_time']),
+                format_duration(row['cpu_time']), format_bytes(row['peak_rss']), format_bytes(row['read_bytes']), format_bytes(row['write_bytes'])
+            ]
+            for row in run_history.get_stage_summary(since)
+        ]
+    )
+
+    # Throughput per day
+    print_table(
+        f"Datasets per day of the last {days} day(s)",
+        ['Day', 'Mode', 'Status', 'Datasets', 'Avg time', 'Avg images'],
+        [
+            [row['day'], row['helper_mode'], row['status'], str(row['runs']), format_duration(row['wall_time']), format_value(row['image_count'])]
+            for row in run_history.get_daily_summary(since)
+        ]
+    )
+
+    # Encode time and size saving of the processed textures (process_textures stage)
+    texture_summary = run_history.get_texture_summary(since)
+    if len(texture_summary) > 0:
+        print_table(
+            f"Textures of the last {days} day(s)",
+            ['Format', 'Mip level', 'Files', 'Avg encode time', 'Total encode time', 'Avg size', 'Saving'],
+            [
+                [
+                    row['format'], str(row['mip_level']), str(row['files']), f"{row['encode_time']:.2f} s", format_duration(row['total_encode_time']),
+                    format_bytes(row['bytes']), f"{row['saving'] * 100:.0f} %" if row['saving'] is not None else "-"
+                ]
+                for row in texture_summary
+            ]
+        )
+
+    # Latest dataset runs with the stages of the latest run
+    dataset_runs = run_history.get_dataset_runs(dataset_name, limit)
+    print_table(
+        f"Latest dataset runs" + (f" of {dataset_name}" if dataset_name is not None else ""),
+        ['Started', 'Dataset', 'Mode', 'Host', 'Status', 'Images', 'Time', 'Cpu time', 'Peak memory', 'Faces', 'Disk', 'Peak disk', 'Settings'],
+        [
+            [
+                row['started_at'], row['dataset_name'], row['helper_mode'], format_value(row['host']), row['status'],
+                format_value(row['image_count']), format_duration(row['wall_time']), format_duration(row['cpu_time']),
+                format_bytes(row['peak_rss']), format_value(row['face_count']), format_bytes(row['disk_bytes']), format_bytes(row['peak_disk_bytes']), format_value(row['settings_hash'])
+            ]
+            for row in dataset_runs
+        ]
+    )
+    if len(dataset_runs) > 0:
+        latest_run = dataset_runs[0]
+        print_table(
+            f"Stages of {latest_run['dataset_name']} ({latest_run['helper_mode']}, {latest_run['started_at']})",
+            ['#', 'Stage', 'Time', 'Cpu time', 'Peak memory', 'Read', 'Write', 'Faces'],
+            [
+                [
+                    format_value(row['stage_number']), row['stage_name'], format_duration(row['wall_time']), format_duration(row['cpu_time']),
+                    format_bytes(row['peak_rss']), format_bytes(row['read_bytes']), format_bytes(row['write_bytes']), format_value(row['face_count'])
+                ]
+                for row in run_history.get_stage_runs(latest_run['id'])
+            ]
+        )
+
+
+if __name__ == "__main__":
+    # Read the arguments
+    parser = argparse.ArgumentParser(description="Shows the summaries of the run history recorded by the helpers.")
+    parser.add_argument('--days', type=int, default=7, help="Summarize the runs of the last days (default: 7)")
+    parser.add_argument('--dataset', default=None, help="Only list the runs of this dataset")
+    parser.add_argument('--limit', type=int, default=10, help="Amount of dataset runs to list (default: 10)")
+    arguments = parser.parse_args()
+
+    # Check if there is a run history
+    run_history_file_path = get_run_history_file_path()
+    if not os.path.isfile(run_history_file_path):
+        print(f"No run history found at '{run_history_file_path}' (is use_run_history enabled?)")
+        sys.exit(1)
+
+    print_report(RunHistory(run_history_file_path), arguments.days, arguments.dataset, arguments.limit)
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+from typing import List, Tuple
+
+class Checkpoint():
+    def __init__(self, checkpoint_file_path: str) -> None:
+        self.checkpoint_file_path = checkpoint_file_path
+        self.completed_stages = self.load()
+
+
+    def create_stage_hashes(self, stage_inputs: List[Tuple[str, dict]]) -> List[Tuple[str, str]]:
+        """
+        This method creates a hash for every stage from its inputs (settings and dataset values) and the hash of the
+        previous stage. If the inputs of a stage change, the hashes of the stage and all following stages change.
+        """
+        stage_hashes = []
+        previous_hash = ''
+        for stage_name, inputs in stage_inputs:
+            stage_hash = hashlib.sha256(
+                json.dumps([previous_hash, stage_name, inputs], sort_keys=True, default=str).encode()
+            ).hexdigest()
+            stage_hashes.append((stage_name, stage_hash))
+            previous_hash = stage_hash
+        return stage_hashes
+
+
+    def get_completed_stage_count(self, stage_hashes: List[Tuple[str, str]]) -> int:
+        """
+        This method returns how many stages (from the start) have been completed with the same inputs.
+        The document can be resumed from the first stage that is not completed.
+        """
+        completed_stage_count = 0
+        for (stage_name, stage_hash), completed_stage in zip(stage_hashes, self.completed_stages):
+            if completed_stage != [stage_name, stage_hash]:
+                break
+            completed_stage_count += 1
+        return completed_stage_count
+
+
+    def complete_stage(self, stage_name: str, stage_hash: str) -> None:
+        """
+        This method records a completed stage. Must only be called after the document has been saved.
+        """
+        self.completed_stages.append([stage_name, stage_hash])
+        self.save()
+
+
+    def truncate(self, completed_stage_count: int) -> None:
+        """
+        This method forgets all stages after the given amount of completed stages (they are calculated again).
+        """
+        self.completed_stages = self.completed_stages[:completed_stage_count]
+        self.save()
+
+
+    def load(self) -> List[List[str]]:
+        """
+        This method loads the completed stages. A missing or broken checkpoint file results in no completed stages.
+        """
+        try:
+            with open(self.checkpoint_file_path, "r") as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            return [list(completed_stage) for completed_stage in checkpoint['completed_stages']]
+        except (OSError, ValueError, KeyError, TypeError):
+            return []
+
+
+    def save(self) -> None:
+        """
+        This method writes the checkpoint file atomically so that a crash cannot corrupt it.
+        """
+        os.makedirs(os.path.dirname(self.checkpoint_file_path), exist_ok=True)
+        temporary_checkpoint_file_path = f"{self.checkpoint_file_path}.tmp"
+        with open(temporary_checkpoint_file_path, "w") as checkpoint_file:
+            json.dump({'completed_stages': self.completed_stages}, checkpoint_file)
+        os.replace(temporary_checkpoint_file_path, self.checkpoint_file_path)
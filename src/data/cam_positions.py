@@ -0,0 +1,106 @@
+import os
+import sys
+from typing import List, Optional
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from settings.settings import settings
+
+class CamPositions():
+    def __init__(self, labels: np.ndarray, positions: np.ndarray) -> None:
+        # Camera labels (n) and camera positions (n x 3) in the order of the cam position file
+        self.labels    = labels
+        self.positions = positions
+
+    @classmethod
+    def load(cls, cam_pos_file_path: str) -> 'CamPositions':
+        """
+        This method parses a cam position file with the columns label, x, y, z (nxyz) and one header row.
+        The labels are normalized to image names without extension (like the camera labels in Metashape).
+        Raises a ValueError if the file cannot be parsed.
+        """
+        with open(cam_pos_file_path, 'r') as cam_pos_file:
+            rows = cam_pos_file.read().split('\n')[1:]
+        columns = np.array([row.split() for row in rows if row.strip() != ''], dtype=str)
+        if columns.size == 0:
+            return cls(np.empty(0, dtype=str), np.empty((0, 3)))
+        if columns.ndim != 2 or columns.shape[1] < 4:
+            raise ValueError("expected 4 columns (nxyz) in every row")
+
+        # Remove image extensions from the labels
+        labels = np.array([cls.get_label(label) for label in columns[:, 0]], dtype=str)
+        positions = columns[:, 1:4].astype(np.float64)
+        return cls(labels, positions)
+
+    @staticmethod
+    def get_label(image_path: str) -> str:
+        """
+        This method returns the camera label of an image path (file name without image extension).
+        """
+        image_name = os.path.basename(image_path)
+        image_stem, image_extension = os.path.splitext(image_name)
+        if image_extension.lower() in settings['image_extensions']:
+            return image_stem
+        return image_name
+
+    def get_position(self, label: str) -> Optional[np.ndarray]:
+        """
+        This method returns the position of the camera with the given label or None if it has no position.
+        """
+        indices = np.flatnonzero(self.labels == label)
+        if len(indices) == 0:
+            return None
+        return self.positions[indices[0]]
+
+    def get_positions(self, image_paths: List[str]) -> np.ndarray:
+        """
+        This method returns the positions of the given images (n x 3). Images without a position get NaN.
+        """
+        image_labels = np.array([self.get_label(image_path) for image_path in image_paths], dtype=str)
+        sorter = np.argsort(self.labels)
+        indices = np.searchsorted(self.labels, image_labels, sorter=sorter)
+        indices = sorter[np.clip(indices, 0, max(len(self.labels) - 1, 0))]
+        positions = np.full((len(image_paths), 3), np.nan)
+        if len(self.labels) > 0:
+            has_position = self.labels[indices] == image_labels
+            positions[has_position] = self.positions[indices[has_position]]
+        return positions
+
+    def validate(self, image_paths: List[str], needed_image_count: Optional[int]) -> List[str]:
+        """
+        This method checks the cam positions against the images of the dataset and returns the problems found.
+        """
+        reasons = []
+
+        # Row count
+        if needed_image_count is not None and len(self.labels) != needed_image_count:
+            reasons.append(f"cam position file has {len(self.labels)} instead of {needed_image_count} rows")
+
+        # Duplicate labels
+        unique_labels, label_counts = np.unique(self.labels, return_counts=True)
+        duplicate_labels = unique_labels[label_counts > 1]
+        if len(duplicate_labels) > 0:
+            reasons.append(f"cam position file has duplicate labels ({', '.join(duplicate_labels[:5])})")
+
+        # Invalid positions (NaN or infinite)
+        invalid_rows = ~np.isfinite(self.positions).all(axis=1)
+        if invalid_rows.any():
+            reasons.append(f"cam position file has invalid positions ({', '.join(self.labels[invalid_rows][:5])})")
+
+        # Duplicate positions
+        if len(self.positions) > 0:
+            _, position_counts = np.unique(self.positions, axis=0, return_counts=True)
+            duplicate_position_count = int((position_counts[position_counts > 1]).sum())
+            if duplicate_position_count > 0:
+                reasons.append(f"cam position file has {duplicate_position_count} cameras with duplicate positions")
+
+        # Labels without image and images without label
+        image_labels = np.array([self.get_label(image_path) for image_path in image_paths], dtype=str)
+        labels_without_image = np.setdiff1d(self.labels, image_labels)
+        images_without_label = np.setdiff1d(image_labels, self.labels)
+        if len(labels_without_image) > 0:
+            reasons.append(f"{len(labels_without_image)} cam position label(s) have no image ({', '.join(labels_without_image[:5])})")
+        if len(images_without_label) > 0:
+            reasons.append(f"{len(images_without_label)} image(s) have no cam position ({', '.join(images_without_label[:5])})")
+
+        return reasons
@@ -1,9 +1,10 @@
 from enum import Enum
 import sys, os
-from typing import List, Tuple
+from typing import Callable, List, Optional, Tuple
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from settings.settings import settings
+from data.cam_positions import CamPositions
 
 class HelperMode(Enum):
     CALCULATION = 1
@@ -20,10 +21,8 @@ class Dataset:
             scan_info_file_path : str,
             psx_file_path : str,
             obj_file_path : str,
-            images : List[str],
-            f_number : float,
-            image_size : Tuple[int],
-            needed_image_count: int
+            metadata_loader : Optional[Callable[['Dataset', str], None]] = None,
+            metadata : Optional[dict] = None
         ):
 
         self.name = name
@@ -34,10 +33,54 @@ class Dataset:
         self.scan_info_file_path = scan_info_file_path
         self.psx_file_path = psx_file_path
         self.obj_file_path = obj_file_path
-        self.images = images
-        self.f_number = f_number
-        self.image_size = image_size
-        self.needed_image_count = needed_image_count
+        self.checkpoint_file_path = os.path.join(model_folder_path, f"{name}.checkpoint.json")
+
+        # Lock file that Metashape creates while the document is opened
+        self.lock_file_path = os.path.join(model_folder_path, f"{name}.files", "lock")
+
+        # The metadata (images, f_number, image_size, ...) is only loaded when it is accessed the first time.
+        # The metadata loader has to store the requested field (and may store more fields) in the metadata.
+        self.metadata_loader = metadata_loader
+        self.metadata = dict(metadata) if metadata is not None else {}
+
+        # Fingerprint of the dataset folder when its metadata was loaded (used by the discovery index)
+        self.fingerprint = None
+
+    def get_metadata(self, field: str):
+        # Load the field if it has not been loaded yet
+        if field not in self.metadata:
+            if self.metadata_loader is None:
+                raise KeyError(f"Metadata '{field}' of dataset {self.name} is not available")
+            self.metadata_loader(self, field)
+        return self.metadata[field]
+
+    @property
+    def images(self) -> List[str]:
+        return self.get_metadata('images')
+
+    @images.setter
+    def images(self, images: List[str]):
+        self.metadata['images'] = images
+
+    @property
+    def f_number(self) -> Optional[float]:
+        return self.get_metadata('f_number')
+
+    @property
+    def image_size(self) -> Optional[Tuple[int, int]]:
+        return self.get_metadata('image_size')
+
+    @property
+    def needed_image_count(self) -> Optional[int]:
+        return self.get_metadata('needed_image_count')
+
+    @property
+    def cam_positions(self) -> Optional[CamPositions]:
+        return self.get_metadata('cam_positions')
+
+    @property
+    def mismatched_images(self) -> List[str]:
+        return self.get_metadata('mismatched_images')
 
     def has_valid_name(self) -> bool:
         # Check if the name is valid
@@ -49,42 +92,82 @@ class Dataset:
         has_valid_name = (use_folder_prefix and prefix_in_name) or not use_folder_prefix
         return has_valid_name
 
+    def uses_fused_export(self) -> bool:
+        # Check if the dataset is exported right after the calculation (no manual unpinning between the two)
+        return any(self.name.startswith(prefix) for prefix in settings.get('fused_export_prefixes'))
+
 
     def is_complete(self, mode: HelperMode) -> bool:
-        has_valid_name        = self.has_valid_name()
-        cam_pos_file_exists   = os.path.isfile(self.cam_pos_file_path)
-        scan_info_file_exists = os.path.isfile(self.scan_info_file_path)
-        has_f_number          = self.f_number is not None
-        has_images            = len(self.images) > 0
-        has_image_size        = self.image_size is not None
-        has_needed_images     = len(self.images) == self.needed_image_count
-        psx_file_exists       = os.path.isfile(self.psx_file_path)
-        in_use                = self.in_use()
+        # The dataset is complete if there is no reason against it
+        is_complete = len(self.get_incompleteness_reasons(mode)) == 0
+        return is_complete
+
+    def get_incompleteness_reasons(self, mode: HelperMode) -> List[str]:
+        # The checks are ordered by their cost and the first failing group returns its reasons.
+        # That way an incomplete dataset is mostly rejected with a few stat calls and the metadata is never loaded.
+        reasons = []
+
+        # Name prefix (no file access)
+        if not self.has_valid_name():
+            reasons.append("name has no valid prefix")
+            return reasons
 
-        # Check if the dataset has the needed things to be calculated
-        if mode == HelperMode.CALCULATION:
-            is_complete =  all([
-                has_valid_name,
-                cam_pos_file_exists,
-                scan_info_file_exists,
-                has_f_number,
-                has_images, 
-                has_image_size,
-                has_needed_images,
-                not psx_file_exists or psx_file_exists and not in_use
-            ])
         # Check if the dataset has the needed things to be exported
         if mode == HelperMode.EXPORT:
-            is_complete =  all([
-                has_valid_name,
-                psx_file_exists,
-                not in_use,
-            ])
-       
-        return is_complete
+            if not os.path.isfile(self.psx_file_path):
+                reasons.append("psx file is missing")
+            elif self.in_use():
+                reasons.append("document is in use")
+            return reasons
+
+        # Check if the dataset has the needed things to be calculated
+        # File existence (stat calls)
+        if not os.path.isfile(self.cam_pos_file_path):
+            reasons.append("cam position file is missing")
+        if not os.path.isfile(self.scan_info_file_path):
+            reasons.append("scan information file is missing")
+        if len(reasons) > 0:
+            return reasons
+
+        # Lock state (stat calls)
+        if os.path.isfile(self.psx_file_path) and self.in_use():
+            reasons.append("document is in use")
+            return reasons
+
+        # Image count (directory listing)
+        if len(self.images) == 0:
+            reasons.append("no images found")
+            return reasons
+
+        # Scan information (pdf, cached)
+        if self.f_number is None:
+            reasons.append("f number could not be extracted")
+        if len(self.images) != self.needed_image_count:
+            reasons.append(f"{len(self.images)} of {self.needed_image_count} images found")
+        if len(reasons) > 0:
+            return reasons
+
+        # Image size (header of the first image)
+        if self.image_size is None:
+            reasons.append("image size could not be read")
+            return reasons
+
+        # Cam positions (small text file)
+        if self.cam_positions is None:
+            reasons.append("cam position file could not be parsed")
+            return reasons
+        reasons.extend(self.cam_positions.validate(self.images, self.needed_image_count))
+        if len(reasons) > 0:
+            return reasons
+
+        # Uniform image sizes (headers of all images)
+        if len(self.mismatched_images) > 0:
+            mismatched_image_names = ', '.join(os.path.basename(image) for image in self.mismatched_images[:5])
+            reasons.append(f"{len(self.mismatched_images)} image(s) differ from the image size {self.image_size} ({mismatched_image_names})")
+
+        return reasons
     
     def in_use(self)-> bool:
         # Check if there is a lock file inside the model.files foler. If one exists the document is in use.
-        lockfile_path = os.path.join(self.model_folder_path, f"{self.name}.files", "lock")
-        in_use = os.path.isfile(lockfile_path)
+        in_use = os.path.isfile(self.lock_file_path)
         return in_use
@@ -0,0 +1,7 @@
+class DatasetRejectedError(Exception):
+    def __init__(self, dataset_name: str, reason: str):
+        self.dataset_name = dataset_name
+        self.reason = reason
+
+        self.message = f"Dataset {dataset_name} rejected: {reason}"
+        super().__init__(self.message)
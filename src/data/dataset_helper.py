@@ -1,14 +1,16 @@
 from enum import Enum
 import sys, os
-import re
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Tuple, Union
-from PIL import Image
-from PyPDF2 import PdfReader
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from settings.settings import settings
+from data.cam_positions import CamPositions
 from data.dataset import Dataset, HelperMode
+from data.discovery_index import DiscoveryIndex
+from data.image_size_prober import ImageSizeProber
+from data.scan_info_parser import ScanInfoParser
 from logger import Logger
 
 class DatasetHelper():
@@ -24,6 +26,20 @@ class DatasetHelper():
         self.output_folder = output_folder
         self.helper_mode   = helper_mode
 
+        # Create the scan info parser with its persistent cache
+        scan_info_cache_file_path = os.path.join(settings['cache_folder_path'], 'scan_info_cache.json')
+        self.scan_info_parser = ScanInfoParser(scan_info_cache_file_path)
+
+        # Create the image size prober which reads the image headers only
+        self.image_size_prober = ImageSizeProber(settings['image_probe_worker_count'])
+
+        # Create the discovery index which stores the metadata of unchanged datasets (one index per helper mode)
+        discovery_index_file_path = os.path.join(settings['cache_folder_path'], f'discovery_index_{helper_mode.name.lower()}.json')
+        self.discovery_index = DiscoveryIndex(discovery_index_file_path)
+
+        # Shared job queue (set if several helpers process the same input folder, used to detect stale lock files)
+        self.job_queue = None
+
 
     def get_available_datasets(self) -> List[Dataset]:
         """
@@ -36,34 +52,78 @@ class DatasetHelper():
         # Create empty list for the available datasets
         available_dataset_objects = []
 
-        # Loop through everything in the input folder (files/folders)
-        for dataset_name in os.listdir(self.input_folder):
-            # Create the full path of the dataset
-            dataset_path = os.path.join(self.input_folder, dataset_name)
-
-            # Check if the created path is a directory
-            if os.path.isdir(dataset_path):
-                # Create a dataset object
-                dataset = self.create_dataset_object(dataset_path)
-
-                # Check if the dataset object is complete for the respective mode
-                dataset_is_complete = dataset.is_complete(self.helper_mode)
-                if dataset_is_complete:
-                    self.logger.log(f"  {dataset_name} is complete")
-                    # Append the complete dataset to the list
-                    available_dataset_objects.append(dataset)
-                else:
-                    self.logger.log(f"  {dataset_name} is incomplete")
+        # Log the completeness of every dataset in order
+        for dataset, incompleteness_reasons in self.evaluate_datasets():
+            if len(incompleteness_reasons) == 0:
+                self.logger.log(f"  {dataset.name} is complete")
+                # Append the complete dataset to the list
+                available_dataset_objects.append(dataset)
+            else:
+                self.logger.log(f"  {dataset.name} is incomplete: {'; '.join(incompleteness_reasons)}")
 
         self.logger.log(f"Total available datasets: {len(available_dataset_objects)}")
         return available_dataset_objects
 
+
+    def evaluate_datasets(self) -> List[Tuple[Dataset, List[str]]]:
+        """
+        This method evaluates every dataset folder in the input folder and returns the datasets together with the
+        reasons why they are incomplete (see evaluate_dataset), sorted by name.
+        """
+        # Collect the paths of all directories in the input folder (files are skipped)
+        dataset_paths = []
+        for dataset_name in sorted(os.listdir(self.input_folder)):
+            dataset_path = os.path.join(self.input_folder, dataset_name)
+            if os.path.isdir(dataset_path):
+                dataset_paths.append(dataset_path)
+
+        # Create and check the datasets concurrently. The results keep the order of the dataset paths.
+        discovery_worker_count = max(1, min(settings.get('discovery_worker_count'), len(dataset_paths) or 1))
+        with ThreadPoolExecutor(max_workers=discovery_worker_count) as executor:
+            evaluated_datasets = list(executor.map(self.evaluate_dataset, dataset_paths))
+
+        # Store the parsed scan informations and the discovery index for the next run
+        self.save_caches(dataset_paths)
+        return evaluated_datasets
+
     
+    def save_caches(self, dataset_paths: List[str]) -> None:
+        """
+        This method stores the scan info cache and the discovery index. Index entries of datasets that are not
+        in the given dataset paths anymore are removed.
+        """
+        self.scan_info_parser.save_cache()
+        self.discovery_index.remove_missing(dataset_paths, self.input_folder)
+        self.discovery_index.save_index()
+
+
+    def evaluate_dataset(self, dataset_path: str) -> Tuple[Dataset, List[str]]:
+        """
+        This method creates the dataset object of the given dataset_path and returns it together with the reasons why
+        it is incomplete for the helper mode (empty if it is complete).
+        It is executed by the discovery workers and must therefore not depend on any shared state except the caches.
+        """
+        dataset = self.create_dataset_object(dataset_path)
+
+        # Remove lock files left by crashed helpers (only the job queue knows which locks belong to its claims)
+        if self.job_queue is not None and dataset.in_use():
+            self.job_queue.remove_stale_lock(dataset)
+
+        incompleteness_reasons = dataset.get_incompleteness_reasons(self.helper_mode)
+
+        # Store the metadata that has been loaded during the checks in the discovery index
+        if dataset.fingerprint is not None:
+            self.discovery_index.update(dataset_path, dataset.fingerprint, dataset.metadata)
+
+        return dataset, incompleteness_reasons
+
+
     def create_dataset_object(self, dataset_path: str) -> Dataset:
         """
         This method creates a new Dataset object from the given dataset_path. No checks are made to ensure the dataset 
-        exists. To determine whether the dataset is complete and can be used for calculation or export, use the methods 
-        dataset.is_complete_for_calculation() and dataset.is_complete_for_export(), respectively.
+        exists and no files are read. The metadata (images, f number, image size, ...) is loaded lazily by
+        load_dataset_metadata when it is accessed. To determine whether the dataset is complete and can be used for
+        calculation or export, use the method dataset.is_complete(mode).
         """
         # Get all the needed dataset attributes 
         dataset_name        = os.path.basename(dataset_path)
@@ -73,11 +133,6 @@ class DatasetHelper():
         scan_info_file_path = os.path.join(dataset_path, settings['scan_info_file_path'])
         psx_file_path       = os.path.join(model_folder_path, f"{dataset_name}.psx")
         obj_file_path       = os.path.join(model_folder_path, f"{dataset_name}.obj")
-        f_number            = self.get_f_number(scan_info_file_path)
-        image_paths         = self.get_image_paths(image_folder_path)
-        image_size          = self.get_first_image_size(image_paths)
-        needed_image_count  = self.get_needed_image_count(scan_info_file_path)
-        
 
         # Create dataset object with the attributes
         dataset = Dataset(
@@ -89,13 +144,48 @@ class DatasetHelper():
             scan_info_file_path,
             psx_file_path,
             obj_file_path,
-            image_paths,
-            f_number,
-            image_size,
-            needed_image_count,
+            self.load_dataset_metadata,
         )
         return dataset
-    
+
+
+    def load_dataset_metadata(self, dataset: Dataset, field: str) -> None:
+        """
+        This method loads a metadata field of the dataset. On the first access the metadata is taken from the discovery
+        index if the dataset did not change since the last run. Fields that are not indexed are read from the files.
+        """
+        # Look up the dataset in the discovery index on the first access
+        if settings.get('use_discovery_index') and dataset.fingerprint is None:
+            dataset.fingerprint = self.discovery_index.create_fingerprint(
+                dataset.basepath,
+                dataset.image_folder_path,
+                [dataset.cam_pos_file_path, dataset.scan_info_file_path]
+            )
+            indexed_metadata = self.discovery_index.get(dataset.basepath, dataset.fingerprint)
+            if indexed_metadata is not None:
+                if indexed_metadata.get('image_size') is not None:
+                    indexed_metadata['image_size'] = tuple(indexed_metadata['image_size'])
+                dataset.metadata.update(indexed_metadata)
+            if field in dataset.metadata:
+                return
+
+        # Read the field from the dataset files
+        if field == 'images':
+            dataset.metadata['images'] = self.get_image_paths(dataset.image_folder_path)
+        elif field in ('f_number', 'needed_image_count'):
+            dataset.metadata.update(self.scan_info_parser.parse(dataset.scan_info_file_path))
+        elif field == 'image_size':
+            dataset.metadata['image_size'] = self.get_first_image_size(dataset.images)
+        elif field == 'cam_positions':
+            try:
+                dataset.metadata['cam_positions'] = CamPositions.load(dataset.cam_pos_file_path)
+            except (OSError, ValueError):
+                dataset.metadata['cam_positions'] = None
+        elif field == 'mismatched_images':
+            dataset.metadata['mismatched_images'] = self.get_mismatched_images(dataset.images, dataset.image_size)
+        else:
+            raise KeyError(f"Unknown dataset metadata '{field}'")
+
 
     def get_image_paths(self, image_folder_path: str) -> List[str]:
         """
@@ -111,84 +201,41 @@ class DatasetHelper():
         return image_paths
 
 
-    def get_needed_image_count(self, scan_info_file_path: str) -> Optional[int]:
-        """
-        This method is used to extract the needed image count from the scan information pdf. 
-        If the num images could not be extracted or it is 0 it returns None.
-        """
-        try:
-            with open(scan_info_file_path, "rb") as pdf_file:
-                pdf_reader = PdfReader(pdf_file)
-                pdf_text = pdf_reader.pages[0].extract_text()
-            cleaned_pdf_text = self.clean_pdf_text(pdf_text)
-            match = re.search(settings.get('num_images_regex'), cleaned_pdf_text)
-            if match:
-                num_images = int(match.group(1))
-                if num_images > 0:
-                    return num_images
-        except:
-            pass
-        return None
-    
-
     def get_first_image_size(self, image_paths: List[str]) -> Optional[Tuple[int, int]]:
         """
-        This method is used to retrieve the size of the first image.
-        If the image size cannot be accessed or is not a tuple of two integers, it returns None.
-        """
-        try:
-            # Open the first image and get the image size (width, height)
-            with Image.open(image_paths[0]) as image:
-                width, height = image.size
-                if isinstance(width, int) and isinstance(height, int):
-                    return width, height
-        except:
-            pass
-        return None
-
-
-    def get_f_number(self, scan_info_file_path) -> Optional[float]:
-        """
-        This method is used extract the f number from the scan information file 
-        """
-        try:
-            with open(scan_info_file_path, "rb") as pdf_file:
-                pdf_reader = PdfReader(pdf_file)
-                pdf_text = pdf_reader.pages[0].extract_text()
-            cleaned_pdf_text = self.clean_pdf_text(pdf_text)
-            match = re.search(settings.get('f_number_regex'), cleaned_pdf_text)
-            if match:
-                return float(match.group(1))
-        except Exception as e:
-            pass
-        return None
-    
-    
-    def clean_pdf_text(self, pdf_text: str) -> str:
+        This method is used to retrieve the size of the first image. Only the image header is read.
+        If the image size cannot be accessed it returns None.
         """
-        This method is used to remove \n (newline) and unnecessary spaces from pdf text.
-        """
-        # replace all \n with a space
-        cleaned_pdf_text = re.sub('\n', ' ', pdf_text)
-        # replace all multiple spaces with one space
-        cleaned_pdf_text = re.sub(' +', ' ', cleaned_pdf_text)
+        if len(image_paths) == 0:
+            return None
+        return self.image_size_prober.get_image_size(image_paths[0])
 
-        # replace all spaces after colon
-        cleaned_pdf_text = re.sub(r":\s+", ":", cleaned_pdf_text)
 
-        return cleaned_pdf_text
+    def get_mismatched_images(self, image_paths: List[str], image_size: Optional[Tuple[int, int]]) -> List[str]:
+        """
+        This method returns all images whose size differs from the size of the first image.
+        If the size of the first image is unknown, no images are reported because the dataset is incomplete anyway.
+        """
+        if image_size is None:
+            return []
+        return self.image_size_prober.get_mismatched_images(image_paths, image_size)
 
 
     def move_dataset(self, dataset: Dataset) -> None:
         """
-        This method is used to move processed datasets into the output folder
+        This method is used to move processed datasets into the output folder. Calculated datasets with a fused export
+        prefix have already been exported and are moved to the export output folder.
         """
+        output_folder = self.output_folder
+        if self.helper_mode == HelperMode.CALCULATION and dataset.uses_fused_export():
+            output_folder = settings.get('export_output_folder_path')
+
         # Check if the dataset path is a directory
         if not os.path.isdir(dataset.basepath):
             raise ValueError("The dataset path does not exist or is not a directory")
         # Check if the output folder path is a directory
-        if not os.path.isdir(self.output_folder):
+        if not os.path.isdir(output_folder):
             raise ValueError("The output folder does not exist or is not a directory")
         # Move the dataset to the output folder
-        shutil.move(dataset.basepath, self.output_folder)
-        self.logger.log(f"   Dataset moved to '{self.output_folder}'")
+        shutil.move(dataset.basepath, output_folder)
+        self.logger.log(f"   Dataset moved to '{output_folder}'")
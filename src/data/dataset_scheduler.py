@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+from typing import Dict, List
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from settings.settings import settings
+from data.dataset import Dataset, HelperMode
+from eta_model import EtaModel, format_eta
+from logger import Logger
+
+class DatasetScheduler():
+    def __init__(self, eta_model: EtaModel, helper_mode: HelperMode, logger: Logger) -> None:
+        self.eta_model   = eta_model
+        self.helper_mode = helper_mode
+        self.logger      = logger
+
+
+    def order(self, datasets: List[Dataset], log_order: bool = True) -> List[Dataset]:
+        """
+        This method returns the datasets in the order they should be processed (see schedule_policy):
+            shortest_job_first -> shortest predicted duration first (from the run history or the amount of pixels)
+            oldest_first       -> the dataset that has been scanned first
+            prefix_priority    -> in the order of schedule_prefix_priorities, then oldest first
+            priority_file      -> in the order of the names in schedule_priority_file_path, then oldest first
+            name               -> sorted by name
+        Datasets that have been waiting longer than schedule_max_wait_hours always come first (oldest first), so large
+        datasets cannot be postponed forever.
+        """
+        if len(datasets) == 0:
+            return []
+
+        schedule_policy = settings.get('schedule_policy')
+        ages = {dataset.name: self.get_age(dataset) for dataset in datasets}
+        costs = self.get_costs(datasets) if schedule_policy == 'shortest_job_first' else {}
+
+        if schedule_policy == 'shortest_job_first':
+            sort_keys = {dataset.name: (costs[dataset.name], -ages[dataset.name]) for dataset in datasets}
+        elif schedule_policy == 'oldest_first':
+            sort_keys = {dataset.name: (-ages[dataset.name],) for dataset in datasets}
+        elif schedule_policy == 'prefix_priority':
+            sort_keys = {dataset.name: (self.get_prefix_rank(dataset), -ages[dataset.name]) for dataset in datasets}
+        elif schedule_policy == 'priority_file':
+            priorities = self.read_priority_file()
+            sort_keys = {dataset.name: (priorities.get(dataset.name, len(priorities)), -ages[dataset.name]) for dataset in datasets}
+        else:
+            sort_keys = {dataset.name: (dataset.name,) for dataset in datasets}
+
+        # Overdue datasets first (oldest first), then the datasets in the order of the policy
+        max_wait_seconds = settings.get('schedule_max_wait_hours') * 3600
+        is_overdue = lambda dataset: max_wait_seconds > 0 and ages[dataset.name] > max_wait_seconds
+        ordered_datasets = sorted(
+            datasets,
+            key=lambda dataset: (0, -ages[dataset.name]) if is_overdue(dataset) else (1, *sort_keys[dataset.name], dataset.name)
+        )
+
+        # Log the order
+        if log_order:
+            self.logger.log(f"Dataset order ({schedule_policy}):")
+            for dataset_number, dataset in enumerate(ordered_datasets, 1):
+                details = [f"waiting {format_eta(ages[dataset.name])}"]
+                if dataset.name in costs:
+                    details.append(f"cost {self.format_cost(costs[dataset.name])}")
+                if is_overdue(dataset):
+                    details.append("overdue")
+                self.logger.log(f"  {dataset_number}. {dataset.name} ({', '.join(details)})")
+
+        return ordered_datasets
+
+
+    def get_costs(self, datasets: List[Dataset]) -> Dict[str, float]:
+        """
+        This method returns the predicted duration (seconds) of every dataset. If a duration cannot be predicted
+        (e.g. no run history), the amount of pixels (megapixels of all images) is used for all datasets instead.
+        """
+        predicted_durations = {}
+        for dataset in datasets:
+            stage_durations = [duration for _, duration in self.eta_model.predict_dataset(dataset, self.helper_mode)]
+            predicted_durations[dataset.name] = sum(stage_durations) if None not in stage_durations else None
+
+        if None not in predicted_durations.values():
+            self.cost_unit = 'duration'
+            return predicted_durations
+
+        self.cost_unit = 'megapixels'
+        costs = {}
+        for dataset in datasets:
+            image_width, image_height = dataset.image_size if dataset.image_size is not None else (0, 0)
+            costs[dataset.name] = len(dataset.images) * image_width * image_height / 1e6
+        return costs
+
+
+    def format_cost(self, cost: float) -> str:
+        if self.cost_unit == 'duration':
+            return format_eta(cost)
+        return f"{cost:.0f} megapixels"
+
+
+    def get_age(self, dataset: Dataset) -> float:
+        """
+        This method returns the seconds since the dataset has been scanned (modification time of the scan information,
+        which is written at the end of the scan) or since the dataset folder changed.
+        """
+        for path in [dataset.scan_info_file_path, dataset.basepath]:
+            try:
+                return max(time.time() - os.stat(path).st_mtime, 0.0)
+            except OSError:
+                pass
+        return 0.0
+
+
+    def get_prefix_rank(self, dataset: Dataset) -> int:
+        # Position of the first matching prefix in schedule_prefix_priorities (datasets without a prefix come last)
+        prefix_priorities = settings.get('schedule_prefix_priorities')
+        for prefix_rank, prefix in enumerate(prefix_priorities):
+            if dataset.name.startswith(prefix):
+                return prefix_rank
+        return len(prefix_priorities)
+
+
+    def read_priority_file(self) -> Dict[str, int]:
+        """
+        This method reads the priority file (one dataset name per line, the first line has the highest priority, lines
+        starting with # are ignored). The file is read on every call, so it can be changed while the helper is running.
+        """
+        priorities = {}
+        try:
+            with open(settings.get('schedule_priority_file_path'), 'r') as priority_file:
+                for line in priority_file:
+                    dataset_name = line.strip()
+                    if dataset_name != '' and not dataset_name.startswith('#') and dataset_name not in priorities:
+                        priorities[dataset_name] = len(priorities)
+        except OSError as e:
+            self.logger.log(f"Priority file could not be read: {e}")
+        return priorities
@@ -0,0 +1,231 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from settings.settings import settings
+from data.dataset import Dataset
+from data.dataset_helper import DatasetHelper
+from data.dataset_scheduler import DatasetScheduler
+from logger import Logger
+
+# inotify flags (see /usr/include/sys/inotify.h)
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_NONBLOCK    = 0x00000800
+IN_CLOEXEC     = 0x00080000
+IN_WATCH_MASK  = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+class PollingChangeNotifier():
+    """
+    Fallback change notifier which simply waits for the poll interval.
+    """
+    def __init__(self, folder_path: str) -> None:
+        self.folder_path = folder_path
+
+    def wait_for_changes(self, timeout: float) -> None:
+        time.sleep(timeout)
+
+
+class InotifyChangeNotifier():
+    """
+    Change notifier which uses inotify (linux only) to wake up as soon as something changes in the watched folder,
+    its dataset folders or their sub folders (e.g. the image folder).
+    """
+    def __init__(self, folder_path: str) -> None:
+        self.folder_path = folder_path
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.file_descriptor = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.file_descriptor < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watches(self) -> None:
+        # Watch the folder and two levels of sub folders (dataset folders and their image/model folders).
+        # Adding a watch to an already watched folder only updates it, so new folders are picked up on every call.
+        folder_paths = [self.folder_path]
+        for depth in range(2):
+            sub_folder_paths = []
+            for folder_path in folder_paths:
+                try:
+                    sub_folder_paths.extend(entry.path for entry in os.scandir(folder_path) if entry.is_dir())
+                except OSError:
+                    pass
+            for folder_path in folder_paths:
+                self.libc.inotify_add_watch(self.file_descriptor, os.fsencode(folder_path), IN_WATCH_MASK)
+            folder_paths = sub_folder_paths
+        for folder_path in folder_paths:
+            self.libc.inotify_add_watch(self.file_descriptor, os.fsencode(folder_path), IN_WATCH_MASK)
+
+    def wait_for_changes(self, timeout: float) -> None:
+        self.add_watches()
+        readable, _, _ = select.select([self.file_descriptor], [], [], timeout)
+        if readable:
+            # Drain the events, only the wake up is needed because the folders are fingerprinted afterwards
+            try:
+                while os.read(self.file_descriptor, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+
+class DatasetWatcher():
+    def __init__(self, dataset_helper: DatasetHelper, logger: Logger, dataset_scheduler: Optional[DatasetScheduler] = None) -> None:
+        self.dataset_helper    = dataset_helper
+        self.logger            = logger
+        self.dataset_scheduler = dataset_scheduler
+
+        # Datasets that are complete and stable are added to the ready datasets (the scheduler picks the next one)
+        self.ready_datasets: List[Dataset] = []
+        self.ready_condition = threading.Condition()
+
+        # Fingerprint and time of the last change of every dataset folder
+        self.fingerprints: Dict[str, list] = {}
+        self.last_changes: Dict[str, float] = {}
+
+        # Dataset folders that have already been queued (they are removed when the folder leaves the input folder)
+        self.queued_dataset_paths: Set[str] = set()
+
+        # Fingerprints of the rejected dataset folders (they are evaluated again as soon as their files change)
+        self.rejected_fingerprints: Dict[str, list] = {}
+
+        self.change_notifier = self.create_change_notifier()
+
+
+    def create_change_notifier(self):
+        """
+        This method creates an inotify change notifier where available and a polling change notifier otherwise.
+        """
+        if sys.platform.startswith('linux'):
+            try:
+                return InotifyChangeNotifier(self.dataset_helper.input_folder)
+            except (OSError, AttributeError):
+                pass
+        return PollingChangeNotifier(self.dataset_helper.input_folder)
+
+
+    def start(self) -> None:
+        """
+        This method starts watching the input folder in a daemon thread.
+        """
+        self.logger.log(f"Watching '{self.dataset_helper.input_folder}' with {type(self.change_notifier).__name__}...")
+        watch_thread = threading.Thread(target=self.watch)
+        watch_thread.daemon = True
+        watch_thread.start()
+
+
+    def get_next_dataset(self, timeout: Optional[float] = None) -> Optional[Dataset]:
+        """
+        This method blocks until a dataset is complete and stable and returns it (None after the timeout). If several
+        datasets are ready, the scheduler decides which one is next.
+        """
+        with self.ready_condition:
+            if not self.ready_condition.wait_for(lambda: len(self.ready_datasets) > 0, timeout=timeout):
+                return None
+            if self.dataset_scheduler is not None and len(self.ready_datasets) > 1:
+                self.ready_datasets = self.dataset_scheduler.order(self.ready_datasets)
+            return self.ready_datasets.pop(0)
+
+
+    def requeue(self, dataset: Dataset) -> None:
+        """
+        This method puts a dataset back to the ready datasets (e.g. if it has been deferred because of missing disk space).
+        """
+        with self.ready_condition:
+            self.ready_datasets.append(dataset)
+            self.ready_condition.notify()
+
+
+    def reject(self, dataset: Dataset) -> None:
+        """
+        This method forgets a queued dataset that has not been processed and stays in the input folder (e.g. rejected or
+        claimed by another helper). It is not queued again until its files change.
+        """
+        self.rejected_fingerprints[dataset.basepath] = self.create_fingerprint(dataset.basepath)
+        self.queued_dataset_paths.discard(dataset.basepath)
+
+
+    def watch(self) -> None:
+        """
+        This method checks the input folder whenever something changed or at the latest after the poll interval.
+        """
+        while True:
+            try:
+                self.check_datasets()
+            except Exception as e:
+                self.logger.log(f"Watcher: {type(e).__name__}: {e}")
+            self.change_notifier.wait_for_changes(settings.get('watch_poll_interval'))
+
+
+    def check_datasets(self) -> None:
+        """
+        This method queues every dataset that is complete and did not change for watch_stable_seconds.
+        """
+        now = time.monotonic()
+        dataset_paths = []
+        for dataset_name in sorted(os.listdir(self.dataset_helper.input_folder)):
+            dataset_path = os.path.join(self.dataset_helper.input_folder, dataset_name)
+            if os.path.isdir(dataset_path):
+                dataset_paths.append(dataset_path)
+
+        # Forget datasets that left the input folder (e.g. processed and moved)
+        for dataset_path in set(self.fingerprints).difference(dataset_paths):
+            self.fingerprints.pop(dataset_path)
+            self.last_changes.pop(dataset_path)
+            self.queued_dataset_paths.discard(dataset_path)
+            self.rejected_fingerprints.pop(dataset_path, None)
+
+        for dataset_path in dataset_paths:
+            if dataset_path in self.queued_dataset_paths:
+                continue
+
+            # Skip rejected datasets until their files change
+            fingerprint = self.create_fingerprint(dataset_path)
+            if dataset_path in self.rejected_fingerprints:
+                if self.rejected_fingerprints[dataset_path] == fingerprint:
+                    continue
+                self.rejected_fingerprints.pop(dataset_path)
+
+            # Remember when the files of the dataset changed the last time (files are still growing while scanning)
+            if self.fingerprints.get(dataset_path) != fingerprint:
+                self.fingerprints[dataset_path] = fingerprint
+                self.last_changes[dataset_path] = now
+                continue
+
+            # Only evaluate datasets that have been stable long enough
+            if now - self.last_changes[dataset_path] < settings.get('watch_stable_seconds'):
+                continue
+
+            # Queue the dataset if it is complete (includes the needed image count)
+            dataset, incompleteness_reasons = self.dataset_helper.evaluate_dataset(dataset_path)
+            if len(incompleteness_reasons) == 0:
+                self.logger.log(f"  {dataset.name} is complete and stable, queued")
+                self.queued_dataset_paths.add(dataset_path)
+                with self.ready_condition:
+                    self.ready_datasets.append(dataset)
+                    self.ready_condition.notify()
+
+        # Store the caches so that a restart does not read the datasets again
+        self.dataset_helper.save_caches(dataset_paths)
+
+
+    def create_fingerprint(self, dataset_path: str) -> list:
+        """
+        This method creates the fingerprint of a dataset folder including the model folder (e.g. lock files).
+        """
+        image_folder_path   = os.path.join(dataset_path, settings['image_folder_path'])
+        model_folder_path   = os.path.join(dataset_path, settings['model_folder_path'])
+        cam_pos_file_path   = os.path.join(dataset_path, settings['cam_pos_file_path'])
+        scan_info_file_path = os.path.join(dataset_path, settings['scan_info_file_path'])
+        fingerprint = self.dataset_helper.discovery_index.create_fingerprint(dataset_path, image_folder_path, [cam_pos_file_path, scan_info_file_path])
+        fingerprint.append(self.dataset_helper.discovery_index.get_mtime(model_folder_path))
+        return fingerprint
@@ -0,0 +1,136 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+from typing import List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from settings.settings import settings
+
+# Metadata fields that are not stored in the index (not serializable or cheap to read again)
+NOT_INDEXED_METADATA_FIELDS = ['cam_positions']
+
+class DiscoveryIndex():
+    def __init__(self, index_file_path: str) -> None:
+        self.index_file_path = index_file_path
+
+        # The lock guards the index because datasets can be created from multiple threads
+        self.index_lock = threading.Lock()
+        self.index_changed = False
+        self.index = self.load_index()
+
+
+    def create_fingerprint(self, dataset_path: str, image_folder_path: str, file_paths: List[str]) -> list:
+        """
+        This method creates the fingerprint of a dataset folder. It consists of the directory mtimes, the image count,
+        the total and latest image sizes/mtimes and the size and mtime of the given files (e.g. CamPos.txt).
+        The fingerprint changes whenever a file that is used for the dataset metadata changes.
+        """
+        fingerprint = [
+            self.get_mtime(dataset_path),
+            self.get_mtime(image_folder_path),
+            settings.get('image_extensions'),
+        ]
+
+        # Add the image count, the total size and the latest mtime of all images
+        image_count = 0
+        image_total_size = 0
+        image_latest_mtime = 0
+        if os.path.isdir(image_folder_path):
+            image_extensions = tuple(settings['image_extensions'])
+            for entry in os.scandir(image_folder_path):
+                if entry.is_file() and entry.name.lower().endswith(image_extensions):
+                    stat = entry.stat()
+                    image_count += 1
+                    image_total_size += stat.st_size
+                    image_latest_mtime = max(image_latest_mtime, stat.st_mtime_ns)
+        fingerprint.extend([image_count, image_total_size, image_latest_mtime])
+
+        # Add the size and mtime of all other files
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+                fingerprint.append([stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                fingerprint.append(None)
+
+        return fingerprint
+
+
+    def get_mtime(self, path: str) -> Optional[int]:
+        """
+        This method returns the mtime of a path or None if it does not exist.
+        """
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+
+    def get(self, dataset_path: str, fingerprint: list) -> Optional[dict]:
+        """
+        This method returns the indexed metadata of the dataset if its fingerprint did not change, otherwise None.
+        """
+        with self.index_lock:
+            index_entry = self.index.get(dataset_path)
+        if index_entry is None or index_entry.get('fingerprint') != fingerprint:
+            return None
+        return dict(index_entry['metadata'])
+
+
+    def update(self, dataset_path: str, fingerprint: list, metadata: dict) -> None:
+        """
+        This method stores the metadata of the dataset together with its fingerprint.
+        """
+        metadata = {field: value for field, value in metadata.items() if field not in NOT_INDEXED_METADATA_FIELDS}
+        with self.index_lock:
+            self.index[dataset_path] = {'fingerprint': fingerprint, 'metadata': metadata}
+            self.index_changed = True
+
+
+    def remove_missing(self, dataset_paths: List[str], input_folder: str) -> None:
+        """
+        This method removes the entries of datasets inside the input folder that do not exist anymore (e.g. moved).
+        """
+        existing_dataset_paths = set(dataset_paths)
+        with self.index_lock:
+            for dataset_path in list(self.index.keys()):
+                if os.path.dirname(dataset_path) == input_folder and dataset_path not in existing_dataset_paths:
+                    del self.index[dataset_path]
+                    self.index_changed = True
+
+
+    def load_index(self) -> dict:
+        """
+        This method loads the index file. A missing or broken index file results in an empty index.
+        """
+        try:
+            with open(self.index_file_path, "r") as index_file:
+                index = json.load(index_file)
+            if isinstance(index, dict):
+                return index
+        except (OSError, ValueError):
+            pass
+        return {}
+
+
+    def save_index(self) -> None:
+        """
+        This method writes the index file if it changed. The file is replaced atomically so that a crash cannot corrupt it.
+        """
+        with self.index_lock:
+            if not self.index_changed:
+                return
+            # Write to a unique temporary file first (the index file can be shared by the helpers of several nodes)
+            file_descriptor, temporary_index_file_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.index_file_path)), prefix=f"{os.path.basename(self.index_file_path)}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(file_descriptor, "w") as index_file:
+                    json.dump(self.index, index_file)
+                os.replace(temporary_index_file_path, self.index_file_path)
+            except Exception:
+                os.remove(temporary_index_file_path)
+                raise
+            self.index_changed = False
@@ -0,0 +1,215 @@
+import os
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from data.image_size_prober import PNG_SIGNATURE, JPEG_SIGNATURE, TIFF_SIGNATURES, JPEG_STANDALONE_MARKERS
+
+# Size of the blocks that are read from the files
+READ_BLOCK_SIZE = 1024 * 1024
+
+# Channels of the PNG color types (multiplied with the bit depth to get the bits per pixel)
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# TIFF tags that describe where the image data is stored
+TIFF_DATA_TAGS = {273: 279, 324: 325}  # StripOffsets -> StripByteCounts, TileOffsets -> TileByteCounts
+TIFF_FIELD_FORMATS = {3: 'H', 4: 'I', 16: 'Q'}
+
+class ImageIntegrityChecker():
+    def __init__(self, worker_count: int = 1) -> None:
+        self.worker_count = worker_count
+
+
+    def check_images(self, image_paths: List[str]) -> Tuple[Dict[str, str], float]:
+        """
+        This method checks all images with a process pool and returns the corrupt images (image path -> error)
+        together with the throughput in MB/s.
+        """
+        if len(image_paths) == 0:
+            return {}, 0.0
+
+        start_time = time.time()
+        worker_count = max(1, min(self.worker_count, len(image_paths)))
+        with ProcessPoolExecutor(max_workers=worker_count) as executor:
+            results = list(executor.map(self.check_image, image_paths, chunksize=8))
+        elapsed_time = max(time.time() - start_time, 1e-6)
+
+        # Collect the failures and the amount of checked bytes
+        corrupt_images = {}
+        checked_bytes = 0
+        for image_path, (error, image_bytes) in zip(image_paths, results):
+            checked_bytes += image_bytes
+            if error is not None:
+                corrupt_images[image_path] = error
+
+        throughput = checked_bytes / (1024 * 1024) / elapsed_time
+        return corrupt_images, throughput
+
+
+    def check_image(self, image_path: str) -> Tuple[Optional[str], int]:
+        """
+        This method checks a single image and returns the error (None if the image is fine) and the file size.
+        PNG images are CRC checked and their image data is stream decoded. JPEG and TIFF images are checked structurally.
+        """
+        try:
+            image_bytes = os.path.getsize(image_path)
+            with open(image_path, 'rb') as image_file:
+                signature = image_file.read(8)
+                image_file.seek(0)
+                if signature.startswith(PNG_SIGNATURE):
+                    return self.check_png(image_file), image_bytes
+                if signature.startswith(JPEG_SIGNATURE):
+                    return self.check_jpeg(image_file, image_bytes), image_bytes
+                if signature[:2] in TIFF_SIGNATURES:
+                    return self.check_tiff(image_file, image_bytes), image_bytes
+                return "unknown image format", image_bytes
+        except (OSError, struct.error) as e:
+            return f"{type(e).__name__}: {e}", 0
+
+
+    def check_png(self, image_file: BinaryIO) -> Optional[str]:
+        """
+        This method verifies the CRC of every chunk and decompresses the image data without keeping it in memory.
+        """
+        image_file.seek(len(PNG_SIGNATURE))
+        decompressor = zlib.decompressobj()
+        decompressed_size = 0
+        expected_size = None
+        has_image_data = False
+
+        while True:
+            # Read the chunk header (length and type)
+            header = image_file.read(8)
+            if len(header) < 8:
+                return "file is truncated (IEND chunk missing)"
+            chunk_length, chunk_type = struct.unpack('>I4s', header)
+
+            # Read the chunk data blockwise and calculate the CRC
+            crc = zlib.crc32(chunk_type)
+            remaining = chunk_length
+            while remaining > 0:
+                block = image_file.read(min(remaining, READ_BLOCK_SIZE))
+                if len(block) == 0:
+                    return f"file is truncated (inside {chunk_type.decode('latin-1')} chunk)"
+                crc = zlib.crc32(block, crc)
+                remaining -= len(block)
+
+                # Decode the image data
+                if chunk_type == b'IDAT':
+                    try:
+                        decompressed_size += len(decompressor.decompress(block))
+                    except zlib.error as e:
+                        return f"image data is corrupt ({e})"
+
+                # Calculate the expected size of the decoded image data (not possible for interlaced images)
+                if chunk_type == b'IHDR':
+                    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', block[:13])
+                    if interlace == 0 and color_type in PNG_CHANNELS:
+                        row_bytes = (width * PNG_CHANNELS[color_type] * bit_depth + 7) // 8
+                        expected_size = height * (row_bytes + 1)
+
+            # Compare the CRC
+            stored_crc = image_file.read(4)
+            if len(stored_crc) < 4:
+                return "file is truncated (CRC missing)"
+            if struct.unpack('>I', stored_crc)[0] != crc & 0xFFFFFFFF:
+                return f"CRC mismatch in {chunk_type.decode('latin-1')} chunk"
+
+            if chunk_type == b'IDAT':
+                has_image_data = True
+            if chunk_type == b'IEND':
+                break
+
+        # Check that the image data is complete
+        if not has_image_data:
+            return "image data is missing"
+        try:
+            decompressed_size += len(decompressor.flush())
+        except zlib.error as e:
+            return f"image data is corrupt ({e})"
+        if not decompressor.eof:
+            return "image data is incomplete"
+        if expected_size is not None and decompressed_size != expected_size:
+            return f"image data has {decompressed_size} instead of {expected_size} bytes"
+        return None
+
+
+    def check_jpeg(self, image_file: BinaryIO, image_bytes: int) -> Optional[str]:
+        """
+        This method checks the JPEG segments up to the image data and verifies that the file ends with an EOI marker.
+        """
+        image_file.seek(2)
+        while True:
+            byte = image_file.read(1)
+            if byte != b'\xff':
+                return "invalid segment marker"
+            while byte == b'\xff':
+                byte = image_file.read(1)
+            if len(byte) == 0:
+                return "file is truncated (no image data)"
+            marker = byte[0]
+            if marker in JPEG_STANDALONE_MARKERS:
+                continue
+            segment_length = struct.unpack('>H', image_file.read(2))[0]
+            if image_file.seek(segment_length - 2, 1) > image_bytes:
+                return "file is truncated (inside a segment)"
+
+            # The image data follows the start of scan segment
+            if marker == 0xDA:
+                break
+
+        # A complete JPEG ends with an EOI marker (some encoders add padding bytes)
+        image_file.seek(max(0, image_bytes - 64))
+        tail = image_file.read().rstrip(b'\x00')
+        if not tail.endswith(b'\xff\xd9'):
+            return "file is truncated (EOI marker missing)"
+        return None
+
+
+    def check_tiff(self, image_file: BinaryIO, image_bytes: int) -> Optional[str]:
+        """
+        This method checks that all strips/tiles of the first IFD are inside the file (classic TIFF only).
+        """
+        header = image_file.read(8)
+        byte_order = '<' if header[:2] == b'II' else '>'
+        version, ifd_offset = struct.unpack(f'{byte_order}HI', header[2:8])
+        if version != 42:
+            return None
+        if ifd_offset + 2 > image_bytes:
+            return "file is truncated (IFD missing)"
+
+        # Read the entries of the first IFD
+        image_file.seek(ifd_offset)
+        entry_count = struct.unpack(f'{byte_order}H', image_file.read(2))[0]
+        entries = image_file.read(entry_count * 12)
+        if len(entries) < entry_count * 12:
+            return "file is truncated (inside the IFD)"
+        values = {}
+        for entry_index in range(entry_count):
+            tag, field_type, count, value = struct.unpack_from(f'{byte_order}HHI4s', entries, entry_index * 12)
+            if field_type not in TIFF_FIELD_FORMATS:
+                continue
+            value_format = TIFF_FIELD_FORMATS[field_type]
+            value_size = struct.calcsize(value_format)
+            if count * value_size <= 4:
+                values[tag] = struct.unpack_from(f'{byte_order}{count}{value_format}', value)
+            else:
+                offset = struct.unpack(f'{byte_order}I', value)[0]
+                image_file.seek(offset)
+                data = image_file.read(count * value_size)
+                if len(data) < count * value_size:
+                    return "file is truncated (inside the IFD values)"
+                values[tag] = struct.unpack(f'{byte_order}{count}{value_format}', data)
+
+        # Check that the image data is inside the file
+        for offsets_tag, byte_counts_tag in TIFF_DATA_TAGS.items():
+            if offsets_tag in values and byte_counts_tag in values:
+                for offset, byte_count in zip(values[offsets_tag], values[byte_counts_tag]):
+                    if offset + byte_count > image_bytes:
+                        return "file is truncated (image data missing)"
+                return None
+        return "image data is missing"
@@ -0,0 +1,147 @@
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+# File signatures of the supported image formats
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SIGNATURE = b'\xff\xd8'
+TIFF_SIGNATURES = (b'II', b'MM')
+
+# JPEG start of frame markers (0xC4, 0xC8 and 0xCC are no frame markers)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# JPEG markers without a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+# TIFF tags and field types needed for the image size
+TIFF_IMAGE_WIDTH_TAG = 256
+TIFF_IMAGE_LENGTH_TAG = 257
+TIFF_FIELD_FORMATS = {3: 'H', 4: 'I', 16: 'Q'}
+
+class ImageSizeProber():
+    def __init__(self, worker_count: int = 1) -> None:
+        self.worker_count = worker_count
+
+
+    def get_image_size(self, image_path: str) -> Optional[Tuple[int, int]]:
+        """
+        This method reads the size (width, height) of an image from its header bytes only.
+        Supported formats are PNG, JPEG and TIFF. If the size cannot be read it returns None.
+        """
+        try:
+            with open(image_path, 'rb') as image_file:
+                signature = image_file.read(8)
+                image_file.seek(0)
+                if signature.startswith(PNG_SIGNATURE):
+                    return self.get_png_size(image_file)
+                if signature.startswith(JPEG_SIGNATURE):
+                    return self.get_jpeg_size(image_file)
+                if signature[:2] in TIFF_SIGNATURES:
+                    return self.get_tiff_size(image_file)
+        except (OSError, struct.error):
+            pass
+        return None
+
+
+    def get_image_sizes(self, image_paths: List[str]) -> Dict[str, Optional[Tuple[int, int]]]:
+        """
+        This method reads the sizes of all images concurrently and returns them by image path.
+        """
+        if len(image_paths) == 0:
+            return {}
+        worker_count = max(1, min(self.worker_count, len(image_paths)))
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            image_sizes = list(executor.map(self.get_image_size, image_paths))
+        return dict(zip(image_paths, image_sizes))
+
+
+    def get_mismatched_images(self, image_paths: List[str], image_size: Optional[Tuple[int, int]]) -> List[str]:
+        """
+        This method returns all images whose size differs from the given image size or cannot be read.
+        """
+        image_sizes = self.get_image_sizes(image_paths)
+        return [image_path for image_path in image_paths if image_sizes[image_path] != image_size]
+
+
+    def get_png_size(self, image_file: BinaryIO) -> Optional[Tuple[int, int]]:
+        """
+        This method reads the size from the IHDR chunk, which always directly follows the PNG signature.
+        """
+        header = image_file.read(24)
+        if len(header) < 24 or header[12:16] != b'IHDR':
+            return None
+        width, height = struct.unpack('>II', header[16:24])
+        return width, height
+
+
+    def get_jpeg_size(self, image_file: BinaryIO) -> Optional[Tuple[int, int]]:
+        """
+        This method walks through the JPEG segments until it finds a start of frame segment, which contains the size.
+        """
+        image_file.seek(2)
+        while True:
+            # Every marker starts with 0xFF and can be padded with more 0xFF bytes
+            byte = image_file.read(1)
+            if byte != b'\xff':
+                return None
+            while byte == b'\xff':
+                byte = image_file.read(1)
+            if len(byte) == 0:
+                return None
+            marker = byte[0]
+
+            # Skip markers without a payload
+            if marker in JPEG_STANDALONE_MARKERS:
+                continue
+
+            # The size is stored in the start of frame segment (length, precision, height, width)
+            segment_length = struct.unpack('>H', image_file.read(2))[0]
+            if marker in JPEG_SOF_MARKERS:
+                _, height, width = struct.unpack('>BHH', image_file.read(5))
+                return width, height
+
+            # Stop at the start of scan, the frame header must come before it
+            if marker == 0xDA:
+                return None
+
+            # Skip the segment payload
+            image_file.seek(segment_length - 2, 1)
+
+
+    def get_tiff_size(self, image_file: BinaryIO) -> Optional[Tuple[int, int]]:
+        """
+        This method reads the size from the ImageWidth and ImageLength tags of the first IFD (classic TIFF and BigTIFF).
+        """
+        header = image_file.read(16)
+        byte_order = '<' if header[:2] == b'II' else '>'
+        version = struct.unpack(f'{byte_order}H', header[2:4])[0]
+
+        # Get the layout of the IFD (classic TIFF or BigTIFF)
+        if version == 42:
+            ifd_offset = struct.unpack(f'{byte_order}I', header[4:8])[0]
+            count_format, entry_size, value_size = 'H', 12, 4
+        elif version == 43:
+            ifd_offset = struct.unpack(f'{byte_order}Q', header[8:16])[0]
+            count_format, entry_size, value_size = 'Q', 20, 8
+        else:
+            return None
+
+        # Read all entries of the first IFD
+        image_file.seek(ifd_offset)
+        count_size = struct.calcsize(count_format)
+        entry_count = struct.unpack(f'{byte_order}{count_format}', image_file.read(count_size))[0]
+        entries = image_file.read(entry_count * entry_size)
+
+        # Search the width and height tags
+        size = {}
+        for entry_index in range(entry_count):
+            entry = entries[entry_index * entry_size:(entry_index + 1) * entry_size]
+            tag, field_type = struct.unpack(f'{byte_order}HH', entry[:4])
+            if tag in (TIFF_IMAGE_WIDTH_TAG, TIFF_IMAGE_LENGTH_TAG) and field_type in TIFF_FIELD_FORMATS:
+                value_format = TIFF_FIELD_FORMATS[field_type]
+                value_offset = entry_size - value_size
+                size[tag] = struct.unpack_from(f'{byte_order}{value_format}', entry, value_offset)[0]
+
+        if TIFF_IMAGE_WIDTH_TAG in size and TIFF_IMAGE_LENGTH_TAG in size:
+            return size[TIFF_IMAGE_WIDTH_TAG], size[TIFF_IMAGE_LENGTH_TAG]
+        return None
@@ -0,0 +1,234 @@
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from settings.settings import settings
+from data.dataset import Dataset, HelperMode
+from logger import Logger
+
+class JobQueue():
+    def __init__(self, queue_folder: str, helper_mode: HelperMode, logger: Logger) -> None:
+        self.queue_folder = queue_folder
+        self.helper_mode  = helper_mode
+        self.logger       = logger
+
+        # Unique id of this helper (several helpers can run on the same workstation)
+        self.host_name = socket.gethostname()
+        self.node_id   = f"{self.host_name}-{os.getpid()}"
+
+        # Claim file paths of the datasets claimed by this helper. The heartbeat thread keeps their leases alive.
+        self.claims: Dict[str, str] = {}
+        self.claims_lock = threading.Lock()
+        self.heartbeat_thread = None
+
+
+    def claim(self, dataset: Dataset) -> bool:
+        """
+        This method claims the dataset for this helper and returns whether the claim was successful. A dataset can only
+        be claimed by one helper (on any workstation) at a time. Claims whose lease expired (no heartbeat for
+        job_lease_seconds, e.g. the helper crashed) are reclaimed.
+        """
+        with self.claims_lock:
+            if dataset.name in self.claims:
+                return True
+
+        claim_file_path = self.get_claim_file_path(dataset)
+        if not self.create_claim_file(claim_file_path):
+            # Take over the claim if its lease expired
+            if not self.remove_stale_claim_file(claim_file_path):
+                return False
+            if not self.create_claim_file(claim_file_path):
+                return False
+
+        with self.claims_lock:
+            self.claims[dataset.name] = claim_file_path
+        self.start_heartbeat()
+        return True
+
+
+    def release(self, dataset: Dataset) -> None:
+        """
+        This method releases the claim of the dataset (after it has been processed or rejected).
+        """
+        with self.claims_lock:
+            claim_file_path = self.claims.pop(dataset.name, None)
+        if claim_file_path is not None and self.get_claim_owner(claim_file_path) == self.node_id:
+            try:
+                os.remove(claim_file_path)
+            except OSError:
+                pass
+
+
+    def has_claim(self, dataset: Dataset) -> bool:
+        """
+        This method returns whether this helper still holds the claim of the dataset (it can be lost if the heartbeat
+        could not be written for longer than the lease).
+        """
+        with self.claims_lock:
+            claim_file_path = self.claims.get(dataset.name)
+        return claim_file_path is not None and self.get_claim_owner(claim_file_path) == self.node_id
+
+
+    def create_claim_file(self, claim_file_path: str) -> bool:
+        # Create the claim file atomically, this fails if the file already exists (also on network shares)
+        try:
+            file_descriptor = os.open(claim_file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(file_descriptor, "w") as claim_file:
+            json.dump({'node': self.node_id, 'claimed_at': time.strftime('%Y-%m-%d %H:%M:%S')}, claim_file)
+        return True
+
+
+    def remove_stale_claim_file(self, claim_file_path: str) -> bool:
+        """
+        This method removes the claim file if its lease expired and returns whether it was removed.
+        The file is renamed first and compared with the expired claim afterwards: if another helper replaced the claim
+        between the check and the rename, the renamed claim is not the expired one and is put back, so only one helper
+        can take over a stale claim.
+        """
+        try:
+            claim_stat = os.stat(claim_file_path)
+        except OSError:
+            return False
+        claim_owner   = self.get_claim_owner(claim_file_path)
+        heartbeat_age = self.get_share_time() - claim_stat.st_mtime
+        if heartbeat_age <= settings.get('job_lease_seconds'):
+            return False
+
+        stale_claim_file_path = f"{claim_file_path}.stale-{self.node_id}"
+        try:
+            os.rename(claim_file_path, stale_claim_file_path)
+        except OSError:
+            return False
+
+        # Put the claim back if it is not the expired claim anymore (it has been taken over by another helper meanwhile)
+        try:
+            stale_claim_stat = os.stat(stale_claim_file_path)
+        except OSError:
+            return False
+        if stale_claim_stat.st_mtime != claim_stat.st_mtime or self.get_claim_owner(stale_claim_file_path) != claim_owner:
+            try:
+                if not os.path.exists(claim_file_path):
+                    os.rename(stale_claim_file_path, claim_file_path)
+                else:
+                    os.remove(stale_claim_file_path)
+            except OSError:
+                pass
+            return False
+
+        self.logger.log(f"Reclaimed stale job claim '{os.path.basename(claim_file_path)}' (no heartbeat for {int(heartbeat_age)} seconds)")
+        os.remove(stale_claim_file_path)
+        return True
+
+
+    def mark_document_opened(self, dataset: Dataset) -> None:
+        """
+        This method records in the claim file that this helper opens the document of the dataset. Only locks of such
+        claims are removed when the claim expires (see remove_stale_lock).
+        """
+        with self.claims_lock:
+            claim_file_path = self.claims.get(dataset.name)
+        if claim_file_path is None:
+            return
+        try:
+            with open(claim_file_path, "r+") as claim_file:
+                claim = json.load(claim_file)
+                if claim.get('node') != self.node_id:
+                    return
+                claim['holds_document'] = True
+                claim_file.seek(0)
+                json.dump(claim, claim_file)
+                claim_file.truncate()
+        except (OSError, ValueError):
+            pass
+
+
+    def remove_stale_lock(self, dataset: Dataset) -> None:
+        """
+        This method removes the Metashape lock file of the dataset if it has been left by a helper that crashed: its
+        claim held the document and expired. Other locks (e.g. the document is opened in Metashape or by a helper
+        without job queue) are kept.
+        """
+        claim_file_path = self.get_claim_file_path(dataset)
+        try:
+            with open(claim_file_path, "r") as claim_file:
+                claim = json.load(claim_file)
+            heartbeat_age = self.get_share_time() - os.stat(claim_file_path).st_mtime
+        except (OSError, ValueError):
+            return
+        if not claim.get('holds_document') or heartbeat_age <= settings.get('job_lease_seconds'):
+            return
+
+        # The lock can be removed by another helper at the same time
+        try:
+            os.remove(dataset.lock_file_path)
+        except FileNotFoundError:
+            return
+        self.logger.log(f"{dataset.name}: Removed stale lock file (left by {claim.get('node')})")
+
+
+    def start_heartbeat(self) -> None:
+        # Start the heartbeat thread once
+        if self.heartbeat_thread is None:
+            self.heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
+            self.heartbeat_thread.start()
+
+
+    def heartbeat(self) -> None:
+        """
+        This method renews the leases of all claims every job_heartbeat_interval seconds by writing the claim files.
+        Claims that have been taken over by another helper are dropped.
+        """
+        while True:
+            time.sleep(settings.get('job_heartbeat_interval'))
+            with self.claims_lock:
+                claims = list(self.claims.items())
+
+            for dataset_name, claim_file_path in claims:
+                try:
+                    # Write the claim again (the file server sets the mtime, so the clocks of the workstations do not matter)
+                    with open(claim_file_path, "r+") as claim_file:
+                        claim = json.load(claim_file)
+                        if claim.get('node') != self.node_id:
+                            raise FileNotFoundError(claim_file_path)
+                        claim['heartbeat_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+                        claim_file.seek(0)
+                        json.dump(claim, claim_file)
+                        claim_file.truncate()
+                except (OSError, ValueError):
+                    self.logger.log(f"{dataset_name}: Lost the job claim (the lease expired)")
+                    with self.claims_lock:
+                        self.claims.pop(dataset_name, None)
+
+
+    def get_claim_owner(self, claim_file_path: str) -> Optional[str]:
+        # Return the helper that owns the claim or None if the claim does not exist or cannot be read
+        try:
+            with open(claim_file_path, "r") as claim_file:
+                return json.load(claim_file).get('node')
+        except (OSError, ValueError):
+            return None
+
+
+    def get_claim_file_path(self, dataset: Dataset) -> str:
+        # Claim files are separate for calculation and export (the same dataset goes through both)
+        return os.path.join(self.queue_folder, f"{self.helper_mode.name.lower()}_{dataset.name}.claim")
+
+
+    def get_share_time(self) -> float:
+        """
+        This method returns the current time of the shared folder (the mtime of a file that has just been written), so
+        that the lease ages do not depend on the clocks of the workstations.
+        """
+        clock_file_path = os.path.join(self.queue_folder, f"{self.node_id}.clock")
+        with open(clock_file_path, "w") as clock_file:
+            clock_file.write(self.node_id)
+        share_time = os.stat(clock_file_path).st_mtime
+        os.remove(clock_file_path)
+        return share_time
@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from typing import Dict, Optional, Union
+from PyPDF2 import PdfReader
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from settings.settings import settings
+
+class ScanInfoParser():
+    def __init__(self, cache_file_path: str) -> None:
+        self.cache_file_path = cache_file_path
+
+        # The lock guards the cache because datasets can be created from multiple threads
+        self.cache_lock = threading.Lock()
+        self.cache_changed = False
+        self.cache = self.load_cache()
+
+
+    def parse(self, scan_info_file_path: str) -> Dict[str, Optional[Union[int, float]]]:
+        """
+        This method returns all the fields of the scan information pdf (f_number and needed_image_count).
+        The pdf is only parsed if it is not in the cache yet or if it changed since it was cached.
+        """
+        # Create an empty scan info if the file cannot be accessed
+        try:
+            stat = os.stat(scan_info_file_path)
+        except OSError:
+            return self.create_scan_info(None)
+
+        # Return the cached scan info if the file and the regex settings did not change
+        cache_key = self.create_cache_key(stat)
+        with self.cache_lock:
+            cache_entry = self.cache.get(scan_info_file_path)
+        if cache_entry is not None and cache_entry.get('key') == cache_key:
+            return dict(cache_entry['scan_info'])
+
+        # Parse the pdf once and extract all fields from the same text
+        scan_info = self.create_scan_info(self.read_pdf_text(scan_info_file_path))
+
+        # Store the scan info in the cache
+        with self.cache_lock:
+            self.cache[scan_info_file_path] = {'key': cache_key, 'scan_info': scan_info}
+            self.cache_changed = True
+
+        return dict(scan_info)
+
+
+    def create_cache_key(self, stat: os.stat_result) -> list:
+        """
+        This method creates the cache key of a scan information pdf. The key changes if the file or the regexes change.
+        """
+        return [
+            stat.st_size,
+            stat.st_mtime_ns,
+            settings.get('f_number_regex'),
+            settings.get('num_images_regex'),
+        ]
+
+
+    def create_scan_info(self, pdf_text: Optional[str]) -> Dict[str, Optional[Union[int, float]]]:
+        """
+        This method extracts all fields from the pdf text. Fields that could not be extracted are None.
+        """
+        scan_info = {'f_number': None, 'needed_image_count': None}
+        if pdf_text is None:
+            return scan_info
+
+        cleaned_pdf_text = self.clean_pdf_text(pdf_text)
+
+        # Extract the f number
+        match = re.search(settings.get('f_number_regex'), cleaned_pdf_text)
+        if match:
+            try:
+                scan_info['f_number'] = float(match.group(1))
+            except ValueError:
+                pass
+
+        # Extract the needed image count (0 is not a valid image count)
+        match = re.search(settings.get('num_images_regex'), cleaned_pdf_text)
+        if match:
+            try:
+                num_images = int(match.group(1))
+                if num_images > 0:
+                    scan_info['needed_image_count'] = num_images
+            except ValueError:
+                pass
+
+        return scan_info
+
+
+    def read_pdf_text(self, scan_info_file_path: str) -> Optional[str]:
+        """
+        This method extracts the text of the first page of the pdf. If the pdf cannot be read it returns None.
+        """
+        try:
+            with open(scan_info_file_path, "rb") as pdf_file:
+                pdf_reader = PdfReader(pdf_file)
+                return pdf_reader.pages[0].extract_text()
+        except:
+            return None
+
+
+    def clean_pdf_text(self, pdf_text: str) -> str:
+        """
+        This method is used to remove \\n (newline) and unnecessary spaces from pdf text.
+        """
+        # replace all \n with a space
+        cleaned_pdf_text = re.sub('\n', ' ', pdf_text)
+        # replace all multiple spaces with one space
+        cleaned_pdf_text = re.sub(' +', ' ', cleaned_pdf_text)
+
+        # replace all spaces after colon
+        cleaned_pdf_text = re.sub(r":\s+", ":", cleaned_pdf_text)
+
+        return cleaned_pdf_text
+
+
+    def load_cache(self) -> dict:
+        """
+        This method loads the cache file. A missing or broken cache file results in an empty cache.
+        """
+        try:
+            with open(self.cache_file_path, "r") as cache_file:
+                cache = json.load(cache_file)
+            if isinstance(cache, dict):
+                return cache
+        except (OSError, ValueError):
+            pass
+        return {}
+
+
+    def save_cache(self) -> None:
+        """
+        This method writes the cache file if it changed. The file is replaced atomically so that a crash cannot corrupt it.
+        """
+        with self.cache_lock:
+            if not self.cache_changed:
+                return
+            # The temporary file has a unique name, so helpers on other nodes that share the file do not write into it
+            file_descriptor, temporary_cache_file_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.cache_file_path)), prefix=f"{os.path.basename(self.cache_file_path)}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(file_descriptor, "w") as cache_file:
+                    json.dump(self.cache, cache_file)
+                os.replace(temporary_cache_file_path, self.cache_file_path)
+            except Exception:
+                os.remove(temporary_cache_file_path)
+                raise
+            self.cache_changed = False
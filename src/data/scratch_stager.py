@@ -0,0 +1,217 @@
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from settings.settings import settings
+from data.dataset import Dataset
+from logger import Logger
+from run_history import get_folder_size
+
+# Metadata fields that are copied to the staged dataset (the other fields contain paths and are read again locally)
+STAGED_METADATA_FIELDS = ['f_number', 'needed_image_count', 'image_size', 'cam_positions']
+
+class ScratchStager():
+    def __init__(self, dataset_helper, logger: Logger) -> None:
+        self.dataset_helper = dataset_helper
+        self.logger         = logger
+        self.scratch_folder = settings.get('scratch_folder_path')
+
+        # One thread copies the next dataset to the scratch folder, another one writes the results back.
+        # Both run while Metashape is calculating the current dataset.
+        self.prefetch_executor   = ThreadPoolExecutor(max_workers=1)
+        self.write_back_executor = ThreadPoolExecutor(max_workers=1)
+        self.prefetches: Dict[str, Future] = {}
+        self.prefetched_datasets: Dict[str, Dataset] = {}
+        self.write_backs = []
+        self.pending_write_backs: Dict[Future, tuple] = {}
+        self.write_backs_lock = threading.Lock()
+
+
+    def prefetch(self, dataset: Dataset) -> None:
+        """
+        This method starts copying the dataset to the scratch folder in the background.
+        """
+        if dataset.name not in self.prefetches:
+            self.prefetches[dataset.name] = self.prefetch_executor.submit(self.copy_to_scratch, dataset)
+            self.prefetched_datasets[dataset.name] = dataset
+
+
+    def stage(self, dataset: Dataset) -> Dataset:
+        """
+        This method returns a dataset that points to the copy in the scratch folder. It waits for the prefetch of the
+        dataset or copies it now. If the copy fails the original dataset is returned (processed in place).
+        """
+        self.prefetch(dataset)
+        self.prefetched_datasets.pop(dataset.name, None)
+        try:
+            scratch_dataset_path = self.prefetches.pop(dataset.name).result()
+        except OSError as e:
+            self.logger.log(f"   Staging failed, processing the dataset in place: {e}")
+            return dataset
+
+        # Create the staged dataset and keep the metadata that does not depend on the dataset location
+        staged_dataset = self.dataset_helper.create_dataset_object(scratch_dataset_path)
+        for field in STAGED_METADATA_FIELDS:
+            if field in dataset.metadata:
+                staged_dataset.metadata[field] = dataset.metadata[field]
+        return staged_dataset
+
+
+    def copy_to_scratch(self, dataset: Dataset) -> str:
+        """
+        This method copies the dataset folder to the scratch folder and returns the path of the copy.
+        The copy is made into a temporary folder first, so an aborted copy is never used. A scratch copy whose model is
+        newer than the model of the dataset holds results that have not been written back, it is never overwritten.
+        """
+        scratch_dataset_path   = os.path.join(self.scratch_folder, dataset.name)
+        temporary_dataset_path = f"{scratch_dataset_path}.partial"
+
+        # Keep the results of a failed write back (the dataset is processed in place instead)
+        scratch_model_folder_path = os.path.join(scratch_dataset_path, settings['model_folder_path'])
+        if get_latest_mtime(scratch_model_folder_path) > get_latest_mtime(dataset.model_folder_path):
+            self.logger.log(f"{dataset.name}: The scratch copy '{scratch_dataset_path}' has newer results than the dataset, it is not overwritten")
+            raise FileExistsError(f"The scratch copy '{scratch_dataset_path}' has results that have not been written back")
+
+        for path in [scratch_dataset_path, temporary_dataset_path]:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+        shutil.copytree(dataset.basepath, temporary_dataset_path)
+        os.replace(temporary_dataset_path, scratch_dataset_path)
+        return scratch_dataset_path
+
+
+    def write_back(self, staged_dataset: Dataset, dataset: Dataset, on_written_back: Optional[Callable] = None) -> None:
+        """
+        This method copies the model folder of the staged dataset back to the original dataset in the background.
+        on_written_back() is called once the results have been written back (e.g. to move the dataset to the output
+        folder), the scratch copy is only removed if it succeeds. If the dataset has not been staged, it is called
+        right away.
+        """
+        if staged_dataset is dataset:
+            if on_written_back is not None:
+                on_written_back()
+            return
+
+        with self.write_backs_lock:
+            write_back = self.write_back_executor.submit(self.copy_from_scratch, staged_dataset, dataset, on_written_back)
+            self.write_backs.append(write_back)
+            self.pending_write_backs[write_back] = (staged_dataset, dataset)
+
+
+    def copy_from_scratch(self, staged_dataset: Dataset, dataset: Dataset, on_written_back: Optional[Callable]) -> None:
+        try:
+            # Copy the model folder next to the original one and swap them, so the original is never half written
+            temporary_model_folder_path = f"{dataset.model_folder_path}.staging"
+            old_model_folder_path       = f"{dataset.model_folder_path}.old"
+            for path in [temporary_model_folder_path, old_model_folder_path]:
+                if os.path.exists(path):
+                    shutil.rmtree(path)
+            shutil.copytree(staged_dataset.model_folder_path, temporary_model_folder_path)
+            if os.path.exists(dataset.model_folder_path):
+                os.replace(dataset.model_folder_path, old_model_folder_path)
+            os.replace(temporary_model_folder_path, dataset.model_folder_path)
+            if os.path.exists(old_model_folder_path):
+                shutil.rmtree(old_model_folder_path)
+            self.logger.log(f"{dataset.name}: Results written back from the scratch folder")
+        except Exception as e:
+            # Keep the scratch copy so that the results are not lost
+            self.logger.log(f"{dataset.name}: Writing back the results failed ({type(e).__name__}: {e}), the results are kept in '{staged_dataset.basepath}'")
+            return
+
+        try:
+            if on_written_back is not None:
+                on_written_back()
+        except Exception as e:
+            # The results are in the original dataset, the scratch copy is kept as well until the dataset has been handled
+            self.logger.log(f"{dataset.name}: Handling the written back results failed ({type(e).__name__}: {e}), the scratch copy is kept in '{staged_dataset.basepath}'")
+            return
+
+        # Remove the scratch copy once the results are safe
+        try:
+            shutil.rmtree(staged_dataset.basepath)
+        except OSError as e:
+            self.logger.log(f"{dataset.name}: Removing the scratch copy failed ({type(e).__name__}: {e})")
+
+
+    def get_outstanding_bytes(self, folder_path: str, excluded_dataset_names: Optional[List[str]] = None) -> float:
+        """
+        This method returns the bytes the running and queued copies (prefetches and write backs) still write to the
+        disk of the folder. The disk admission reserves them, they are not part of the free space yet.
+        """
+        device = os.stat(folder_path).st_dev
+        outstanding_bytes = 0.0
+
+        # Prefetches write the dataset into the scratch folder (the finished part is already on the disk)
+        for dataset_name, prefetch in list(self.prefetches.items()):
+            if prefetch.done() or dataset_name in (excluded_dataset_names or []) or os.stat(self.scratch_folder).st_dev != device:
+                continue
+            dataset = self.prefetched_datasets[dataset_name]
+            copied_bytes = get_folder_size(os.path.join(self.scratch_folder, f"{dataset.name}.partial")) or 0
+            outstanding_bytes += max((get_folder_size(dataset.basepath) or 0) - copied_bytes, 0)
+
+        # Write backs copy the model folder next to the original one before the scratch copy is removed
+        with self.write_backs_lock:
+            pending_write_backs = [datasets for write_back, datasets in self.pending_write_backs.items() if not write_back.done()]
+        for staged_dataset, dataset in pending_write_backs:
+            if os.stat(os.path.dirname(dataset.model_folder_path)).st_dev != device:
+                continue
+            copied_bytes = get_folder_size(f"{dataset.model_folder_path}.staging") or 0
+            outstanding_bytes += max((get_folder_size(staged_dataset.model_folder_path) or 0) - copied_bytes, 0)
+        return outstanding_bytes
+
+
+    def discard(self, staged_dataset: Dataset, dataset: Dataset) -> None:
+        """
+        This method removes the scratch copy of a dataset without writing anything back (e.g. rejected datasets).
+        """
+        if staged_dataset is not dataset and os.path.isdir(staged_dataset.basepath):
+            shutil.rmtree(staged_dataset.basepath)
+
+
+    def cancel_prefetch(self, dataset: Dataset) -> None:
+        """
+        This method removes the scratch copy of a prefetched dataset that is not processed now (e.g. it has been deferred
+        because of missing disk space). It waits for the copy if it is still running.
+        """
+        self.prefetched_datasets.pop(dataset.name, None)
+        prefetch = self.prefetches.pop(dataset.name, None)
+        if prefetch is None:
+            return
+        try:
+            scratch_dataset_path = prefetch.result()
+        except OSError:
+            return
+        if os.path.isdir(scratch_dataset_path):
+            shutil.rmtree(scratch_dataset_path)
+
+
+    def wait(self) -> None:
+        """
+        This method waits until all results have been written back.
+        """
+        with self.write_backs_lock:
+            write_backs = list(self.write_backs)
+            self.write_backs = []
+            self.pending_write_backs = {}
+        for write_back in write_backs:
+            write_back.result()
+
+
+def get_latest_mtime(folder_path: str) -> float:
+    """
+    This function returns the latest modification time of the files in the folder and its sub folders (0 if the folder
+    does not exist or is empty).
+    """
+    latest_mtime = 0.0
+    for root, _, file_names in os.walk(folder_path):
+        for file_name in file_names:
+            try:
+                latest_mtime = max(latest_mtime, os.path.getmtime(os.path.join(root, file_name)))
+            except OSError:
+                pass
+    return latest_mtime
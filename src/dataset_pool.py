@@ -0,0 +1,382 @@
+import multiprocessing
+import os
+import queue
+import time
+from typing import Callable, Dict, List, Optional
+
+# psutil is optional. Without it the free memory is not checked and the CPU load is taken from the load average.
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from data.dataset import Dataset, HelperMode
+from data.dataset_exceptions import DatasetRejectedError
+from data.dataset_helper import DatasetHelper
+from data.job_queue import JobQueue
+from disk_admission import DiskAdmission
+from eta_model import EtaTracker
+from logger import Logger
+from settings.settings import settings
+
+
+class QueueLogger(Logger):
+    def __init__(self, message_queue, dataset_name: str):
+        # The logger of a worker process sends all messages to the parent process (which writes the log file)
+        self.message_queue = message_queue
+        self.dataset_name  = dataset_name
+
+    def log(self, message):
+        self.message_queue.put(('log', self.dataset_name, message))
+
+
+class QueueWindow():
+    def __init__(self, message_queue, dataset_name: str):
+        # The window of a worker process sends the task information and progress to the parent process
+        self.message_queue = message_queue
+        self.dataset_name  = dataset_name
+        self.last_progress_time = 0
+
+    def update_task_info(self, task_name: str, current_task: int, task_amount: int):
+        self.message_queue.put(('task', self.dataset_name, task_name, current_task, task_amount))
+
+    def update_current_dataset_task_progress(self, value: float):
+        # Send the progress at most once per second (Metashape reports the progress very often)
+        if time.time() - self.last_progress_time > 1:
+            self.last_progress_time = time.time()
+            self.message_queue.put(('progress', self.dataset_name, value))
+
+    def reset_current_dataset_task_progressbar(self):
+        self.message_queue.put(('progress', self.dataset_name, 0))
+
+
+class DatasetWorker():
+    def __init__(self, dataset: Dataset, process, slot: int, start_event) -> None:
+        self.dataset     = dataset
+        self.process     = process
+        self.slot        = slot
+        self.start_event = start_event
+        self.start_time  = time.time()
+
+        # Weight of the stage that is running and the stage that waits to be started (name, weight)
+        self.weight = 0.0
+        self.requested_stage = None
+        self.requested_time  = 0.0
+
+
+def run_dataset_worker(
+        task_name: str,
+        dataset_path: str,
+        helper_mode: HelperMode,
+        input_folder: str,
+        output_folder: str,
+        parent_settings: dict,
+        cpus: Optional[List[int]],
+        message_queue,
+        start_event
+    ) -> None:
+    """
+    This function calculates/exports one dataset in a worker process. Every stage waits until the parent process allows
+    it to start. Logs, progress and the result are sent to the parent process through the message queue.
+    """
+    # Use the settings of the parent process
+    settings.update(parent_settings)
+
+    dataset_name = os.path.basename(dataset_path)
+    logger = QueueLogger(message_queue, dataset_name)
+    window = QueueWindow(message_queue, dataset_name)
+
+    def wait_for_stage_start(stage, parameters, stage_number, stage_amount):
+        # Ask the parent process to start the stage and wait until it has enough resources
+        start_event.clear()
+        message_queue.put(('stage', dataset_name, stage.name, stage.weight))
+        start_event.wait()
+
+    try:
+        # Pin the worker to its cpus
+        if cpus is not None:
+            set_cpu_affinity(cpus)
+
+        # Metashape is only imported in the worker process
+        from metashape_helper import MetashapeHelper
+
+        # Create the dataset again (datasets cannot be sent to other processes because of their metadata loader)
+        dataset_helper = DatasetHelper(logger, input_folder, output_folder, helper_mode)
+        dataset = dataset_helper.create_dataset_object(dataset_path)
+
+        # Calculate/export the dataset
+        metashape_helper = MetashapeHelper(dataset, window, logger)
+        metashape_helper.before_stage_hooks.append(wait_for_stage_start)
+        getattr(metashape_helper, task_name)()
+        message_queue.put(('done', dataset_name, None, None))
+    except DatasetRejectedError as e:
+        message_queue.put(('done', dataset_name, 'rejected', str(e)))
+    except Exception as e:
+        message_queue.put(('done', dataset_name, 'failed', f'{type(e).__name__}: {e}'))
+
+
+def set_cpu_affinity(cpus: List[int]) -> None:
+    """
+    This function restricts the current process (and the processes it starts) to the given cpus.
+    """
+    if psutil is not None:
+        psutil.Process().cpu_affinity(cpus)
+    elif hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+
+class DatasetPool():
+    def __init__(
+            self,
+            dataset_helper: DatasetHelper,
+            window,
+            logger: Logger,
+            task_name: str,
+            job_queue: Optional[JobQueue] = None,
+            eta_tracker: Optional[EtaTracker] = None,
+            disk_admission: Optional[DiskAdmission] = None
+        ) -> None:
+        self.dataset_helper = dataset_helper
+        self.window         = window
+        self.logger         = logger
+
+        # Tracks the stages and the progress of all workers for the batch ETA
+        self.eta_tracker = eta_tracker
+
+        # Defers datasets until there is enough free disk space for them
+        self.disk_admission = disk_admission
+
+        # Shared job queue, a dataset is only started if it can be claimed (other helpers may process it)
+        self.job_queue = job_queue
+
+        # Name of the MetashapeHelper method that is executed for every dataset ('calculate' or 'export')
+        self.task_name = task_name
+
+        # Worker processes are spawned (forking a process with Metashape or tkinter loaded is not safe)
+        self.context       = multiprocessing.get_context('spawn')
+        self.message_queue = self.context.Queue()
+        self.workers: Dict[str, DatasetWorker] = {}
+
+        # Dataset whose task and progress is shown in the window (the one that started a stage last)
+        self.shown_dataset_name = None
+
+        # Measured free memory (GB) and cpu load (percent), None if unknown
+        self.free_memory = None
+        self.cpu_load    = None
+        if psutil is not None:
+            psutil.cpu_percent(interval=None)
+
+
+    def run(self, datasets: List[Dataset], on_dataset_finished: Callable) -> None:
+        """
+        This method calculates/exports the datasets in worker processes and returns when all of them are finished.
+        At most parallel_worker_count datasets are processed at the same time. Every stage of a dataset is only started
+        if the weights of the running stages, the free memory and the cpu load leave room for it.
+        Datasets without enough free disk space are deferred until running datasets have finished. If they do not fit
+        when no dataset is running, they are left in the input folder.
+        on_dataset_finished(dataset, error_type, error_message) is called for every dataset in this process
+        (error_type is None, 'rejected', 'failed', 'claimed' or 'deferred').
+        """
+        waiting_datasets = list(datasets)
+        while len(waiting_datasets) > 0 or len(self.workers) > 0:
+            self.update_resources()
+
+            # Start new datasets while there are free workers
+            while len(waiting_datasets) > 0 and self.can_start_dataset():
+                dataset = self.pop_admitted_dataset(waiting_datasets)
+                if dataset is None:
+                    break
+                if self.job_queue is not None and not (self.job_queue.claim(dataset) and os.path.isdir(dataset.basepath)):
+                    self.logger.log(f"{dataset.name}: Claimed or already processed by another helper")
+                    on_dataset_finished(dataset, 'claimed', None)
+                    continue
+                if self.job_queue is not None:
+                    self.job_queue.mark_document_opened(dataset)
+                self.start_worker(dataset)
+
+            # Datasets that do not fit on the disk while no dataset is running will not fit later either
+            if len(waiting_datasets) > 0 and len(self.workers) == 0:
+                for dataset in waiting_datasets:
+                    on_dataset_finished(dataset, 'deferred', "Not enough free disk space")
+                waiting_datasets = []
+
+            # Start the requested stages in the order they were requested
+            for worker in sorted(self.workers.values(), key=lambda worker: worker.requested_time):
+                if worker.requested_stage is not None and self.can_start_stage(worker.requested_stage[1]):
+                    self.start_stage(worker)
+
+            # Handle the messages of the workers
+            self.handle_messages(1, on_dataset_finished)
+
+            # Handle workers that exited without a result (e.g. Metashape crashed). The messages are read again first
+            # because the result of a worker can arrive after its process has exited.
+            exited_workers = [worker for worker in self.workers.values() if not worker.process.is_alive()]
+            if len(exited_workers) > 0:
+                self.handle_messages(0, on_dataset_finished)
+            for worker in exited_workers:
+                if worker.dataset.name in self.workers:
+                    self.finish_worker(worker, 'failed', f"Worker process exited with code {worker.process.exitcode}", on_dataset_finished)
+
+
+    def pop_admitted_dataset(self, waiting_datasets: List[Dataset]) -> Optional[Dataset]:
+        # Remove and return the first waiting dataset that fits on the disk (deferred datasets keep their place)
+        if self.disk_admission is None:
+            return waiting_datasets.pop(0)
+        reserved_bytes = self.disk_admission.get_reserved_bytes([worker.dataset for worker in self.workers.values()])
+        for dataset in waiting_datasets:
+            if self.disk_admission.admit(dataset, reserved_bytes):
+                waiting_datasets.remove(dataset)
+                return dataset
+        return None
+
+
+    def start_worker(self, dataset: Dataset) -> None:
+        # Use the first free slot (every slot has its own cpus)
+        used_slots = {worker.slot for worker in self.workers.values()}
+        slot = min(set(range(settings.get('parallel_worker_count'))) - used_slots)
+        cpus = self.get_slot_cpus(slot) if settings.get('use_cpu_affinity') else None
+
+        # Start the worker process
+        start_event = self.context.Event()
+        process = self.context.Process(
+            target=run_dataset_worker,
+            args=(
+                self.task_name,
+                dataset.basepath,
+                self.dataset_helper.helper_mode,
+                self.dataset_helper.input_folder,
+                self.dataset_helper.output_folder,
+                dict(settings),
+                cpus,
+                self.message_queue,
+                start_event
+            ),
+            name=dataset.name
+        )
+        process.start()
+        self.workers[dataset.name] = DatasetWorker(dataset, process, slot, start_event)
+
+        cpus_text = f" on cpus {cpus[0]}-{cpus[-1]}" if cpus is not None else ""
+        self.logger.log(f"{dataset.name}: Started worker {slot + 1}{cpus_text}")
+
+
+    def start_stage(self, worker: DatasetWorker) -> None:
+        # Allow the worker to start its stage and show the dataset in the window
+        stage_name, stage_weight = worker.requested_stage
+        worker.weight = stage_weight
+        worker.requested_stage = None
+        worker.start_event.set()
+        if self.eta_tracker is not None:
+            self.eta_tracker.start_stage(worker.dataset.name, stage_name)
+
+        self.shown_dataset_name = worker.dataset.name
+        self.window.current_dataset_name_dynamic_label.configure(text=worker.dataset.name)
+
+
+    def handle_messages(self, timeout: float, on_dataset_finished: Callable) -> None:
+        # Wait for the first message (at most timeout seconds) and handle all messages that are available
+        try:
+            message = self.message_queue.get(timeout=timeout) if timeout > 0 else self.message_queue.get_nowait()
+            while True:
+                self.handle_message(message, on_dataset_finished)
+                message = self.message_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+
+    def handle_message(self, message: tuple, on_dataset_finished: Callable) -> None:
+        message_type, dataset_name = message[0], message[1]
+        worker = self.workers.get(dataset_name)
+        if worker is None:
+            return
+
+        if message_type == 'log':
+            # Write the log message of the worker (prefixed with the dataset because the logs are interleaved)
+            self.logger.log(f"{dataset_name}: {message[2]}")
+        elif message_type == 'stage':
+            # The worker waits to start the next stage, the previous stage does not use resources anymore
+            worker.weight = 0.0
+            worker.requested_stage = (message[2], message[3])
+            worker.requested_time  = time.time()
+        elif message_type == 'task' and dataset_name == self.shown_dataset_name:
+            self.window.update_task_info(message[2], message[3], message[4])
+        elif message_type == 'progress':
+            # The ETA uses the progress of all workers, the window shows the progress of one dataset
+            if self.eta_tracker is not None:
+                self.eta_tracker.update_progress(dataset_name, message[2])
+            if dataset_name != self.shown_dataset_name:
+                return
+            if message[2] == 0:
+                self.window.reset_current_dataset_task_progressbar()
+            else:
+                self.window.update_current_dataset_task_progress(message[2])
+        elif message_type == 'done':
+            self.finish_worker(worker, message[2], message[3], on_dataset_finished)
+
+
+    def finish_worker(self, worker: DatasetWorker, error_type: Optional[str], error_message: Optional[str], on_dataset_finished: Callable) -> None:
+        # Remove the worker and wait until its process has exited
+        del self.workers[worker.dataset.name]
+        worker.process.join()
+
+        # Log the result
+        elapsed_time_string = self.logger.get_elapsed_time_string(worker.start_time)
+        if error_type is None:
+            self.logger.log(f"{worker.dataset.name}: Finished dataset! Elapsed time: {elapsed_time_string}")
+        else:
+            self.logger.log(f"{worker.dataset.name}: Dataset {error_type}: {error_message}")
+
+        on_dataset_finished(worker.dataset, error_type, error_message)
+
+
+    def update_resources(self) -> None:
+        # Measure the free memory and the cpu load (since the last measurement)
+        if psutil is not None:
+            self.free_memory = psutil.virtual_memory().available / 1024**3
+            self.cpu_load    = psutil.cpu_percent(interval=None)
+        elif hasattr(os, 'getloadavg'):
+            self.cpu_load    = 100 * os.getloadavg()[0] / (os.cpu_count() or 1)
+
+
+    def has_free_resources(self) -> bool:
+        # Check the free memory and the cpu load (unknown values do not limit the pool)
+        if self.free_memory is not None and self.free_memory < settings.get('parallel_min_free_memory'):
+            return False
+        if self.cpu_load is not None and self.cpu_load > settings.get('parallel_max_cpu_load'):
+            return False
+        return True
+
+
+    def can_start_dataset(self) -> bool:
+        # A new dataset needs a free worker and free resources (the first dataset is always started)
+        if len(self.workers) >= settings.get('parallel_worker_count'):
+            return False
+        return len(self.workers) == 0 or self.has_free_resources()
+
+
+    def can_start_stage(self, stage_weight: float) -> bool:
+        # A stage can always start if no other stage is running, so every dataset makes progress
+        used_weight = sum(worker.weight for worker in self.workers.values())
+        if used_weight == 0:
+            return True
+        if used_weight + stage_weight > settings.get('parallel_max_weight'):
+            return False
+        return self.has_free_resources()
+
+
+    def get_slot_cpus(self, slot: int) -> List[int]:
+        # Split the cpus evenly between the worker slots
+        cpu_count = os.cpu_count() or 1
+        cpus_per_worker = max(1, cpu_count // settings.get('parallel_worker_count'))
+        first_cpu = (slot * cpus_per_worker) % cpu_count
+        return [(first_cpu + cpu) % cpu_count for cpu in range(cpus_per_worker)]
+
+
+    def terminate(self) -> None:
+        """
+        This method stops all worker processes (e.g. when the helper is closed).
+        """
+        for worker in list(self.workers.values()):
+            worker.process.terminate()
+            worker.process.join()
+        self.workers = {}
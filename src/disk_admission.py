@@ -0,0 +1,123 @@
+import os
+import shutil
+from typing import List, Set
+
+from data.dataset import Dataset, HelperMode
+from eta_model import EtaModel
+from logger import Logger
+from parameter_planner import ParameterPlanner
+from run_history import get_folder_size
+from settings.settings import settings
+
+# Estimate without run history: bytes per depth map pixel and the size of the model and the texture
+FALLBACK_DEPTHMAP_BYTES_PER_PIXEL = 4
+FALLBACK_MODEL_BYTES = 1024**3
+
+
+class DiskAdmission():
+    def __init__(self, eta_model: EtaModel, helper_mode: HelperMode, logger: Logger, folder_path: str, scratch_stager=None) -> None:
+        self.eta_model   = eta_model
+        self.helper_mode = helper_mode
+        self.logger      = logger
+
+        # Folder the documents are written to (the input folder or the scratch folder)
+        self.folder_path = folder_path
+
+        # The copies of the scratch stager that are still running write to the disk as well (None without staging)
+        self.scratch_stager = scratch_stager
+
+        # Datasets that have been deferred (logged only once until they are admitted)
+        self.deferred_dataset_names: Set[str] = set()
+
+
+    def admit(self, dataset: Dataset, reserved_bytes: float = 0.0) -> bool:
+        """
+        This method returns whether there is enough free disk space to start the dataset: its estimated peak disk usage,
+        the space reserved by running datasets and by running copies to and from the scratch folder and disk_min_free_gb
+        must fit into the free space. Datasets that do not
+        fit are logged and should be deferred (not failed), they can be started as soon as enough space is free.
+        """
+        if not settings.get('use_disk_admission'):
+            return True
+
+        needed_bytes, free_bytes = self.get_needed_and_free_bytes(dataset, reserved_bytes)
+        if needed_bytes <= free_bytes:
+            if dataset.name in self.deferred_dataset_names:
+                self.deferred_dataset_names.discard(dataset.name)
+                self.logger.log(f"{dataset.name}: Enough free disk space, no longer deferred")
+            return True
+
+        if dataset.name not in self.deferred_dataset_names:
+            self.deferred_dataset_names.add(dataset.name)
+            self.logger.log(
+                f"{dataset.name}: Deferred, needs {needed_bytes / 1024**3:.1f} GB of disk space in '{self.folder_path}' "
+                f"(including {settings.get('disk_min_free_gb')} GB that are kept free) but only {free_bytes / 1024**3:.1f} GB are free"
+            )
+        return False
+
+
+    def fits(self, dataset: Dataset, reserved_bytes: float = 0.0) -> bool:
+        """
+        This method returns whether the dataset would be admitted without logging anything (e.g. to decide whether the
+        next dataset can already be staged).
+        """
+        if not settings.get('use_disk_admission'):
+            return True
+        needed_bytes, free_bytes = self.get_needed_and_free_bytes(dataset, reserved_bytes)
+        return needed_bytes <= free_bytes
+
+
+    def get_needed_and_free_bytes(self, dataset: Dataset, reserved_bytes: float):
+        # The dataset, the reserved space, the outstanding copies of the scratch stager (except the prefetch of the
+        # dataset itself, it is part of its estimate) and disk_min_free_gb must fit into the free space
+        needed_bytes = self.estimate_peak_disk_usage(dataset) + reserved_bytes + settings.get('disk_min_free_gb') * 1024**3
+        if self.scratch_stager is not None:
+            needed_bytes += self.scratch_stager.get_outstanding_bytes(self.folder_path, [dataset.name])
+        return needed_bytes, shutil.disk_usage(self.folder_path).free
+
+
+    def estimate_peak_disk_usage(self, dataset: Dataset) -> float:
+        """
+        This method returns the estimated largest disk usage of the dataset while it is processed (bytes). The run
+        history is used if datasets have been processed before, otherwise the size of the depth maps is estimated from
+        the image count and resolution. Datasets that are copied to the scratch folder also need the space of the copy.
+        """
+        peak_disk_usage = self.eta_model.predict_peak_disk_usage(dataset, self.helper_mode)
+        if peak_disk_usage is None:
+            peak_disk_usage = self.estimate_peak_disk_usage_without_history(dataset)
+        if self.folder_path == settings.get('scratch_folder_path'):
+            peak_disk_usage += get_files_size(dataset.images)
+        return peak_disk_usage
+
+
+    def estimate_peak_disk_usage_without_history(self, dataset: Dataset) -> float:
+        # The depth maps (calculation only) and the model are the largest parts of the document
+        if self.helper_mode == HelperMode.EXPORT:
+            return FALLBACK_MODEL_BYTES
+        image_width, image_height = dataset.image_size if dataset.image_size is not None else (0, 0)
+        parameter_plan, _ = ParameterPlanner(dataset).plan()
+        depthmap_pixels = len(dataset.images) * image_width * image_height / parameter_plan['depthmap_downscale']**2
+        return depthmap_pixels * FALLBACK_DEPTHMAP_BYTES_PER_PIXEL + FALLBACK_MODEL_BYTES
+
+
+    def get_reserved_bytes(self, datasets: List[Dataset]) -> float:
+        """
+        This method returns the disk space the running datasets will still need: their estimated peak disk usage minus
+        the size of their model folders.
+        """
+        reserved_bytes = 0.0
+        for dataset in datasets:
+            used_bytes = get_folder_size(dataset.model_folder_path) or 0
+            reserved_bytes += max(self.estimate_peak_disk_usage(dataset) - used_bytes, 0.0)
+        return reserved_bytes
+
+
+def get_files_size(file_paths: List[str]) -> int:
+    # Size of the files (missing files are skipped)
+    files_size = 0
+    for file_path in file_paths:
+        try:
+            files_size += os.path.getsize(file_path)
+        except OSError:
+            pass
+    return files_size
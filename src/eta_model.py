@@ -0,0 +1,312 @@
+import datetime
+import json
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data.dataset import Dataset, HelperMode
+from logger import Logger
+from run_history import RunHistory, get_dataset_features
+from settings.settings import settings
+from stages.metashape_stages import stage_registry
+
+# Amount of the latest stage runs the model is fitted with
+ETA_SAMPLE_LIMIT = 5000
+
+# Minimum time between two updates of the batch ETA in the window (seconds)
+ETA_UPDATE_INTERVAL = 1.0
+
+
+def get_feature_vector(features: dict) -> np.ndarray:
+    """
+    This function returns the values the duration of a stage is assumed to be linear in: a constant part, the image
+    count, the processed megapixels (less with a higher depth map downscale), smoothing and the texture area.
+    """
+    downscale = max(1, features['depthmap_downscale'])
+    return np.array([
+        1.0,
+        features['image_count'],
+        features['image_count'] * features['megapixels'] / downscale**2,
+        1.0 if features['use_smooth'] else 0.0,
+        (features['image_texture_size'] / 1024)**2,
+    ])
+
+
+def fit_non_negative(feature_vectors: np.ndarray, durations: np.ndarray) -> np.ndarray:
+    """
+    This function fits the coefficients with least squares. Features with a negative coefficient are removed and the
+    rest is fitted again, so a stage never gets faster with more images or pixels (important when extrapolating to
+    datasets that are larger than the ones in the history).
+    """
+    coefficients = np.zeros(feature_vectors.shape[1])
+    used_features = list(range(feature_vectors.shape[1]))
+    while len(used_features) > 0:
+        fitted_coefficients = np.linalg.lstsq(feature_vectors[:, used_features], durations, rcond=None)[0]
+        if (fitted_coefficients >= 0).all():
+            coefficients[used_features] = fitted_coefficients
+            break
+        used_features.pop(int(np.argmin(fitted_coefficients)))
+    return coefficients
+
+
+class FeatureModel():
+    def __init__(self, feature_vectors: np.ndarray, values: np.ndarray) -> None:
+        # Fit the coefficients with least squares if there are enough samples. Otherwise the median value per image
+        # is used. The values are the durations of a stage or the disk usage of a dataset.
+        self.coefficients = None
+        self.value_per_image = None
+        if len(values) >= 2 * feature_vectors.shape[1]:
+            self.coefficients = fit_non_negative(feature_vectors, values)
+        else:
+            image_counts = np.maximum(feature_vectors[:, 1], 1)
+            self.value_per_image = float(np.median(values / image_counts))
+
+    def predict(self, features: dict) -> float:
+        feature_vector = get_feature_vector(features)
+        if self.coefficients is not None:
+            value = float(feature_vector @ self.coefficients)
+        else:
+            value = self.value_per_image * max(feature_vector[1], 1)
+        return max(value, 0.0)
+
+
+class EtaModel():
+    def __init__(self, run_history: Optional[RunHistory]) -> None:
+        # One duration model per stage, fitted from the stage runs in the run history
+        self.stage_models: Dict[str, FeatureModel] = {}
+
+        # One disk usage model per helper mode, fitted from the size of the model folders after completed dataset runs
+        # and from their largest size while they were processed
+        self.disk_models: Dict[str, FeatureModel] = {}
+        self.peak_disk_models: Dict[str, FeatureModel] = {}
+
+        if run_history is not None:
+            self.fit(run_history.get_stage_samples(ETA_SAMPLE_LIMIT))
+            for helper_mode in HelperMode:
+                self.fit_disk_usage(helper_mode, run_history.get_disk_samples(helper_mode.name.lower(), ETA_SAMPLE_LIMIT))
+
+
+    def fit(self, samples) -> None:
+        """
+        This method fits the duration model of every stage from the samples (stage_name, wall_time, features json).
+        """
+        stage_samples: Dict[str, Tuple[list, list]] = {}
+        for sample in samples:
+            feature_vectors, durations = stage_samples.setdefault(sample['stage_name'], ([], []))
+            feature_vectors.append(get_feature_vector(json.loads(sample['features'])))
+            durations.append(sample['wall_time'])
+
+        for stage_name, (feature_vectors, durations) in stage_samples.items():
+            self.stage_models[stage_name] = FeatureModel(np.array(feature_vectors), np.array(durations))
+
+
+    def fit_disk_usage(self, helper_mode: HelperMode, samples) -> None:
+        """
+        This method fits the disk usage models of the helper mode from the samples (disk_bytes, peak_disk_bytes, features json).
+        """
+        for disk_models, column_name in [(self.disk_models, 'disk_bytes'), (self.peak_disk_models, 'peak_disk_bytes')]:
+            column_samples = [sample for sample in samples if sample[column_name] is not None]
+            if len(column_samples) == 0:
+                continue
+            feature_vectors = np.array([get_feature_vector(json.loads(sample['features'])) for sample in column_samples])
+            disk_bytes = np.array([sample[column_name] for sample in column_samples], dtype=float)
+            disk_models[helper_mode.name] = FeatureModel(feature_vectors, disk_bytes)
+
+
+    def predict_stage(self, stage_name: str, features: dict) -> Optional[float]:
+        """
+        This method returns the predicted duration of the stage in seconds or None if the stage has never been run.
+        """
+        stage_model = self.stage_models.get(stage_name)
+        return stage_model.predict(features) if stage_model is not None else None
+
+
+    def predict_dataset(self, dataset: Dataset, helper_mode: HelperMode) -> List[Tuple[str, Optional[float]]]:
+        """
+        This method returns the stages the dataset will run through together with their predicted durations.
+        """
+        features = get_dataset_features(dataset)
+        return [(stage_name, self.predict_stage(stage_name, features)) for stage_name in get_planned_stage_names(dataset, helper_mode)]
+
+
+    def predict_disk_usage(self, dataset: Dataset, helper_mode: HelperMode) -> Optional[float]:
+        """
+        This method returns the predicted size of the model folder after the dataset has been processed (bytes) or
+        None if no dataset has been processed in this helper mode.
+        """
+        disk_model = self.disk_models.get(helper_mode.name)
+        return disk_model.predict(get_dataset_features(dataset)) if disk_model is not None else None
+
+
+    def predict_peak_disk_usage(self, dataset: Dataset, helper_mode: HelperMode) -> Optional[float]:
+        """
+        This method returns the predicted largest size of the model folder while the dataset is processed (bytes) or
+        None if no dataset has been processed in this helper mode.
+        """
+        peak_disk_model = self.peak_disk_models.get(helper_mode.name)
+        return peak_disk_model.predict(get_dataset_features(dataset)) if peak_disk_model is not None else None
+
+
+def get_planned_stage_names(dataset: Dataset, helper_mode: HelperMode) -> List[str]:
+    # Stages of the dataset like in MetashapeHelper (the stage conditions only depend on the dataset and the settings)
+    if helper_mode == HelperMode.EXPORT:
+        stage_names = settings.get('export_stages')
+    elif dataset.uses_fused_export():
+        stage_names = settings.get('calculation_stages') + settings.get('export_stages')
+    else:
+        stage_names = settings.get('calculation_stages')
+    return [stage.name for stage in stage_registry.resolve(stage_names, SimpleNamespace(dataset=dataset))]
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    # Format a remaining time as h:mm:ss (days are written out)
+    if seconds is None:
+        return "unknown"
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+class EtaTracker():
+    def __init__(self, eta_model: EtaModel, window, logger: Logger, helper_mode: HelperMode) -> None:
+        self.eta_model   = eta_model
+        self.window      = window
+        self.logger      = logger
+        self.helper_mode = helper_mode
+
+        # Predicted stages of the datasets that are not finished (dataset name -> [(stage name, predicted duration)])
+        self.dataset_stages: Dict[str, List[Tuple[str, Optional[float]]]] = {}
+
+        # Running stage of every dataset (stage index, start time, progress 0 - 1)
+        self.running_stages: Dict[str, Tuple[int, float, float]] = {}
+
+        # The tracker is updated from the helper thread and the callbacks of Metashape
+        self.lock = threading.Lock()
+        self.last_update_time = 0.0
+
+
+    def add_datasets(self, datasets: List[Dataset]) -> None:
+        """
+        This method adds the datasets to the batch and logs the predicted batch duration.
+        """
+        with self.lock:
+            for dataset in datasets:
+                self.dataset_stages[dataset.name] = self.eta_model.predict_dataset(dataset, self.helper_mode)
+        self.log_batch_eta()
+        self.update_window(force=True)
+
+
+    def attach(self, metashape_helper, dataset_name: str) -> None:
+        # Track the stages and the progress of the helper
+        metashape_helper.before_stage_hooks.append(
+            lambda stage, parameters, stage_number, stage_amount: self.start_stage(dataset_name, stage.name)
+        )
+        metashape_helper.progress_hooks.append(lambda value: self.update_progress(dataset_name, value))
+
+
+    def start_stage(self, dataset_name: str, stage_name: str) -> None:
+        """
+        This method is called when a stage of the dataset starts. It logs the predicted remaining time.
+        """
+        with self.lock:
+            stage_names = [name for name, _ in self.dataset_stages.get(dataset_name, [])]
+            if stage_name not in stage_names:
+                return
+            self.running_stages[dataset_name] = (stage_names.index(stage_name), time.time(), 0.0)
+            stage_remaining_time   = self.get_stage_remaining_time(dataset_name)
+            dataset_remaining_time = self.get_dataset_remaining_time(dataset_name)
+
+        # The logs of parallel datasets are prefixed with the dataset name (like the logs of the dataset pool)
+        prefix = f"{dataset_name}: " if settings.get('parallel_worker_count') > 1 else ""
+        self.logger.log(
+            f"{prefix}      ETA: stage {format_eta(stage_remaining_time)}, dataset {format_eta(dataset_remaining_time)}, "
+            f"batch {self.get_batch_eta_text()}"
+        )
+        self.update_window(force=True)
+
+
+    def update_progress(self, dataset_name: str, value: float) -> None:
+        # Metashape reports the progress of the running stage (0 - 100)
+        with self.lock:
+            if dataset_name not in self.running_stages:
+                return
+            stage_index, start_time, _ = self.running_stages[dataset_name]
+            self.running_stages[dataset_name] = (stage_index, start_time, min(max(value / 100, 0.0), 1.0))
+        self.update_window()
+
+
+    def finish_dataset(self, dataset_name: str) -> None:
+        # Remove the dataset from the batch (processed, rejected or failed)
+        with self.lock:
+            self.dataset_stages.pop(dataset_name, None)
+            self.running_stages.pop(dataset_name, None)
+        self.update_window(force=True)
+
+
+    def get_stage_remaining_time(self, dataset_name: str) -> Optional[float]:
+        """
+        This method returns the remaining time of the running stage. The prediction is blended with the extrapolation
+        of the progress: the further the stage is, the more the measured progress counts.
+        """
+        stage_index, start_time, progress = self.running_stages[dataset_name]
+        predicted_duration = self.dataset_stages[dataset_name][stage_index][1]
+        elapsed_time = time.time() - start_time
+        if progress <= 0.01:
+            return max(predicted_duration - elapsed_time, 0.0) if predicted_duration is not None else None
+
+        extrapolated_duration = elapsed_time / progress
+        if predicted_duration is None:
+            return max(extrapolated_duration - elapsed_time, 0.0)
+        estimated_duration = (1 - progress) * predicted_duration + progress * extrapolated_duration
+        return max(estimated_duration - elapsed_time, 0.0)
+
+
+    def get_dataset_remaining_time(self, dataset_name: str) -> Optional[float]:
+        """
+        This method returns the remaining time of the dataset (None if a remaining stage has never been run).
+        """
+        stages = self.dataset_stages[dataset_name]
+        if dataset_name in self.running_stages:
+            stage_index = self.running_stages[dataset_name][0]
+            remaining_time = self.get_stage_remaining_time(dataset_name)
+            remaining_durations = [remaining_time] + [duration for _, duration in stages[stage_index + 1:]]
+        else:
+            remaining_durations = [duration for _, duration in stages]
+        if any(duration is None for duration in remaining_durations):
+            return None
+        return sum(remaining_durations)
+
+
+    def get_batch_remaining_time(self) -> Optional[float]:
+        """
+        This method returns the remaining time of all datasets. If several datasets are processed at the same time,
+        the work is assumed to be split evenly between the workers.
+        """
+        with self.lock:
+            remaining_times = [self.get_dataset_remaining_time(dataset_name) for dataset_name in self.dataset_stages]
+        if any(remaining_time is None for remaining_time in remaining_times):
+            return None
+        worker_count = max(1, min(settings.get('parallel_worker_count'), len(remaining_times)))
+        return sum(remaining_times) / worker_count
+
+
+    def get_batch_eta_text(self) -> str:
+        # Remaining time of the batch and the time it will be finished
+        remaining_time = self.get_batch_remaining_time()
+        if remaining_time is None:
+            return "unknown (not enough run history)"
+        finish_time = datetime.datetime.now() + datetime.timedelta(seconds=remaining_time)
+        return f"{format_eta(remaining_time)} (finished {finish_time.strftime('%a %H:%M')})"
+
+
+    def log_batch_eta(self) -> None:
+        self.logger.log(f"Predicted batch duration: {self.get_batch_eta_text()}")
+
+
+    def update_window(self, force: bool = False) -> None:
+        # Show the batch ETA in the window (at most once per ETA_UPDATE_INTERVAL unless forced)
+        if not force and time.time() - self.last_update_time < ETA_UPDATE_INTERVAL:
+            return
+        self.last_update_time = time.time()
+        self.window.update_batch_eta(self.get_batch_eta_text())
@@ -14,7 +14,7 @@ class HelperWindow():
         
         # Set the title & window size
         self.master.title(title)
-        self.master.geometry("600x155")
+        self.master.geometry("600x180")
         self.master.resizable(False, False)
 
         # Add the logo to the window
@@ -25,10 +25,12 @@ class HelperWindow():
         self.master.grid_columnconfigure(0, weight=1)
 
         # Datasets done section
-        self.datasets_done_progress_frame           = self.tkinter_helper.create_frame(self.master, 0, 0, [0], [1, 7, 1])
+        self.datasets_done_progress_frame           = self.tkinter_helper.create_frame(self.master, 0, 0, [0, 0], [1, 7, 1])
         self.datasets_done_progressbar_static_label = self.tkinter_helper.create_label(self.datasets_done_progress_frame, 0, 0, "Datasets done:", True, False)
         self.datasets_done_progressbar              = self.tkinter_helper.create_progressbar(self.datasets_done_progress_frame, 0, 1, False)
         self.datasets_done_amount_dynamic_label     = self.tkinter_helper.create_label(self.datasets_done_progress_frame, 0, 2, "0 of 0", False, False)
+        self.batch_eta_static_label                 = self.tkinter_helper.create_label(self.datasets_done_progress_frame, 1, 0, "Remaining:", True, False)
+        self.batch_eta_dynamic_label                = self.tkinter_helper.create_label(self.datasets_done_progress_frame, 1, 1, "-", True, False)
 
         # Current dataset section
         self.current_dataset_progress_label_frame          = self.tkinter_helper.create_label_frame(self.master, 1, 0, [0], [1, 7, 1], "Current Dataset:")
@@ -49,6 +51,15 @@ class HelperWindow():
         self.datasets_done_progressbar['value'] += step
         self.datasets_done_amount_dynamic_label.configure(text=f"{processed_datasets} of {available_datasets}")
 
+    def set_datasets_done(self, processed_datasets: int, available_datasets: int):
+        # Set the datasets done (used when the amount of available datasets grows, e.g. in watch mode)
+        self.datasets_done_progressbar['value'] = 100 * processed_datasets / available_datasets if available_datasets > 0 else 0
+        self.datasets_done_amount_dynamic_label.configure(text=f"{processed_datasets} of {available_datasets}")
+
+    def update_batch_eta(self, batch_eta: str):
+        # Update the remaining time of all datasets
+        self.batch_eta_dynamic_label.configure(text=batch_eta)
+
     def update_task_info(self, task_name: str, current_task: int, task_amount: int):
         # Update the current task name and qnumber
         self.current_dataset_task_name_dynamic_label.configure(text=task_name)
@@ -50,6 +50,11 @@ class Logger:
         elapsed_time_string = self.get_elapsed_time_string(start_time)
         self.log(f"      Finished Task! Elapsed time: {elapsed_time_string}")
 
+    def log_document_saved(self, start_time: float):
+        # Get the elapsed saving time and log it
+        elapsed_time_string = self.get_elapsed_time_string(start_time)
+        self.log(f"      Saved document! Elapsed time: {elapsed_time_string}")
+
     def get_elapsed_time_string(self, start_time: float):
         # Get the current time
         end_time = time.time()
@@ -1,10 +1,22 @@
 import os
 import shutil
 import time
+from contextlib import contextmanager
 import Metashape
 
 from data.dataset import Dataset
+from data.dataset_exceptions import DatasetRejectedError
+from data.image_integrity_checker import ImageIntegrityChecker
+from checkpoint import Checkpoint
+from parameter_planner import ParameterPlanner
+from run_history import RunHistory, RunRecorder, get_run_history_file_path
 from settings.settings import settings
+from stages.metashape_stages import stage_registry
+from stages.retention_policy import RetentionPolicy, get_resumable_stage_count
+from stages.stage_runner import StageRunner
+
+# Number of the latest runs of every stage whose average wall time decides if the stage is expensive
+STAGE_DURATION_RUN_LIMIT = 20
 
 
 class MetashapeHelper():
@@ -13,407 +25,187 @@ class MetashapeHelper():
         self.window    = window
         self.logger    = logger
 
+        # Record the metrics of the dataset and its stages in the run history. The measured stage durations decide
+        # which stages are expensive (see StageRunner.is_expensive).
+        self.run_recorder = None
+        self.stage_durations = {}
+        if settings.get('use_run_history'):
+            run_history = RunHistory(get_run_history_file_path())
+            self.run_recorder = RunRecorder(run_history, self)
+            self.stage_durations = run_history.get_stage_durations(STAGE_DURATION_RUN_LIMIT)
+
+        # Additional hooks that are called before every stage (e.g. to wait for free resources in a dataset pool) and
+        # whenever the progress of a stage changes (e.g. to update the ETA)
+        self.before_stage_hooks = []
+        self.progress_hooks = []
+
+        # Matching and depth map parameters of the dataset (planned at the start of the calculation)
+        self.parameter_plan = None
+
         # Create a metashape document
         self.document  = Metashape.Document()
 
-        # Task amounts that need to be done
-        self.task_amount = 0
-        
         # Create the coordinate system
         self.coordinate_system = Metashape.CoordinateSystem('LOCAL_CS["Local Coordinates (mm)",LOCAL_DATUM["Local Datum",0],UNIT["millimetre",0.001,AUTHORITY["EPSG","1025"]]]')
 
 
     def calculate(self):
-        # Delete old file
-        if os.path.isfile(self.dataset.psx_file_path):
-            shutil.rmtree(self.dataset.model_folder_path)
-        
-        # Create new document
-        self.document.save(self.dataset.psx_file_path)
-        # Add a chunk and add a coordinate system
-        self.document.addChunk()
-        self.document.chunk.crs = self.coordinate_system
-
-        # Set the task amount
-        self.task_amount = (1 if settings.get('use_smooth') else 0) + 5
-
-        # Add the photos, the cam poses, the f number and image size
-        self.addPhotos()
-        self.importCameraReferences()
-        self.importCameraCalibration()
-
-        # Go through all calculation tasks
-        self.matchPhotos()
-        self.alignCameras()
-        self.optimizeCameras()
-        self.buildDepthMaps()
-        self.buildModel()
-        
-        # Smooth model only if the use_smooth settings is True
-        if settings.get('use_smooth'):
-            self.smoothModel()
-
-        # Close the document -> Remove lock file manually (metashape does not have a good option for this)
-        self.close_document()
-
-
-    def export(self):
-        if os.path.isfile(self.dataset.psx_file_path):
-            # Load the existing .psx file
-            self.document.open(self.dataset.psx_file_path, read_only=False, ignore_lock=False) 
-
-        # Set the task amount
-        self.task_amount = 3
-
-        # Go through all export tasks
-        self.buildUV()
-        self.buildTexture()
-        self.exportModel()
-
-        # Close the document -> Remove lock file manually (metashape does not have a good option for this)
-        self.close_document()
-        
-        
-    def addPhotos(self):
-        # Log the task start
-        self.logger.log_task_start("Add Photos")
-
-        # Add all photos
-        self.document.chunk.addPhotos(self.dataset.images)
-
-        # Save the document
-        self.document.save()
-
-        # Log task end
-        self.logger.log("      Finished!")
-    
-
-    def importCameraReferences(self):
-        # Log the task start
-        self.logger.log_task_start("Import Camera Reference")
-        
-        # Import the references
-        self.document.chunk.importReference(
-            path   = self.dataset.cam_pos_file_path, 
-            format = Metashape.ReferenceFormatCSV,columns = "nxyz[XYZ]",
-            delimiter = " ", 
-            crs = self.coordinate_system, 
-            skip_rows = 1,
-            ignore_labels = False,
-            create_markers = False
-        )
-        self.document.chunk.updateTransform()
-
-        # Save the document
-        self.document.save()
-
-        # Log task end
-        self.logger.log("      Finished!")
-
-    def importCameraCalibration(self):
-        # Log the task start
-        self.logger.log_task_start("Import Camera Calibration")
-        
-        # Prepare calibration
-        calibration = Metashape.Calibration()
-        calibration.f      = self.dataset.f_number
-        calibration.width  = self.dataset.image_size[0]
-        calibration.height = self.dataset.image_size[1]
-
-        # Apply calibration to all cameras
-        for sensor in self.document.chunk.sensors: 
-            sensor.user_calib = calibration
-        
-        # Save the document
-        self.document.save()
-
-        # Log task end
-        self.logger.log("      Finished!")
-
-
-    def matchPhotos(self):
-        # Clear current task progressbar
-        self.window.reset_current_dataset_task_progressbar()
-
-        # Update current task name and number labels in window
-        self.window.update_task_info("Match Photos", 1, self.task_amount)
-
-        # Save the start time of the task
-        start_time = time.time()
-
-        # Log the task start
-        self.logger.log_task_start("Match Photos")
-
-        # Execute task
-        self.document.chunk.matchPhotos(
-            downscale = settings.get('depthmap_downscale'),
-            generic_preselection     = True,
-            reference_preselection   = True,
-            filter_stationary_points = True,
-            keypoint_limit  = 250000,
-            tiepoint_limit  = 250000,
-            keep_keypoints  = False,
-            guided_matching = False,
-            progress=self.window.update_current_dataset_task_progress
-        )
-
-        # Save the document
-        self.document.save()
-
-        # Log task end
-        self.logger.log_task_finish(start_time)
-
-
-    def alignCameras(self):
-        # Clear current task progressbar
-        self.window.reset_current_dataset_task_progressbar()
-
-        # Update current task name and number labels in window
-        self.window.update_task_info("Align Cameras", 2, self.task_amount)
-
-        # Save the start time of the task 
-        start_time = time.time()
-
-        # Log the task start
-        self.logger.log_task_start("Align Cameras")
-
-        # Execute task
-        self.document.chunk.alignCameras(
-            progress=self.window.update_current_dataset_task_progress
-        )
-        
-        # Save the document
-        self.document.save()
-
-        # Log task end
-        self.logger.log_task_finish(start_time)
-    
-
-    def optimizeCameras(self):
-        # Clear current task progressbar
-        self.window.reset_current_dataset_task_progressbar()
-        # Update current task name and number labels in window
-        self.window.update_task_info("Optimize Cameras", 3, self.task_amount)
-
-        # Save the start time of the task
-        start_time = time.time()
-
-        # Log the task start
-        self.logger.log_task_start("Optimize Cameras")
-
-        # Execute task
-        self.document.chunk.optimizeCameras(
-            fit_f  = True,
-            fit_cx = False,
-            fit_cy = False,
-            fit_b1 = False,
-            fit_b2 = False,
-            fit_k1 = False,
-            fit_k2 = False,
-            fit_k3 = False,
-            fit_k4 = False,
-            fit_p1 = False,
-            fit_p2 = False,
-            fit_corrections     = False,
-            adaptive_fitting    = False,
-            tiepoint_covariance = False,
-            progress=self.window.update_current_dataset_task_progress
-        )
-
-        # Save the document
-        self.document.save()
-
-        # Log task end
-        self.logger.log_task_finish(start_time)
-
-
-    def buildDepthMaps(self):
-        # Clear current task progressbar
-        self.window.reset_current_dataset_task_progressbar()
-        # Update current task name and number labels in window
-        self.window.update_task_info("Build Depthmaps", 4, self.task_amount)
-
-        # Save the start time of the task
-        start_time = time.time()
-
-        # Log the task start
-        self.logger.log_task_start("Build Depth Maps")
-
-        # Execute task
-        self.document.chunk.buildDepthMaps(
-            downscale   = 1,
-            filter_mode = Metashape.MildFiltering,
-            progress=self.window.update_current_dataset_task_progress
-        )
-
-        # Save the document
-        self.document.save()
-
-        # Log task end
-        self.logger.log_task_finish(start_time)
-
-
-    def buildModel(self):
-        # Clear current task progressbar
-        self.window.reset_current_dataset_task_progressbar()
-
-        # Update current task name and number labels in window
-        self.window.update_task_info("Build Model", 5, self.task_amount)
-
-        # Save the start time of the task
-        start_time = time.time()
-
-        # Log the task start
-        self.logger.log_task_start("Build Model")
-
-        # If there are tweaks calculate the model with tweaks
-        if settings.get('use_tweaks') and (len(settings.get('tweaks')) > 0):
-            task = Metashape.Tasks.BuildModel()
-            for tweak in settings.get('tweaks'):
-                task[tweak[0]] = tweak[1]
-            task.face_count  = Metashape.HighFaceCount
-            task.source_data = Metashape.DepthMapsData
-            # Execute task
-            task.apply(
-                object=self.document.chunk,
-                progress=self.window.update_current_dataset_task_progress
+        # Record the dataset and its stages in the run history
+        with self.recordRun('calculation'):
+            # Check the images before anything is changed (rejected datasets are left untouched)
+            self.checkImageIntegrity()
+
+            # Plan the matching and depth map parameters from the image count and resolution
+            self.planParameters()
+
+            # Get all enabled calculation stages in their order. Datasets with a fused export prefix are exported in the same
+            # document right after the calculation.
+            stage_names = settings.get('calculation_stages')
+            if self.dataset.uses_fused_export():
+                stage_names = stage_names + settings.get('export_stages')
+            stages = stage_registry.resolve(stage_names, self)
+
+            # Get the stages that have already been completed with the same inputs
+            checkpoint = Checkpoint(self.dataset.checkpoint_file_path)
+            stage_hashes = checkpoint.create_stage_hashes([(stage.name, stage.get_inputs(self)) for stage in stages])
+            completed_stage_count = checkpoint.get_completed_stage_count(stage_hashes) if settings.get('use_resume') else 0
+
+            # Resume before the stage that creates an intermediate if it has been removed but is needed again
+            completed_stage_names = [stage_name for stage_name, _ in checkpoint.completed_stages]
+            completed_stage_count = get_resumable_stage_count(stages, completed_stage_count, completed_stage_names)
+            can_resume = os.path.isfile(self.dataset.psx_file_path) and completed_stage_count > 0
+
+            if can_resume:
+                # Reopen the existing document and continue with the first stage that has not been completed
+                self.logger.log(f"   Resume after {completed_stage_count} completed stage(s)")
+                self.document.open(self.dataset.psx_file_path, read_only=False, ignore_lock=True)
+                checkpoint.truncate(completed_stage_count)
+            else:
+                # Delete old file
+                if os.path.isfile(self.dataset.psx_file_path):
+                    shutil.rmtree(self.dataset.model_folder_path)
+                checkpoint.truncate(0)
+
+                # Create new document
+                self.document.save(self.dataset.psx_file_path)
+                # Add a chunk and add a coordinate system
+                self.document.addChunk()
+                self.document.chunk.crs = self.coordinate_system
+
+            # Record every stage in the checkpoint after it has been saved
+            stage_hashes = dict(stage_hashes)
+            stage_runner = self.createStageRunner()
+            stage_runner.save_hooks.append(
+                lambda saved_stages: [checkpoint.complete_stage(stage.name, stage_hashes[stage.name]) for stage in saved_stages]
             )
-        else:
-            # Execute task
-            self.document.chunk.buildModel(
-                face_count  = Metashape.HighFaceCount,
-                source_data = Metashape.DepthMapsData,
-                progress=self.window.update_current_dataset_task_progress
-            )
-
-        # Save the document
-        self.document.save()
-
-        # Log task end
-        self.logger.log_task_finish(start_time)
-
 
-    def smoothModel(self):
-        # Clear current task progressbar
-        self.window.reset_current_dataset_task_progressbar()
-
-        # Update current task name and number labels in window
-        self.window.update_task_info("Smooth Model", 6, self.task_amount) 
+            # Remove the intermediates after the last stage that needs them
+            retention_policy = RetentionPolicy(self, stages[completed_stage_count:])
+            stage_runner.cleanup_hooks.append(retention_policy.remove_intermediates)
 
-        # Save the start time of the task
-        start_time = time.time()
-
-        # Log the task start
-        self.logger.log_task_start("Smooth Model")
+            # Go through all stages that have not been completed
+            stage_runner.run(stages[completed_stage_count:], completed_stage_count + 1, len(stages))
 
-        # Execute task
-        self.document.chunk.smoothModel(
-            strength       = 1,
-            fix_borders    = False,
-            preserve_edges = False,
-            progress=self.window.update_current_dataset_task_progress
-        )
+            # Close the document -> Remove lock file manually (metashape does not have a good option for this)
+            self.close_document()
 
-        # Save the document
-        self.document.save()
 
-        # Log task end
-        self.logger.log_task_finish(start_time)
-
-
-    def buildUV(self):
+    def export(self):
+        # Record the dataset and its stages in the run history
+        with self.recordRun('export'):
+            if os.path.isfile(self.dataset.psx_file_path):
+                # Load the existing .psx file
+                self.document.open(self.dataset.psx_file_path, read_only=False, ignore_lock=False) 
+
+            # Go through all export stages
+            stages = stage_registry.resolve(settings.get('export_stages'), self)
+            self.createStageRunner().run(stages)
+
+            # Close the document -> Remove lock file manually (metashape does not have a good option for this)
+            self.close_document()
+
+
+    def createStageRunner(self):
+        # Create a stage runner which shows the current stage and its progress in the window
+        stage_runner = StageRunner(self)
+        stage_runner.stage_durations = self.stage_durations
+        stage_runner.before_stage_hooks.extend(self.before_stage_hooks)
+        stage_runner.before_stage_hooks.append(self.showStage)
+        stage_runner.progress_hooks.append(self.window.update_current_dataset_task_progress)
+        stage_runner.progress_hooks.extend(self.progress_hooks)
+
+        # Record the metrics of every stage in the run history
+        if self.run_recorder is not None:
+            stage_runner.before_stage_hooks.append(self.run_recorder.start_stage)
+            stage_runner.cleanup_hooks.append(self.run_recorder.measure_disk_usage)
+            stage_runner.after_stage_hooks.append(self.run_recorder.finish_stage)
+        return stage_runner
+
+
+    @contextmanager
+    def recordRun(self, helper_mode: str):
+        # Record the dataset run with its status and metrics (nothing is recorded if the run history is disabled)
+        if self.run_recorder is None:
+            yield
+            return
+
+        self.run_recorder.start_dataset(helper_mode)
+        try:
+            yield
+        except DatasetRejectedError as e:
+            self.run_recorder.finish_dataset('rejected', str(e))
+            raise
+        except BaseException as e:
+            self.run_recorder.finish_dataset('failed', f'{type(e).__name__}: {e}')
+            raise
+        self.run_recorder.finish_dataset('completed')
+
+
+    def showStage(self, stage, parameters, stage_number, stage_amount):
         # Clear current task progressbar
         self.window.reset_current_dataset_task_progressbar()
 
         # Update current task name and number labels in window
-        self.window.update_task_info('Build UV', 1, self.task_amount)
-
-        # Save the start time of the task
-        start_time = time.time()
-
-        # Log the task start
-        self.logger.log_task_start("Build UV")
+        self.window.update_task_info(stage.label, stage_number, stage_amount)
 
-        # Store the image_texture size
-        image_texture_size = settings.get('image_texture_size')
 
-        # Execute task
-        self.document.chunk.buildUV(
-            mapping_mode = Metashape.GenericMapping,
-            page_count   = 1,
-            texture_size = image_texture_size,
-            progress=self.window.update_current_dataset_task_progress
-        )
-
-        # Save the document
-        self.document.save()
-
-        # Log task end
-        self.logger.log_task_finish(start_time)
-
-
-    def buildTexture(self):
-        # Clear current task progressbar
-        self.window.reset_current_dataset_task_progressbar()
+    def checkImageIntegrity(self):
+        # Skip the check if it is disabled
+        image_integrity_check = settings.get('image_integrity_check')
+        if image_integrity_check == 'off':
+            return
 
-        # Update current task name and number labels in window
-        self.window.update_task_info('Build Texture', 2, self.task_amount)
-
-        # Save the start time of the task
+        # Log the task start
+        self.logger.log_task_start("Check Image Integrity")
         start_time = time.time()
 
-        # Log the task start
-        self.logger.log_task_start("Build texture")
+        # Check all images in parallel
+        image_integrity_checker = ImageIntegrityChecker(settings.get('image_integrity_worker_count'))
+        corrupt_images, throughput = image_integrity_checker.check_images(self.dataset.images)
+        self.logger.log(f"      Checked {len(self.dataset.images)} images with {throughput:.1f} MB/s, {len(corrupt_images)} corrupt")
 
-        # Execute task
-        self.document.chunk.buildTexture(
-            texture_size    = settings.get('image_texture_size'),
-            ghosting_filter = True,
-            progress=self.window.update_current_dataset_task_progress
-        )
+        # Log every corrupt image
+        for image_path, error in corrupt_images.items():
+            self.logger.log(f"      Corrupt image {os.path.basename(image_path)}: {error}")
 
-        # Save the document
-        self.document.save()
+        # Reject the dataset or exclude the corrupt images
+        if len(corrupt_images) > 0:
+            if image_integrity_check == 'reject':
+                raise DatasetRejectedError(self.dataset.name, f"{len(corrupt_images)} corrupt image(s)")
+            if image_integrity_check == 'exclude':
+                self.dataset.images = [image for image in self.dataset.images if image not in corrupt_images]
+                self.logger.log(f"      Excluded {len(corrupt_images)} corrupt image(s)")
 
         # Log task end
         self.logger.log_task_finish(start_time)
 
 
-    def exportModel(self):
-        # Clear current task progressbar
-        self.window.reset_current_dataset_task_progressbar()
-
-        # Update current task name and number labels in window
-        self.window.update_task_info('Export Model', 3, self.task_amount)
-
-        # Save the start time of the task
-        start_time = time.time()
-
-        # Log the task start
-        self.logger.log_task_start("Export model")
-
-        # Execute task
-        self.document.chunk.exportModel(
-            path            = self.dataset.obj_file_path,
-            binary          = True,
-            precision       = 6,
-            texture_format  = Metashape.ImageFormatPNG,
-            save_texture    = True,
-            save_uv         = True,
-            save_normals    = True,
-            save_colors     = True,
-            save_alpha      = True,
-            colors_rgb_8bit = True,
-            format          = Metashape.ModelFormatOBJ,
-            crs             = self.coordinate_system,
-            progress        = self.window.update_current_dataset_task_progress
-        )
-
-        # Save the document
-        self.document.save()
-
-        # Log task end
-        self.logger.log_task_finish(start_time)
+    def planParameters(self):
+        # Plan the parameters and log them with the reasons
+        self.parameter_plan, reasons = ParameterPlanner(self.dataset).plan()
+        self.logger.log(f"   Planned parameters: {self.parameter_plan}")
+        for reason in reasons:
+            self.logger.log(f"      {reason}")
 
 
     def close_document(self):
@@ -421,6 +213,5 @@ class MetashapeHelper():
         del self.document
 
         # Delete the lock file it it exists (this file is used to check if the document is still opened)
-        lock_file = os.path.join(self.dataset.model_folder_path, f"{self.dataset.name}.files", "Lock")
-        if os.path.exists(lock_file):
-            os.remove(lock_file)
+        if os.path.exists(self.dataset.lock_file_path):
+            os.remove(self.dataset.lock_file_path)
@@ -0,0 +1,114 @@
+import math
+import os
+import re
+from itertools import product
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from data.dataset import Dataset
+from settings.settings import settings
+
+# Elevation and azimuth ring encoded in the edof image names (e.g. image_0002_-70_29.2.png)
+IMAGE_ANGLES_REGEX = r"_(-?[0-9]+(?:\.[0-9]+)?)_(-?[0-9]+(?:\.[0-9]+)?)$"
+
+class PairPreselector():
+    def __init__(self, dataset: Dataset) -> None:
+        self.dataset = dataset
+
+
+    def get_pairs(self) -> List[Tuple[int, int]]:
+        """
+        This method returns the image pairs (indices into dataset.images) that should be matched.
+        Two images are paired if the angle between their viewing directions is at most pair_max_angle and the distance
+        between the cameras is at most pair_max_distance_factor times the median camera distance to the object.
+        """
+        positions = self.get_camera_positions()
+        if positions is None or len(positions) < 2:
+            return []
+
+        # Get the viewing directions (unit vectors from the object center to the cameras) and the camera distances
+        offsets    = positions - self.get_center(positions)
+        distances  = np.linalg.norm(offsets, axis=1)
+        directions = offsets / np.maximum(distances, 1e-12)[:, np.newaxis]
+
+        max_angle    = math.radians(settings.get('pair_max_angle'))
+        max_distance = settings.get('pair_max_distance_factor') * float(np.median(distances))
+
+        # Candidate pairs come from a spatial grid over the viewing directions. The cell size is the chord length of
+        # the maximum angle, so all directions within the angle are in the same or a neighbouring cell.
+        cell_size = max(2 * math.sin(max_angle / 2), 1e-6)
+        grid = self.create_grid(directions, cell_size)
+
+        pairs = []
+        min_cos_angle = math.cos(max_angle)
+        for cell, image_indices in grid.items():
+            # Collect the images of the cell and its 26 neighbours
+            neighbour_indices = []
+            for offset in product((-1, 0, 1), repeat=3):
+                neighbour_cell = (cell[0] + offset[0], cell[1] + offset[1], cell[2] + offset[2])
+                neighbour_indices.extend(grid.get(neighbour_cell, []))
+            neighbour_indices = np.array(neighbour_indices)
+
+            # Check the exact angle and distance of all candidates at once
+            for image_index in image_indices:
+                candidates = neighbour_indices[neighbour_indices > image_index]
+                if len(candidates) == 0:
+                    continue
+                cos_angles = directions[candidates] @ directions[image_index]
+                camera_distances = np.linalg.norm(positions[candidates] - positions[image_index], axis=1)
+                matches = candidates[(cos_angles >= min_cos_angle) & (camera_distances <= max_distance)]
+                pairs.extend((image_index, int(match)) for match in matches)
+
+        return sorted(pairs)
+
+
+    def get_center(self, positions: np.ndarray) -> np.ndarray:
+        """
+        This method returns the center of the sphere the cameras are placed on (least squares fit).
+        The mean of the positions would be biased because the cameras only cover a part of the sphere.
+        """
+        # |p|^2 = 2 p.c + (r^2 - |c|^2) is linear in the center c
+        system = np.hstack([2 * positions, np.ones((len(positions), 1))])
+        values = (positions ** 2).sum(axis=1)
+        solution, _, rank, _ = np.linalg.lstsq(system, values, rcond=None)
+        if rank < 4:
+            return positions.mean(axis=0)
+        return solution[:3]
+
+
+    def create_grid(self, directions: np.ndarray, cell_size: float) -> Dict[Tuple[int, int, int], List[int]]:
+        """
+        This method puts every direction into the grid cell it belongs to.
+        """
+        cells = np.floor(directions / cell_size).astype(int)
+        grid = {}
+        for image_index, cell in enumerate(map(tuple, cells)):
+            grid.setdefault(cell, []).append(image_index)
+        return grid
+
+
+    def get_camera_positions(self) -> Optional[np.ndarray]:
+        """
+        This method returns the camera positions of all images from the cam position file. If an image has no position,
+        the positions are derived from the elevation and azimuth in the image names instead.
+        Returns None if neither is available.
+        """
+        if self.dataset.cam_positions is not None:
+            positions = self.dataset.cam_positions.get_positions(self.dataset.images)
+            if np.isfinite(positions).all():
+                return positions
+
+        # Derive unit positions from the elevation and azimuth ring of the image names
+        positions = []
+        for image_path in self.dataset.images:
+            image_stem = os.path.splitext(os.path.basename(image_path))[0]
+            match = re.search(IMAGE_ANGLES_REGEX, image_stem)
+            if match is None:
+                return None
+            elevation, azimuth = (math.radians(float(angle)) for angle in match.groups())
+            positions.append([
+                math.cos(elevation) * math.cos(azimuth),
+                math.cos(elevation) * math.sin(azimuth),
+                math.sin(elevation)
+            ])
+        return np.array(positions)
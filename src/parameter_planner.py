@@ -0,0 +1,118 @@
+from typing import Dict, List, Tuple
+
+from data.dataset import Dataset
+from settings.settings import settings
+
+# Matching downscales of Metashape (0 = images upscaled by 2) and the factor of the processed pixels
+MATCHING_DOWNSCALES = [0, 1, 2, 4, 8]
+MATCHING_PIXEL_FACTORS = {0: 4.0, 1: 1.0, 2: 1 / 4, 4: 1 / 16, 8: 1 / 64}
+
+# Depth map downscales of Metashape (1 = ultra high quality, 2 = high, 4 = medium, 8 = low)
+DEPTHMAP_DOWNSCALES = [1, 2, 4, 8]
+
+# Keypoints per matched megapixel and the limits of the keypoint and tiepoint limits
+KEYPOINTS_PER_MEGAPIXEL = 10000
+MIN_KEYPOINT_LIMIT = 40000
+MAX_KEYPOINT_LIMIT = 250000
+MIN_TIEPOINT_LIMIT = 10000
+
+# Up to this image count every image keeps the full tiepoint limit (more images overlap more, so fewer tie points per
+# image are needed)
+FULL_TIEPOINT_IMAGE_COUNT = 100
+
+
+class ParameterPlanner():
+    def __init__(self, dataset: Dataset) -> None:
+        self.dataset = dataset
+
+
+    def plan(self) -> Tuple[Dict[str, object], List[str]]:
+        """
+        This method returns the matching and depth map parameters of the dataset and the reasons for them. The downscales
+        are chosen so the estimated time of the matching and the depth maps fits into adaptive_time_budget_minutes:
+        the depth map downscale is increased first (most of the time), then the matching downscale.
+        """
+        image_count = len(self.dataset.images)
+        image_width, image_height = self.dataset.image_size if self.dataset.image_size is not None else (0, 0)
+        megapixels = image_width * image_height / 1e6
+
+        # Without adaptive parameters the fixed parameters are used
+        if not settings.get('use_adaptive_parameters'):
+            parameters = {
+                'matching_downscale':  settings.get('depthmap_downscale'),
+                'keypoint_limit':      MAX_KEYPOINT_LIMIT,
+                'tiepoint_limit':      MAX_KEYPOINT_LIMIT,
+                'depthmap_downscale':  1,
+                'depthmap_filter_mode': 'MildFiltering',
+            }
+            return parameters, ["adaptive parameters are disabled (use_adaptive_parameters)"]
+
+        reasons = []
+
+        # Start with the configured matching downscale, but do not match more megapixels than needed for the alignment
+        matching_downscale = settings.get('depthmap_downscale')
+        max_matching_megapixels = settings.get('adaptive_max_matching_megapixels')
+        while self.get_matching_megapixels(megapixels, matching_downscale) > max_matching_megapixels and matching_downscale < 2:
+            matching_downscale = self.get_next_downscale(MATCHING_DOWNSCALES, matching_downscale)
+        if matching_downscale != settings.get('depthmap_downscale'):
+            reasons.append(
+                f"matching downscale {matching_downscale}: {megapixels:.1f} MP images would be matched with more than "
+                f"{max_matching_megapixels} MP"
+            )
+
+        # Increase the downscales until the estimated time fits into the time budget
+        depthmap_downscale = 1
+        time_budget = settings.get('adaptive_time_budget_minutes') * 60
+        estimated_time = self.estimate_time(image_count, megapixels, matching_downscale, depthmap_downscale)
+        while estimated_time > time_budget:
+            if depthmap_downscale < 4:
+                depthmap_downscale = self.get_next_downscale(DEPTHMAP_DOWNSCALES, depthmap_downscale)
+            elif matching_downscale < 4:
+                matching_downscale = self.get_next_downscale(MATCHING_DOWNSCALES, matching_downscale)
+            elif depthmap_downscale < DEPTHMAP_DOWNSCALES[-1]:
+                depthmap_downscale = self.get_next_downscale(DEPTHMAP_DOWNSCALES, depthmap_downscale)
+            else:
+                reasons.append(f"estimated time {estimated_time / 60:.0f} min exceeds the time budget even with the lowest quality")
+                break
+            new_estimated_time = self.estimate_time(image_count, megapixels, matching_downscale, depthmap_downscale)
+            reasons.append(
+                f"matching downscale {matching_downscale}, depth map downscale {depthmap_downscale}: "
+                f"estimated {estimated_time / 60:.0f} min > time budget {time_budget / 60:.0f} min ({image_count} images, {megapixels:.1f} MP)"
+            )
+            estimated_time = new_estimated_time
+
+        # Limit the keypoints by the matched megapixels and the tiepoints by the image count
+        matching_megapixels = self.get_matching_megapixels(megapixels, matching_downscale)
+        keypoint_limit = int(min(max(matching_megapixels * KEYPOINTS_PER_MEGAPIXEL, MIN_KEYPOINT_LIMIT), MAX_KEYPOINT_LIMIT))
+        reasons.append(f"keypoint limit {keypoint_limit}: {matching_megapixels:.1f} MP are matched per image")
+        tiepoint_limit = keypoint_limit
+        if image_count > FULL_TIEPOINT_IMAGE_COUNT:
+            tiepoint_limit = int(max(keypoint_limit * FULL_TIEPOINT_IMAGE_COUNT / image_count, MIN_TIEPOINT_LIMIT))
+            reasons.append(f"tiepoint limit {tiepoint_limit}: {image_count} overlapping images need fewer tie points per image")
+
+        reasons.append(f"estimated time of the matching and the depth maps: {estimated_time / 60:.0f} min")
+        parameters = {
+            'matching_downscale':   matching_downscale,
+            'keypoint_limit':       keypoint_limit,
+            'tiepoint_limit':       tiepoint_limit,
+            'depthmap_downscale':   depthmap_downscale,
+            'depthmap_filter_mode': 'MildFiltering',
+        }
+        return parameters, reasons
+
+
+    def estimate_time(self, image_count: int, megapixels: float, matching_downscale: int, depthmap_downscale: int) -> float:
+        # Estimate the seconds of the matching and the depth maps from the processed megapixels
+        matching_time = image_count * self.get_matching_megapixels(megapixels, matching_downscale) / settings.get('adaptive_matching_megapixels_per_second')
+        depthmap_time = image_count * megapixels / depthmap_downscale**2 / settings.get('adaptive_depthmap_megapixels_per_second')
+        return matching_time + depthmap_time
+
+
+    def get_matching_megapixels(self, megapixels: float, matching_downscale: int) -> float:
+        return megapixels * MATCHING_PIXEL_FACTORS[matching_downscale]
+
+
+    def get_next_downscale(self, downscales: List[int], downscale: int) -> int:
+        # Return the next higher downscale (the highest downscale stays)
+        higher_downscales = [higher_downscale for higher_downscale in downscales if higher_downscale > downscale]
+        return higher_downscales[0] if len(higher_downscales) > 0 else downscale
@@ -0,0 +1,455 @@
+import datetime
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+# psutil is optional. Without it the resource usage is read from the os module and /proc (Linux) where possible.
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from parameter_planner import ParameterPlanner
+from settings.settings import settings
+
+# Tables of the run history. Times are in seconds, memory and io in bytes.
+RUN_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dataset_runs (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    dataset_name   TEXT NOT NULL,
+    helper_mode    TEXT NOT NULL,
+    host           TEXT,
+    started_at     TEXT NOT NULL,
+    finished_at    TEXT,
+    status         TEXT NOT NULL,
+    error          TEXT,
+    image_count    INTEGER,
+    image_width    INTEGER,
+    image_height   INTEGER,
+    settings_hash  TEXT,
+    features       TEXT,
+    wall_time      REAL,
+    cpu_time       REAL,
+    peak_rss       INTEGER,
+    read_bytes     INTEGER,
+    write_bytes    INTEGER,
+    face_count     INTEGER,
+    disk_bytes     INTEGER,
+    peak_disk_bytes INTEGER
+);
+CREATE TABLE IF NOT EXISTS stage_runs (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    dataset_run_id INTEGER NOT NULL REFERENCES dataset_runs(id),
+    stage_name     TEXT NOT NULL,
+    stage_number   INTEGER,
+    started_at     TEXT NOT NULL,
+    wall_time      REAL,
+    cpu_time       REAL,
+    peak_rss       INTEGER,
+    read_bytes     INTEGER,
+    write_bytes    INTEGER,
+    face_count     INTEGER,
+    parameters     TEXT
+);
+CREATE TABLE IF NOT EXISTS texture_runs (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    dataset_run_id INTEGER NOT NULL REFERENCES dataset_runs(id),
+    texture_name   TEXT NOT NULL,
+    file_name      TEXT NOT NULL,
+    format         TEXT NOT NULL,
+    mip_level      INTEGER,
+    width          INTEGER,
+    height         INTEGER,
+    source_bytes   INTEGER,
+    bytes          INTEGER,
+    encode_time    REAL
+);
+CREATE INDEX IF NOT EXISTS stage_runs_stage_name ON stage_runs(stage_name);
+CREATE INDEX IF NOT EXISTS dataset_runs_started_at ON dataset_runs(started_at);
+"""
+
+class RunHistory():
+    def __init__(self, database_file_path: str) -> None:
+        self.database_file_path = database_file_path
+        with self.connect() as connection:
+            connection.executescript(RUN_HISTORY_SCHEMA)
+
+            # Add the columns that are missing in run histories of older versions
+            dataset_run_columns = [row['name'] for row in connection.execute("PRAGMA table_info(dataset_runs)")]
+            for column_name, column_type in [('features', 'TEXT'), ('disk_bytes', 'INTEGER'), ('peak_disk_bytes', 'INTEGER')]:
+                if column_name not in dataset_run_columns:
+                    connection.execute(f"ALTER TABLE dataset_runs ADD COLUMN {column_name} {column_type}")
+
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        # Several helpers (e.g. the workers of a dataset pool) can write at the same time, sqlite locks the database.
+        # The changes are committed and the connection is closed at the end.
+        connection = sqlite3.connect(self.database_file_path, timeout=60)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+
+    def start_dataset_run(self, dataset_name: str, helper_mode: str, image_count: Optional[int], image_size: Optional[tuple], features: dict) -> int:
+        """
+        This method records the start of a dataset calculation/export and returns the id of the dataset run.
+        The features (see get_dataset_features) are used to predict the stage durations.
+        """
+        image_width, image_height = image_size if image_size is not None else (None, None)
+        with self.connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO dataset_runs (dataset_name, helper_mode, host, started_at, status, image_count, image_width, image_height, "
+                "settings_hash, features) VALUES (?, ?, ?, ?, 'running', ?, ?, ?, ?, ?)",
+                (
+                    dataset_name, helper_mode, socket.gethostname(), get_timestamp(), image_count, image_width, image_height,
+                    get_settings_hash(), json.dumps(features)
+                )
+            )
+            return cursor.lastrowid
+
+
+    def finish_dataset_run(self, dataset_run_id: int, status: str, error: Optional[str], metrics: dict) -> None:
+        """
+        This method records the end of a dataset run with its status ('completed', 'rejected' or 'failed') and metrics.
+        """
+        with self.connect() as connection:
+            connection.execute(
+                "UPDATE dataset_runs SET finished_at = ?, status = ?, error = ?, wall_time = ?, cpu_time = ?, peak_rss = ?, "
+                "read_bytes = ?, write_bytes = ?, face_count = ?, disk_bytes = ?, peak_disk_bytes = ? WHERE id = ?",
+                (
+                    get_timestamp(), status, error, metrics.get('wall_time'), metrics.get('cpu_time'), metrics.get('peak_rss'),
+                    metrics.get('read_bytes'), metrics.get('write_bytes'), metrics.get('face_count'), metrics.get('disk_bytes'),
+                    metrics.get('peak_disk_bytes'), dataset_run_id
+                )
+            )
+
+
+    def add_stage_run(self, dataset_run_id: int, stage_name: str, stage_number: int, started_at: str, parameters: dict, metrics: dict) -> None:
+        """
+        This method records the metrics of a finished stage.
+        """
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT INTO stage_runs (dataset_run_id, stage_name, stage_number, started_at, wall_time, cpu_time, peak_rss, "
+                "read_bytes, write_bytes, face_count, parameters) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    dataset_run_id, stage_name, stage_number, started_at, metrics.get('wall_time'), metrics.get('cpu_time'),
+                    metrics.get('peak_rss'), metrics.get('read_bytes'), metrics.get('write_bytes'), metrics.get('face_count'),
+                    json.dumps(parameters, sort_keys=True, default=str)
+                )
+            )
+
+
+    def add_texture_runs(self, dataset_run_id: int, records: List[dict]) -> None:
+        """
+        This method records the files written by the texture processing (see TextureProcessor.process_texture).
+        """
+        with self.connect() as connection:
+            connection.executemany(
+                "INSERT INTO texture_runs (dataset_run_id, texture_name, file_name, format, mip_level, width, height, source_bytes, "
+                "bytes, encode_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        dataset_run_id, record['texture'], record['file'], record['format'], record['mip_level'], record['width'],
+                        record['height'], record['source_bytes'], record['bytes'], record['encode_time']
+                    )
+                    for record in records
+                ]
+            )
+
+
+    def get_stage_summary(self, since: str) -> List[sqlite3.Row]:
+        """
+        This method returns the metrics of every stage aggregated over all dataset runs since the given time.
+        """
+        with self.connect() as connection:
+            return connection.execute(
+                "SELECT stage_runs.stage_name AS stage_name, COUNT(*) AS runs, AVG(stage_runs.wall_time) AS wall_time, "
+                "SUM(stage_runs.wall_time) AS total_wall_time, AVG(stage_runs.cpu_time) AS cpu_time, "
+                "MAX(stage_runs.peak_rss) AS peak_rss, AVG(stage_runs.read_bytes) AS read_bytes, AVG(stage_runs.write_bytes) AS write_bytes "
+                "FROM stage_runs JOIN dataset_runs ON dataset_runs.id = stage_runs.dataset_run_id "
+                "WHERE dataset_runs.started_at >= ? GROUP BY stage_runs.stage_name ORDER BY total_wall_time DESC",
+                (since,)
+            ).fetchall()
+
+
+    def get_daily_summary(self, since: str) -> List[sqlite3.Row]:
+        """
+        This method returns the amount of dataset runs per day and status and their average wall time since the given time.
+        """
+        with self.connect() as connection:
+            return connection.execute(
+                "SELECT substr(started_at, 1, 10) AS day, helper_mode, status, COUNT(*) AS runs, AVG(wall_time) AS wall_time, "
+                "AVG(image_count) AS image_count FROM dataset_runs WHERE started_at >= ? "
+                "GROUP BY day, helper_mode, status ORDER BY day, helper_mode, status",
+                (since,)
+            ).fetchall()
+
+
+    def get_dataset_runs(self, dataset_name: Optional[str], limit: int) -> List[sqlite3.Row]:
+        """
+        This method returns the latest dataset runs (optionally of one dataset only).
+        """
+        with self.connect() as connection:
+            if dataset_name is None:
+                return connection.execute("SELECT * FROM dataset_runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+            return connection.execute(
+                "SELECT * FROM dataset_runs WHERE dataset_name = ? ORDER BY id DESC LIMIT ?", (dataset_name, limit)
+            ).fetchall()
+
+
+    def get_stage_samples(self, limit: int) -> List[sqlite3.Row]:
+        """
+        This method returns the wall time of the latest stage runs together with the features of their datasets.
+        """
+        with self.connect() as connection:
+            return connection.execute(
+                "SELECT stage_runs.stage_name AS stage_name, stage_runs.wall_time AS wall_time, dataset_runs.features AS features "
+                "FROM stage_runs JOIN dataset_runs ON dataset_runs.id = stage_runs.dataset_run_id "
+                "WHERE dataset_runs.features IS NOT NULL AND stage_runs.wall_time IS NOT NULL ORDER BY stage_runs.id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+
+
+    def get_stage_durations(self, limit: int) -> Dict[str, float]:
+        """
+        This method returns the average wall time of every stage over its latest runs (at most limit runs per stage).
+        """
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT stage_name, AVG(wall_time) AS wall_time FROM ("
+                "SELECT stage_name, wall_time, ROW_NUMBER() OVER (PARTITION BY stage_name ORDER BY id DESC) AS run_number "
+                "FROM stage_runs WHERE wall_time IS NOT NULL"
+                ") WHERE run_number <= ? GROUP BY stage_name",
+                (limit,)
+            ).fetchall()
+        return {row['stage_name']: row['wall_time'] for row in rows}
+
+
+    def get_disk_samples(self, helper_mode: str, limit: int) -> List[sqlite3.Row]:
+        """
+        This method returns the size of the model folder after the latest completed dataset runs and the largest size
+        while they were processed together with their features.
+        """
+        with self.connect() as connection:
+            return connection.execute(
+                "SELECT disk_bytes, peak_disk_bytes, features FROM dataset_runs "
+                "WHERE helper_mode = ? AND status = 'completed' AND features IS NOT NULL AND disk_bytes IS NOT NULL ORDER BY id DESC LIMIT ?",
+                (helper_mode, limit)
+            ).fetchall()
+
+
+    def get_texture_summary(self, since: str) -> List[sqlite3.Row]:
+        """
+        This method returns the encoded texture files per format and mip level since the given time with their encode
+        time and size. The size saving compares the files of mip level 0 with the exported textures.
+        """
+        with self.connect() as connection:
+            return connection.execute(
+                "SELECT texture_runs.format AS format, texture_runs.mip_level AS mip_level, COUNT(*) AS files, "
+                "AVG(texture_runs.encode_time) AS encode_time, SUM(texture_runs.encode_time) AS total_encode_time, "
+                "AVG(texture_runs.bytes) AS bytes, "
+                "CASE WHEN texture_runs.mip_level = 0 THEN 1.0 - SUM(texture_runs.bytes) * 1.0 / SUM(texture_runs.source_bytes) END AS saving "
+                "FROM texture_runs JOIN dataset_runs ON dataset_runs.id = texture_runs.dataset_run_id "
+                "WHERE dataset_runs.started_at >= ? GROUP BY texture_runs.format, texture_runs.mip_level "
+                "ORDER BY texture_runs.format, texture_runs.mip_level",
+                (since,)
+            ).fetchall()
+
+
+    def get_stage_runs(self, dataset_run_id: int) -> List[sqlite3.Row]:
+        """
+        This method returns the stages of a dataset run in their order.
+        """
+        with self.connect() as connection:
+            return connection.execute("SELECT * FROM stage_runs WHERE dataset_run_id = ? ORDER BY id", (dataset_run_id,)).fetchall()
+
+
+class RunRecorder():
+    def __init__(self, run_history: RunHistory, helper) -> None:
+        self.run_history = run_history
+        self.helper      = helper
+
+        self.dataset_run_id = None
+        self.dataset_start_time  = 0.0
+        self.dataset_start_usage = {}
+        self.stage_start_time    = 0.0
+        self.stage_started_at    = None
+        self.stage_start_usage   = {}
+        self.stage_number        = 0
+        self.face_count          = None
+        self.peak_disk_bytes     = None
+
+
+    def start_dataset(self, helper_mode: str) -> None:
+        # Record the dataset with its image count and resolution
+        dataset = self.helper.dataset
+        self.dataset_run_id = self.run_history.start_dataset_run(
+            dataset.name, helper_mode, len(dataset.images), dataset.image_size, get_dataset_features(dataset)
+        )
+        self.dataset_start_time  = time.time()
+        self.dataset_start_usage = get_resource_usage()
+        self.face_count          = None
+        self.peak_disk_bytes     = None
+
+
+    def finish_dataset(self, status: str, error: Optional[str] = None) -> None:
+        # Record the metrics of the whole dataset
+        metrics = get_usage_difference(self.dataset_start_usage, get_resource_usage())
+        metrics['wall_time']  = time.time() - self.dataset_start_time
+        metrics['face_count'] = self.face_count
+        metrics['disk_bytes'] = get_folder_size(self.helper.dataset.model_folder_path)
+        if metrics['disk_bytes'] is not None:
+            self.peak_disk_bytes = max(self.peak_disk_bytes or 0, metrics['disk_bytes'])
+        metrics['peak_disk_bytes'] = self.peak_disk_bytes
+        self.run_history.finish_dataset_run(self.dataset_run_id, status, error, metrics)
+
+
+    def start_stage(self, stage, parameters, stage_number, stage_amount) -> None:
+        # Remember the resource usage at the start of the stage
+        self.stage_number      = stage_number
+        self.stage_started_at  = get_timestamp()
+        self.stage_start_time  = time.time()
+        self.stage_start_usage = get_resource_usage()
+
+
+    def finish_stage(self, stage, parameters, elapsed_time) -> None:
+        # Record the metrics of the stage (the wall time does not include saving the document). The face count of the
+        # last stage is the face count of the dataset (the document is closed when the dataset is finished).
+        self.face_count = self.get_face_count()
+        metrics = get_usage_difference(self.stage_start_usage, get_resource_usage())
+        metrics['wall_time']  = elapsed_time
+        metrics['face_count'] = self.face_count
+        self.run_history.add_stage_run(self.dataset_run_id, stage.name, self.stage_number, self.stage_started_at, parameters, metrics)
+
+
+    def measure_disk_usage(self, stage) -> None:
+        # Remember the largest size of the model folder (measured after every stage before intermediates are removed)
+        disk_bytes = get_folder_size(self.helper.dataset.model_folder_path)
+        if disk_bytes is not None:
+            self.peak_disk_bytes = max(self.peak_disk_bytes or 0, disk_bytes)
+
+
+    def record_textures(self, records: List[dict]) -> None:
+        # Record the encode time and size of every file written by the texture processing
+        if len(records) > 0:
+            self.run_history.add_texture_runs(self.dataset_run_id, records)
+
+
+    def get_face_count(self) -> Optional[int]:
+        # Return the face count of the current model or None if there is no model
+        try:
+            model = self.helper.document.chunk.model
+            return len(model.faces) if model is not None else None
+        except Exception:
+            return None
+
+
+def get_run_history_file_path() -> str:
+    # The run history is stored in the cache folder (shared by the calculation and the export helper)
+    return os.path.join(settings.get('cache_folder_path'), 'run_history.sqlite')
+
+
+def get_resource_usage() -> dict:
+    """
+    This function returns the cpu time (including finished child processes), the peak memory and the io of the process.
+    Values that cannot be measured on this system are None.
+    """
+    usage = {'cpu_time': None, 'peak_rss': None, 'read_bytes': None, 'write_bytes': None}
+    if psutil is not None:
+        process = psutil.Process()
+        cpu_times = process.cpu_times()
+        usage['cpu_time'] = cpu_times.user + cpu_times.system + cpu_times.children_user + cpu_times.children_system
+        memory_info = process.memory_info()
+        usage['peak_rss'] = getattr(memory_info, 'peak_wset', None)
+        try:
+            io_counters = process.io_counters()
+            usage['read_bytes']  = io_counters.read_bytes
+            usage['write_bytes'] = io_counters.write_bytes
+        except (AttributeError, psutil.Error):
+            pass
+    else:
+        times = os.times()
+        usage['cpu_time'] = times.user + times.system + times.children_user + times.children_system
+
+    # Peak memory on Linux/macOS (kilobytes on Linux)
+    if usage['peak_rss'] is None and resource is not None:
+        usage['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    # Io on Linux without psutil
+    if usage['read_bytes'] is None and os.path.isfile('/proc/self/io'):
+        with open('/proc/self/io', 'r') as io_file:
+            io_counters = dict(line.split(': ') for line in io_file.read().splitlines())
+        usage['read_bytes']  = int(io_counters['read_bytes'])
+        usage['write_bytes'] = int(io_counters['write_bytes'])
+
+    return usage
+
+
+def get_usage_difference(start_usage: dict, end_usage: dict) -> dict:
+    # Cpu time and io are counted since the start, the peak memory is the peak of the process until the end
+    return {
+        'cpu_time':    subtract(end_usage.get('cpu_time'), start_usage.get('cpu_time')),
+        'read_bytes':  subtract(end_usage.get('read_bytes'), start_usage.get('read_bytes')),
+        'write_bytes': subtract(end_usage.get('write_bytes'), start_usage.get('write_bytes')),
+        'peak_rss':    end_usage.get('peak_rss'),
+    }
+
+
+def subtract(end_value, start_value):
+    return end_value - start_value if end_value is not None and start_value is not None else None
+
+
+def get_folder_size(folder_path: str) -> Optional[int]:
+    """
+    This function returns the size of all files in the folder and its sub folders (None if the folder does not exist).
+    """
+    if not os.path.isdir(folder_path):
+        return None
+    folder_size = 0
+    for root, _, file_names in os.walk(folder_path):
+        for file_name in file_names:
+            try:
+                folder_size += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return folder_size
+
+
+def get_dataset_features(dataset) -> dict:
+    """
+    This function returns the properties of the dataset and the settings that the stage durations depend on.
+    """
+    image_width, image_height = dataset.image_size if dataset.image_size is not None else (0, 0)
+    parameter_plan, _ = ParameterPlanner(dataset).plan()
+    return {
+        'image_count':        len(dataset.images),
+        'megapixels':         image_width * image_height / 1e6,
+        'depthmap_downscale': parameter_plan['depthmap_downscale'],
+        'matching_downscale': parameter_plan['matching_downscale'],
+        'use_smooth':         settings.get('use_smooth'),
+        'image_texture_size': settings.get('image_texture_size'),
+    }
+
+
+def get_settings_hash() -> str:
+    # Short hash of all settings, runs with the same hash used the same settings
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def get_timestamp() -> str:
+    return datetime.datetime.now().isoformat(timespec='seconds')
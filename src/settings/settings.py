@@ -11,6 +11,12 @@
 #   LOG SETTINGS:
 #   ============
 #   log_output_folder_path -> Path where the log files should be stored
+#   use_run_history        -> Record the time, cpu time, peak memory and io of every dataset and stage in the run history
+#                             (run_history.sqlite in the cache folder). Use report.bat to show the summaries.
+#
+#   CACHE SETTINGS:
+#   ==============
+#   cache_folder_path -> Path where the helpers store their caches (e.g. parsed scan information)
 #
 #   DATASET STRUCTURE SETTINGS:
 #   ==========================
@@ -22,6 +28,31 @@
 #   cam_pos_file_path   -> Location of the cam position file (relative to dataset folder)
 #   scan_info_file_path -> Location of the scan information file (relative to dataset folder)
 #
+#   DISCOVERY SETTINGS:
+#   ==================
+#   discovery_worker_count   -> Number of threads used to retrieve the available datasets (1 = one dataset after another)
+#   image_probe_worker_count -> Number of threads per dataset used to read the image sizes (all images must have the same size)
+#   use_discovery_index      -> Whether to reuse the metadata of datasets that did not change since the last run (stored in the cache folder)
+#
+#   WATCH SETTINGS:
+#   ==============
+#   use_watch_mode       -> Whether the helpers keep running and process datasets as soon as they are complete (instead of processing the available datasets once)
+#                           The watch mode processes one dataset after another (parallel_worker_count must be 1)
+#   watch_poll_interval  -> Seconds between two checks of the input folder (inotify wakes the helper up earlier where available)
+#   watch_stable_seconds -> Seconds the files of a complete dataset must not change before it is processed
+#
+#   SCHEDULE SETTINGS:
+#   =================
+#   schedule_policy             -> Order in which the datasets are processed:
+#                                  'shortest_job_first' -> shortest predicted duration first (run history, otherwise image count x resolution)
+#                                  'oldest_first'       -> the dataset that has been scanned first
+#                                  'prefix_priority'    -> in the order of schedule_prefix_priorities, then oldest first
+#                                  'priority_file'      -> in the order of the dataset names in the priority file, then oldest first
+#                                  'name'               -> sorted by name (default, the order of the input folder)
+#   schedule_prefix_priorities  -> Dataset prefixes from the highest to the lowest priority (prefix_priority policy)
+#   schedule_priority_file_path -> Text file with one dataset name per line, the first line has the highest priority (priority_file policy, read before every dataset)
+#   schedule_max_wait_hours     -> Datasets that have been waiting longer are processed first, regardless of the policy (0 = never)
+#
 #   SCAN INFORMATION REGEX SETTINGS:
 #   ===============================
 #   f_number_regex   -> Regex used to extract the f-number
@@ -34,15 +65,82 @@
 #   export_input_folder_path        -> Location of the 3_UNPINNED folder (absolute path)
 #   export_output_folder_path       -> Location of the 4_EXPORTED folder (absolute path)
 #
+#   JOB QUEUE SETTINGS:
+#   ==================
+#   use_job_queue          -> Whether several helpers (e.g. on different workstations) process the same input folders. Every dataset is claimed by one helper.
+#                             All helpers that use the same input folders must use the job queue
+#   job_queue_folder_path  -> Shared folder for the claim files (absolute path, must be the same folder for all helpers)
+#   job_heartbeat_interval -> Seconds between two heartbeats of a helper for its claimed datasets
+#   job_lease_seconds      -> Seconds without heartbeat after which a claim is considered stale (e.g. crashed helper) and the dataset can be claimed again
+#
+#   SCRATCH SETTINGS:
+#   ================
+#   use_scratch_staging -> Whether to process a local copy of every dataset (useful if the input folders are on a network share). The next dataset is
+#                          copied while the current one is processed and the results are written back in the background
+#   scratch_folder_path -> Location of the local scratch folder for the dataset copies (absolute path)
+#
+#   PARALLEL SETTINGS:
+#   =================
+#   parallel_worker_count    -> Number of datasets that are calculated/exported at the same time in separate processes (1 = one after another, default).
+#                               Raise it (e.g. to 2) to process several datasets at the same time, the datasets are then processed in place
+#                               (no scratch folder) and the watch mode cannot be used
+#   parallel_max_weight      -> Maximum sum of the stage weights that run at the same time (see stages/metashape_stages.py, 1.0 = one heavy stage)
+#   parallel_min_free_memory -> Minimum free memory (GB) to start another dataset or stage (needs psutil)
+#   parallel_max_cpu_load    -> Maximum cpu load (percent) to start another dataset or stage
+#   use_cpu_affinity         -> Whether to pin every worker process to its own share of the cpus
+#
+#   SAVE SETTINGS:
+#   =============
+#   save_policy              -> When the document is saved: 'every_stage' (default), 'expensive_stages', 'end' (only after the last stage) or 'auto' (see save_min_unsaved_seconds).
+#                               'expensive_stages' saves after the stages that took at least save_min_unsaved_seconds in the run history (without history
+#                               after the stages that are declared as expensive)
+#   save_min_unsaved_seconds -> With the 'auto' save policy the document is saved as soon as the stages since the last save took at least this many seconds
+#                               (cheap stages are saved together with the next stages, long stages are saved right away)
+#
+#   DISK SETTINGS:
+#   =============
+#   retention_prune_intermediates -> Intermediate results that are removed from the document after the last stage that needs them: 'depth_maps' (after build_model)
+#                                    and 'tie_points' (after build_depth_maps). Removed intermediates are calculated again if a stage that needs them is resumed. Empty by default (the documents keep all intermediates)
+#   use_disk_admission            -> Whether to check the free disk space before a dataset is started. Datasets whose estimated peak disk usage (run history,
+#                                    otherwise image count and resolution) does not fit are deferred instead of failing when the disk is full
+#   disk_min_free_gb              -> Free disk space (GB) that is kept in addition to the estimated peak disk usage of the datasets
+#
 #   # CALCULATION SETTINGS:
 #   use_tweaks          -> Wether to use tweaks or not during the calculation. If you dont want to use tweaks just set it to False
 #   tweaks              -> List of tweaks that are used to calculate the model. If you dont want to use tweaks just set use_tweaks to False
-#   depthmap_downscale  -> Downscale factor of the depthmaps (0 = no downscale, 0 < = more down scaled)
+#   depthmap_downscale  -> Downscale factor of the depthmaps (0 = no downscale, 0 < = more down scaled). Must be 0, 1, 2, 4 or 8
 #   use_smooth          -> Whether to smooth the calculated mesh or not
+#   calculation_stages  -> Stages of the calculation in their order (see stages/metashape_stages.py for all stages). Stages can be removed, reordered or added
+#   use_resume          -> Whether to continue an aborted calculation from the last completed stage (instead of starting from scratch)
+#   use_pair_preselection    -> Whether to match only image pairs with similar camera positions (instead of the generic/reference preselection of Metashape)
+#                               Disabled by default (the camera positions can fall back to the angles in the image file names)
+#   pair_max_angle           -> Maximum angle (degrees) between the viewing directions of two images that are matched
+#   pair_max_distance_factor -> Maximum distance between two cameras that are matched (multiplied with the median camera distance to the object)
+#   image_integrity_check        -> What to do with corrupt images before the calculation: 'off' (no check), 'reject' (skip the dataset) or 'exclude' (calculate without them)
+#   image_integrity_worker_count -> Number of processes used to check the images
+#   use_adaptive_parameters                 -> Whether to choose the matching and depth map parameters per dataset from the image count and resolution
+#                                              (disabled by default: the keypoint and tiepoint limits are 250000, matching uses depthmap_downscale and the depth maps downscale 1)
+#   adaptive_time_budget_minutes            -> Time the matching and the depth maps of a dataset should take at most. The downscales are increased until the estimate fits
+#   adaptive_max_matching_megapixels        -> Maximum megapixels per image used for matching (higher resolutions do not improve the alignment)
+#   adaptive_matching_megapixels_per_second -> Megapixels the workstation matches per second (used to estimate the time)
+#   adaptive_depthmap_megapixels_per_second -> Megapixels the workstation turns into depth maps per second at downscale 1 (used to estimate the time)
 #
 #   EXPORT SETTINGS: 
 #   ===============
-#   image_texture_size -> Size of the exported texture (width and height are the same)
+#   image_texture_size    -> Size of the exported texture (width and height are the same)
+#   export_stages         -> Stages of the export in their order (see stages/metashape_stages.py for all stages)
+#   lod_levels            -> Levels of detail exported by the export_lods stage: [face count, texture size] per level. Every level is
+#                            exported next to the model (NAME_lod0.obj has the most faces) and listed in NAME_lods.json for the viewer
+#   texture_formats       -> Encodings written by the process_textures stage for every exported texture: 'jpeg', 'webp' and/or 'png' (needs Pillow)
+#   texture_jpeg_quality  -> Quality of the jpeg textures (1 - 100)
+#   texture_webp_quality  -> Quality of the webp textures (1 - 100)
+#   texture_mip_levels    -> Amount of mip levels per texture including the full size (every level has half the size of the previous level)
+#   texture_tile_size     -> Size of the tiles the mip levels are downscaled in (limits the memory of the filter)
+#   texture_worker_count  -> Number of processes that process the textures
+#   texture_max_memory_mb -> Memory (MB) all processes may use at the same time. Every texture is decoded completely, a 16k RGBA texture needs about
+#                            2.5 GB with webp (at least one texture is processed, even if it needs more)
+#   fused_export_prefixes -> Dataset prefixes that are exported right after the calculation (no manual unpinning). These datasets are moved
+#                            directly to the export output folder. Empty by default (e.g. ["EXP"] to export the EXP datasets right away)
 #
 #----------------------------------------
 
@@ -52,6 +150,10 @@ settings = {
 
     # Log settings
     "log_output_folder_path": "C:\\InsectScanner\\Logs",
+    "use_run_history": True,
+
+    # Cache settings
+    "cache_folder_path": "C:\\InsectScanner\\Cache",
 
     # Dataset structure settings
     "use_folder_prefix": True, 
@@ -62,6 +164,22 @@ settings = {
     "cam_pos_file_path": "CamPos.txt",
     "scan_info_file_path": "ScanInformation.pdf",
 
+    # Discovery settings
+    "discovery_worker_count": 8,
+    "image_probe_worker_count": 8,
+    "use_discovery_index": True,
+
+    # Watch settings
+    "use_watch_mode": False,
+    "watch_poll_interval": 30,
+    "watch_stable_seconds": 120,
+
+    # Schedule settings
+    "schedule_policy": "name",
+    "schedule_prefix_priorities": ["EXP", "ETHZ-ENT"],
+    "schedule_priority_file_path": "C:\\InsectScanner\\priority.txt",
+    "schedule_max_wait_hours": 0,
+
     # Scan info pdf regex
     "f_number_regex":   r"Camera Constant\/f \[px\]:([0-9]*.[0-9]*)",
     "num_images_regex": r"Num Images:([0-9]*)",
@@ -72,12 +190,63 @@ settings = {
     "export_input_folder_path":       "C:\\InsectScanner\\Data\\UNPINNED",
     "export_output_folder_path":      "C:\\InsectScanner\\Data\\EXPORTED",
 
+    # Job queue settings
+    "use_job_queue": False,
+    "job_queue_folder_path": "C:\\InsectScanner\\Data\\JOBS",
+    "job_heartbeat_interval": 60,
+    "job_lease_seconds": 600,
+
+    # Scratch settings
+    "use_scratch_staging": False,
+    "scratch_folder_path": "C:\\InsectScanner\\Scratch",
+
+    # Parallel settings
+    "parallel_worker_count": 1,
+    "parallel_max_weight": 1.0,
+    "parallel_min_free_memory": 8,
+    "parallel_max_cpu_load": 90,
+    "use_cpu_affinity": False,
+
+    # Save settings
+    "save_policy": "every_stage",
+    "save_min_unsaved_seconds": 300,
+
+    # Disk settings
+    "retention_prune_intermediates": [],
+    "use_disk_admission": True,
+    "disk_min_free_gb": 20,
+
     # Calculation settings
     "use_tweaks": True,
     "tweaks": [("ooc_surface_blow_up",  "0.95"), ("ooc_surface_blow_off", "0.95")],
     "depthmap_downscale": 0,
     "use_smooth": True,
+    "calculation_stages": [
+        "add_photos", "import_camera_references", "import_camera_calibration", "match_photos",
+        "align_cameras", "optimize_cameras", "build_depth_maps", "build_model", "smooth_model"
+    ],
+    "use_resume": True,
+    "use_pair_preselection": False,
+    "pair_max_angle": 45,
+    "pair_max_distance_factor": 1.0,
+    "image_integrity_check": "reject",
+    "image_integrity_worker_count": 4,
+    "use_adaptive_parameters": False,
+    "adaptive_time_budget_minutes": 90,
+    "adaptive_max_matching_megapixels": 25.0,
+    "adaptive_matching_megapixels_per_second": 40.0,
+    "adaptive_depthmap_megapixels_per_second": 10.0,
 
     # Export settings
-    "image_texture_size": 4096
+    "image_texture_size": 4096,
+    "export_stages": ["build_uv", "build_texture", "export_model", "export_lods"],
+    "lod_levels": [[1000000, 4096], [250000, 2048], [50000, 1024]],
+    "texture_formats": ["jpeg", "webp"],
+    "texture_jpeg_quality": 90,
+    "texture_webp_quality": 85,
+    "texture_mip_levels": 4,
+    "texture_tile_size": 2048,
+    "texture_worker_count": 4,
+    "texture_max_memory_mb": 4096,
+    "fused_export_prefixes": []
 }
\ No newline at end of file
@@ -1,10 +1,12 @@
 import os
 import re
 from typing import List
-import Metashape
 
 from settings.settings import settings
 from settings.settings_exceptions import SettingNotFoundError, SettingTypeError, SettingValueError, MetashapeVersionMismatchError
+from parameter_planner import MATCHING_DOWNSCALES
+from stages.metashape_stages import intermediate_removers, stage_registry
+from texture_processor import TEXTURE_FORMATS, is_format_supported
 
 class SettingsValidator:
     def __init__(self):
@@ -15,6 +17,10 @@ class SettingsValidator:
             
             # Log settings
             'log_output_folder_path': str,
+            'use_run_history': bool,
+
+            # Cache settings
+            'cache_folder_path': str,
 
             # Dataset structure settings
             'use_folder_prefix': bool,
@@ -25,6 +31,22 @@ class SettingsValidator:
             'cam_pos_file_path': str,
             'scan_info_file_path': str,
 
+            # Discovery settings
+            'discovery_worker_count': int,
+            'image_probe_worker_count': int,
+            'use_discovery_index': bool,
+
+            # Watch settings
+            'use_watch_mode': bool,
+            'watch_poll_interval': int,
+            'watch_stable_seconds': int,
+
+            # Schedule settings
+            'schedule_policy': str,
+            'schedule_prefix_priorities': List,
+            'schedule_priority_file_path': str,
+            'schedule_max_wait_hours': int,
+
             # Scan info pdf regex
             "f_number_regex": str,
             "num_images_regex": str,
@@ -35,20 +57,72 @@ class SettingsValidator:
             'export_input_folder_path': str,
             'export_output_folder_path': str,
 
+            # Job queue settings
+            'use_job_queue': bool,
+            'job_queue_folder_path': str,
+            'job_heartbeat_interval': int,
+            'job_lease_seconds': int,
+
+            # Scratch settings
+            'use_scratch_staging': bool,
+            'scratch_folder_path': str,
+
+            # Parallel settings
+            'parallel_worker_count': int,
+            'parallel_max_weight': float,
+            'parallel_min_free_memory': int,
+            'parallel_max_cpu_load': int,
+            'use_cpu_affinity': bool,
+
+            # Save settings
+            'save_policy': str,
+            'save_min_unsaved_seconds': int,
+
+            # Disk settings
+            'retention_prune_intermediates': List,
+            'use_disk_admission': bool,
+            'disk_min_free_gb': int,
+
             # Calculation settings
             'use_tweaks': bool,
             'tweaks': List,
             'depthmap_downscale': int,
             'use_smooth': bool,
+            'calculation_stages': List,
+            'use_resume': bool,
+            'use_pair_preselection': bool,
+            'pair_max_angle': int,
+            'pair_max_distance_factor': float,
+            'image_integrity_check': str,
+            'image_integrity_worker_count': int,
+            'use_adaptive_parameters': bool,
+            'adaptive_time_budget_minutes': int,
+            'adaptive_max_matching_megapixels': float,
+            'adaptive_matching_megapixels_per_second': float,
+            'adaptive_depthmap_megapixels_per_second': float,
 
             # Export settings
             'image_texture_size': int,
+            'export_stages': List,
+            'lod_levels': List,
+            'texture_formats': List,
+            'texture_jpeg_quality': int,
+            'texture_webp_quality': int,
+            'texture_mip_levels': int,
+            'texture_tile_size': int,
+            'texture_worker_count': int,
+            'texture_max_memory_mb': int,
+            'fused_export_prefixes': List,
         }
 
-    def validate(self):
+    def validate(self, check_metashape_version: bool = True):
+        """
+        This method validates all settings. The Metashape version is not checked for tools that do not use Metashape
+        (e.g. the planner), so they run without a Metashape installation or license.
+        """
         self.validate_existence()
         self.validate_types()
-        self.validate_special_cases()
+        self.validate_special_cases(check_metashape_version)
 
     def validate_existence(self):
         for setting_name in self.settings_types.keys():
@@ -62,15 +136,32 @@ class SettingsValidator:
             if not isinstance(setting_value, expected_type):
                 raise SettingTypeError(f"Invalid type for setting '{setting_name}'. Expected {expected_type.__name__}, but got {type(setting_value).__name__}!")
 
-    def validate_special_cases(self):
-        self.validate_script_api_version()
+    def validate_special_cases(self, check_metashape_version: bool = True):
+        if check_metashape_version:
+            self.validate_script_api_version()
         self.validate_use_folder_prefix()
         self.validate_image_extensions()
+        self.validate_worker_counts()
+        self.validate_watch_intervals()
+        self.validate_schedule()
         self.validate_use_tweaks()
+        self.validate_image_integrity_check()
+        self.validate_pair_preselection()
+        self.validate_depthmap_downscale()
+        self.validate_adaptive_parameters()
+        self.validate_stages()
+        self.validate_lod_levels()
+        self.validate_texture_processing()
+        self.validate_save_policy()
+        self.validate_disk_settings()
+        self.validate_parallel_limits()
+        self.validate_job_queue()
         self.validate_folders()
         self.validate_regexes()
 
     def validate_script_api_version(self):
+        # Metashape is only imported here, so the other settings can be validated without it
+        import Metashape
         script_api_version = settings.get('script_api_version')
         metashape_version  = Metashape.app.version
         if not metashape_version.startswith(script_api_version):
@@ -87,20 +178,151 @@ class SettingsValidator:
         if len(image_extensions) == 0:
             raise SettingValueError("No image extensions have been defined!")
 
+    def validate_worker_counts(self):
+        worker_count_names = ['discovery_worker_count', 'image_probe_worker_count', 'image_integrity_worker_count', 'parallel_worker_count', 'texture_worker_count']
+        for worker_count_name in worker_count_names:
+            worker_count = settings.get(worker_count_name)
+            if worker_count < 1:
+                raise SettingValueError(f"{worker_count_name} must be at least 1!")
+
+    def validate_watch_intervals(self):
+        # The watch mode processes one dataset after another (the dataset pool only processes the available datasets)
+        if settings.get('use_watch_mode') and settings.get('parallel_worker_count') > 1:
+            raise SettingValueError("The watch mode processes one dataset after another, set parallel_worker_count to 1!")
+        if settings.get('watch_poll_interval') < 1:
+            raise SettingValueError("The watch poll interval must be at least 1 second!")
+        if settings.get('watch_stable_seconds') < 0:
+            raise SettingValueError("The watch stable seconds must not be negative!")
+
+    def validate_schedule(self):
+        schedule_policy = settings.get('schedule_policy')
+        if schedule_policy not in ['shortest_job_first', 'oldest_first', 'prefix_priority', 'priority_file', 'name']:
+            raise SettingValueError("The schedule policy must be 'shortest_job_first', 'oldest_first', 'prefix_priority', 'priority_file' or 'name'!")
+        if schedule_policy == 'prefix_priority' and len(settings.get('schedule_prefix_priorities')) == 0:
+            raise SettingValueError("You want to schedule by prefix but you provided no prefixes.")
+        if schedule_policy == 'priority_file' and not os.path.isfile(settings.get('schedule_priority_file_path')):
+            raise FileNotFoundError(f"The schedule_priority_file_path : '{settings.get('schedule_priority_file_path')}' does not exist!")
+        if settings.get('schedule_max_wait_hours') < 0:
+            raise SettingValueError("The schedule max wait hours must not be negative!")
+
     def validate_use_tweaks(self):
         use_tweaks = settings.get('use_tweaks')
         tweaks     = settings.get('tweaks')
         if use_tweaks and len(tweaks) == 0:
             raise SettingValueError("No tweaks have been defined!")
 
+    def validate_image_integrity_check(self):
+        image_integrity_check = settings.get('image_integrity_check')
+        if image_integrity_check not in ['off', 'reject', 'exclude']:
+            raise SettingValueError("The image integrity check must be 'off', 'reject' or 'exclude'!")
+
+    def validate_pair_preselection(self):
+        pair_max_angle           = settings.get('pair_max_angle')
+        pair_max_distance_factor = settings.get('pair_max_distance_factor')
+        if not 0 < pair_max_angle <= 180:
+            raise SettingValueError("The pair max angle must be between 0 and 180 degrees!")
+        if pair_max_distance_factor <= 0:
+            raise SettingValueError("The pair max distance factor must be greater than 0!")
+
+    def validate_depthmap_downscale(self):
+        # The downscale is used as the matching downscale of Metashape, which only knows these downscales
+        if settings.get('depthmap_downscale') not in MATCHING_DOWNSCALES:
+            raise SettingValueError(f"The depthmap downscale must be one of {', '.join(str(downscale) for downscale in MATCHING_DOWNSCALES)}!")
+
+    def validate_adaptive_parameters(self):
+        adaptive_names = [
+            'adaptive_time_budget_minutes',
+            'adaptive_max_matching_megapixels',
+            'adaptive_matching_megapixels_per_second',
+            'adaptive_depthmap_megapixels_per_second'
+        ]
+        for adaptive_name in adaptive_names:
+            if settings.get(adaptive_name) <= 0:
+                raise SettingValueError(f"{adaptive_name} must be greater than 0!")
+
+    def validate_stages(self):
+        for stages_name in ['calculation_stages', 'export_stages']:
+            try:
+                stage_registry.validate(settings.get(stages_name))
+            except ValueError as e:
+                raise SettingValueError(f"{stages_name}: {e}")
+        if len(settings.get('fused_export_prefixes')) > 0:
+            try:
+                stage_registry.validate(settings.get('calculation_stages') + settings.get('export_stages'))
+            except ValueError as e:
+                raise SettingValueError(f"calculation_stages + export_stages (fused export): {e}")
+
+    def validate_lod_levels(self):
+        lod_levels = settings.get('lod_levels')
+        if 'export_lods' in settings.get('export_stages') and len(lod_levels) == 0:
+            raise SettingValueError("You want to export levels of detail but you provided no lod levels.")
+        for lod_level in lod_levels:
+            if not isinstance(lod_level, list) or len(lod_level) != 2 or not all(isinstance(value, int) and value > 0 for value in lod_level):
+                raise SettingValueError(f"Invalid lod level {lod_level}, expected [face count, texture size] with positive integers!")
+        face_counts = [lod_level[0] for lod_level in lod_levels]
+        if len(set(face_counts)) != len(face_counts):
+            raise SettingValueError("The face counts of the lod levels must be different!")
+
+    def validate_texture_processing(self):
+        texture_formats = settings.get('texture_formats')
+        for texture_format in texture_formats:
+            if texture_format not in TEXTURE_FORMATS:
+                raise SettingValueError(f"Unknown texture format '{texture_format}' (known: {', '.join(TEXTURE_FORMATS)})!")
+        if 'process_textures' in settings.get('export_stages'):
+            if len(texture_formats) == 0:
+                raise SettingValueError("You want to process the textures but you provided no texture formats.")
+            for texture_format in texture_formats:
+                if not is_format_supported(texture_format):
+                    raise SettingValueError(f"The texture format '{texture_format}' needs Pillow (with {texture_format} support), install it with 'pip install Pillow'!")
+        for quality_name in ['texture_jpeg_quality', 'texture_webp_quality']:
+            if not 1 <= settings.get(quality_name) <= 100:
+                raise SettingValueError(f"{quality_name} must be between 1 and 100!")
+        if settings.get('texture_mip_levels') < 1:
+            raise SettingValueError("The texture mip levels must be at least 1!")
+        if settings.get('texture_tile_size') < 64:
+            raise SettingValueError("The texture tile size must be at least 64 pixels!")
+        if settings.get('texture_max_memory_mb') <= 0:
+            raise SettingValueError("The texture max memory must be greater than 0!")
+
+    def validate_save_policy(self):
+        save_policy = settings.get('save_policy')
+        if save_policy not in ['every_stage', 'expensive_stages', 'end', 'auto']:
+            raise SettingValueError("The save policy must be 'every_stage', 'expensive_stages', 'end' or 'auto'!")
+
+    def validate_disk_settings(self):
+        for intermediate in settings.get('retention_prune_intermediates'):
+            if intermediate not in intermediate_removers:
+                raise SettingValueError(f"Unknown intermediate '{intermediate}' in retention_prune_intermediates (known: {', '.join(intermediate_removers)})!")
+        if settings.get('disk_min_free_gb') < 0:
+            raise SettingValueError("The disk min free gb must not be negative!")
+
+    def validate_parallel_limits(self):
+        if settings.get('parallel_max_weight') <= 0:
+            raise SettingValueError("The parallel max weight must be greater than 0!")
+        if settings.get('parallel_min_free_memory') < 0:
+            raise SettingValueError("The parallel min free memory must not be negative!")
+        if not 0 < settings.get('parallel_max_cpu_load') <= 100:
+            raise SettingValueError("The parallel max cpu load must be between 1 and 100 percent!")
+
+    def validate_job_queue(self):
+        if settings.get('job_heartbeat_interval') < 1:
+            raise SettingValueError("The job heartbeat interval must be at least 1 second!")
+        if settings.get('job_lease_seconds') < 2 * settings.get('job_heartbeat_interval'):
+            raise SettingValueError("The job lease must be at least twice as long as the job heartbeat interval!")
+
     def validate_folders(self):
         folder_names = [
             'log_output_folder_path',
+            'cache_folder_path',
             'calculation_input_folder_path',
             'calculation_output_folder_path',
             'export_input_folder_path',
             'export_output_folder_path'
         ]
+        if settings.get('use_scratch_staging'):
+            folder_names.append('scratch_folder_path')
+        if settings.get('use_job_queue'):
+            folder_names.append('job_queue_folder_path')
 
         for folder_name in folder_names:
             folder_path = settings.get(folder_name)
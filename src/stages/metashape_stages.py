@@ -0,0 +1,534 @@
+import json
+import os
+import re
+import numpy as np
+
+# Metashape is only needed to run the stages. The stage list and the parameters can be inspected without it.
+try:
+    import Metashape
+except ImportError:
+    Metashape = None
+
+from pair_preselector import PairPreselector
+from settings.settings import settings
+from stages.stage import Stage
+from stages.stage_registry import StageRegistry
+from texture_processor import TextureProcessor, get_texture_savings
+
+# Registry of all stages that can be used in the calculation_stages and export_stages settings
+stage_registry = StageRegistry()
+
+
+def get_metashape_constants(parameters: dict, parameter_names: list) -> dict:
+    """
+    This function replaces the names of Metashape constants (e.g. 'MildFiltering') in the parameters with the constants.
+    """
+    resolved_parameters = dict(parameters)
+    for parameter_name in parameter_names:
+        resolved_parameters[parameter_name] = getattr(Metashape, parameters[parameter_name])
+    return resolved_parameters
+
+
+#----------------------------------------
+# Calculation stages
+#----------------------------------------
+
+def add_photos(helper, parameters, progress):
+    # Add all photos
+    helper.document.chunk.addPhotos(helper.dataset.images, progress=progress)
+
+stage_registry.register(Stage(
+    name   = 'add_photos',
+    label  = 'Add Photos',
+    run    = add_photos,
+    inputs = lambda helper: {'images': [os.path.basename(image) for image in helper.dataset.images]},
+    weight = 0.1,
+))
+
+
+def import_camera_references(helper, parameters, progress):
+    # Set the references from the already parsed cam positions (the file is not read again)
+    cameras   = helper.document.chunk.cameras
+    positions = helper.dataset.cam_positions.get_positions([camera.label for camera in cameras])
+    for camera, position in zip(cameras, positions):
+        if np.isfinite(position).all():
+            camera.reference.location = Metashape.Vector(position.tolist())
+            camera.reference.enabled  = True
+    helper.document.chunk.updateTransform()
+
+stage_registry.register(Stage(
+    name       = 'import_camera_references',
+    label      = 'Import Camera Reference',
+    run        = import_camera_references,
+    inputs     = lambda helper: {'cam_positions': helper.dataset.cam_positions.positions.tolist()},
+    depends_on = ['add_photos'],
+    weight     = 0.1,
+))
+
+
+def import_camera_calibration(helper, parameters, progress):
+    # Prepare calibration
+    calibration = Metashape.Calibration()
+    calibration.f      = parameters['f']
+    calibration.width  = parameters['width']
+    calibration.height = parameters['height']
+
+    # Apply calibration to all cameras
+    for sensor in helper.document.chunk.sensors:
+        sensor.user_calib = calibration
+
+stage_registry.register(Stage(
+    name       = 'import_camera_calibration',
+    label      = 'Import Camera Calibration',
+    run        = import_camera_calibration,
+    parameters = lambda helper: {
+        'f':      helper.dataset.f_number,
+        'width':  helper.dataset.image_size[0],
+        'height': helper.dataset.image_size[1],
+    },
+    depends_on = ['add_photos'],
+    weight     = 0.1,
+))
+
+
+def match_photos(helper, parameters, progress):
+    # Get the image pairs from the camera positions (empty if the preselection is not used)
+    pairs = get_preselected_pairs(helper) if parameters['use_pair_preselection'] else []
+
+    # Execute task (the generic and reference preselection is only needed if no pairs are given)
+    helper.document.chunk.matchPhotos(
+        downscale                = parameters['downscale'],
+        generic_preselection     = len(pairs) == 0,
+        reference_preselection   = len(pairs) == 0,
+        filter_stationary_points = parameters['filter_stationary_points'],
+        keypoint_limit           = parameters['keypoint_limit'],
+        tiepoint_limit           = parameters['tiepoint_limit'],
+        keep_keypoints           = parameters['keep_keypoints'],
+        guided_matching          = parameters['guided_matching'],
+        pairs                    = pairs,
+        progress                 = progress
+    )
+
+def get_preselected_pairs(helper):
+    # Get the image pairs and translate the image indices into camera keys
+    image_pairs  = PairPreselector(helper.dataset).get_pairs()
+    camera_keys  = {camera.label: camera.key for camera in helper.document.chunk.cameras}
+    image_labels = [os.path.splitext(os.path.basename(image))[0] for image in helper.dataset.images]
+    pairs = [
+        (camera_keys[image_labels[first]], camera_keys[image_labels[second]])
+        for first, second in image_pairs
+        if image_labels[first] in camera_keys and image_labels[second] in camera_keys
+    ]
+
+    # Log the amount of pairs compared to all possible pairs
+    camera_count = len(helper.document.chunk.cameras)
+    helper.logger.log(f"      Preselected {len(pairs)} of {camera_count * (camera_count - 1) // 2} image pairs")
+    return pairs
+
+stage_registry.register(Stage(
+    name       = 'match_photos',
+    label      = 'Match Photos',
+    run        = match_photos,
+    parameters = lambda helper: {
+        'downscale':                helper.parameter_plan['matching_downscale'],
+        'filter_stationary_points': True,
+        'keypoint_limit':           helper.parameter_plan['keypoint_limit'],
+        'tiepoint_limit':           helper.parameter_plan['tiepoint_limit'],
+        'keep_keypoints':           False,
+        'guided_matching':          False,
+        'use_pair_preselection':    settings.get('use_pair_preselection'),
+        'pair_max_angle':           settings.get('pair_max_angle'),
+        'pair_max_distance_factor': settings.get('pair_max_distance_factor'),
+    },
+    depends_on = ['import_camera_references', 'import_camera_calibration'],
+    produces   = ['tie_points'],
+    expensive  = True,
+    weight     = 0.5,
+))
+
+
+def align_cameras(helper, parameters, progress):
+    # Execute task
+    helper.document.chunk.alignCameras(progress=progress)
+
+stage_registry.register(Stage(
+    name       = 'align_cameras',
+    label      = 'Align Cameras',
+    run        = align_cameras,
+    depends_on = ['match_photos'],
+    consumes   = ['tie_points'],
+    expensive  = True,
+    weight     = 0.5,
+))
+
+
+def optimize_cameras(helper, parameters, progress):
+    # Execute task
+    helper.document.chunk.optimizeCameras(**parameters, progress=progress)
+
+stage_registry.register(Stage(
+    name       = 'optimize_cameras',
+    label      = 'Optimize Cameras',
+    run        = optimize_cameras,
+    parameters = lambda helper: {
+        'fit_f':  True,
+        'fit_cx': False,
+        'fit_cy': False,
+        'fit_b1': False,
+        'fit_b2': False,
+        'fit_k1': False,
+        'fit_k2': False,
+        'fit_k3': False,
+        'fit_k4': False,
+        'fit_p1': False,
+        'fit_p2': False,
+        'fit_corrections':     False,
+        'adaptive_fitting':    False,
+        'tiepoint_covariance': False,
+    },
+    depends_on = ['align_cameras'],
+    consumes   = ['tie_points'],
+))
+
+
+def build_depth_maps(helper, parameters, progress):
+    # Execute task
+    helper.document.chunk.buildDepthMaps(**get_metashape_constants(parameters, ['filter_mode']), progress=progress)
+
+stage_registry.register(Stage(
+    name       = 'build_depth_maps',
+    label      = 'Build Depth Maps',
+    run        = build_depth_maps,
+    parameters = lambda helper: {
+        'downscale':   helper.parameter_plan['depthmap_downscale'],
+        'filter_mode': helper.parameter_plan['depthmap_filter_mode'],
+    },
+    depends_on = ['align_cameras'],
+    produces   = ['depth_maps'],
+    consumes   = ['tie_points'],
+    expensive  = True,
+    weight     = 1.0,
+))
+
+
+def build_model(helper, parameters, progress):
+    # If there are tweaks calculate the model with tweaks
+    if len(parameters['tweaks']) > 0:
+        task = Metashape.Tasks.BuildModel()
+        for tweak in parameters['tweaks']:
+            task[tweak[0]] = tweak[1]
+        task.face_count  = getattr(Metashape, parameters['face_count'])
+        task.source_data = getattr(Metashape, parameters['source_data'])
+        # Execute task
+        task.apply(object=helper.document.chunk, progress=progress)
+    else:
+        # Execute task
+        helper.document.chunk.buildModel(
+            face_count  = getattr(Metashape, parameters['face_count']),
+            source_data = getattr(Metashape, parameters['source_data']),
+            progress    = progress
+        )
+
+stage_registry.register(Stage(
+    name       = 'build_model',
+    label      = 'Build Model',
+    run        = build_model,
+    parameters = lambda helper: {
+        'face_count':  'HighFaceCount',
+        'source_data': 'DepthMapsData',
+        'tweaks':      settings.get('tweaks') if settings.get('use_tweaks') else [],
+    },
+    depends_on = ['build_depth_maps'],
+    consumes   = ['depth_maps'],
+    expensive  = True,
+    weight     = 1.0,
+))
+
+
+def smooth_model(helper, parameters, progress):
+    # Execute task
+    helper.document.chunk.smoothModel(**parameters, progress=progress)
+
+stage_registry.register(Stage(
+    name       = 'smooth_model',
+    label      = 'Smooth Model',
+    run        = smooth_model,
+    parameters = lambda helper: {
+        'strength':       1,
+        'fix_borders':    False,
+        'preserve_edges': False,
+    },
+    depends_on = ['build_model'],
+    condition  = lambda helper: settings.get('use_smooth'),
+))
+
+
+#----------------------------------------
+# Intermediates
+#----------------------------------------
+
+def remove_depth_maps(helper):
+    # The depth maps are only needed to build the model and are by far the largest part of the document
+    if helper.document.chunk.depth_maps is not None:
+        helper.document.chunk.remove(helper.document.chunk.depth_maps)
+
+def remove_tie_points(helper):
+    # The tie points are only needed to align the cameras and to build the depth maps
+    if helper.document.chunk.tie_points is not None:
+        helper.document.chunk.remove(helper.document.chunk.tie_points)
+
+# Functions that remove an intermediate from the chunk (used in the retention_prune_intermediates setting)
+intermediate_removers = {
+    'depth_maps': remove_depth_maps,
+    'tie_points': remove_tie_points,
+}
+
+
+#----------------------------------------
+# Export stages
+#----------------------------------------
+
+def build_uv(helper, parameters, progress):
+    # Execute task
+    helper.document.chunk.buildUV(**get_metashape_constants(parameters, ['mapping_mode']), progress=progress)
+
+stage_registry.register(Stage(
+    name       = 'build_uv',
+    label      = 'Build UV',
+    run        = build_uv,
+    parameters = lambda helper: {
+        'mapping_mode': 'GenericMapping',
+        'page_count':   1,
+        'texture_size': settings.get('image_texture_size'),
+    },
+    depends_on = ['build_model', 'smooth_model'],
+))
+
+
+def build_texture(helper, parameters, progress):
+    # Execute task
+    helper.document.chunk.buildTexture(**parameters, progress=progress)
+
+stage_registry.register(Stage(
+    name       = 'build_texture',
+    label      = 'Build Texture',
+    run        = build_texture,
+    parameters = lambda helper: {
+        'texture_size':    settings.get('image_texture_size'),
+        'ghosting_filter': True,
+    },
+    depends_on = ['build_uv'],
+    expensive  = True,
+    weight     = 0.5,
+))
+
+
+def export_model(helper, parameters, progress):
+    # Execute task
+    helper.document.chunk.exportModel(
+        path     = helper.dataset.obj_file_path,
+        crs      = helper.coordinate_system,
+        progress = progress,
+        **get_metashape_constants(parameters, ['texture_format', 'format'])
+    )
+
+def get_export_parameters():
+    # Parameters of exportModel (also used to export the levels of detail)
+    return {
+        'binary':          True,
+        'precision':       6,
+        'texture_format':  'ImageFormatPNG',
+        'save_texture':    True,
+        'save_uv':         True,
+        'save_normals':    True,
+        'save_colors':     True,
+        'save_alpha':      True,
+        'colors_rgb_8bit': True,
+        'format':          'ModelFormatOBJ',
+    }
+
+stage_registry.register(Stage(
+    name       = 'export_model',
+    label      = 'Export Model',
+    run        = export_model,
+    parameters = lambda helper: get_export_parameters(),
+    depends_on = ['build_texture'],
+))
+
+
+def export_lods(helper, parameters, progress):
+    # The levels are built from the highest to the lowest face count, every level is decimated from the previous one
+    levels = sorted(parameters['levels'], key=lambda level: level[0], reverse=True)
+    original_chunk = helper.document.chunk
+    source_chunk, source_texture_size = original_chunk, parameters['texture_size']
+    lod_chunks, manifest_levels = [], []
+    try:
+        for level_index, (face_count, texture_size) in enumerate(levels):
+            level_progress = get_level_progress(progress, level_index, len(levels))
+
+            # Build the level (or reuse the model, uv and texture of the previous level)
+            lod_chunk, reused = build_lod(source_chunk, source_texture_size, face_count, texture_size, level_progress)
+            if lod_chunk is not source_chunk:
+                lod_chunks.append(lod_chunk)
+                source_chunk, source_texture_size = lod_chunk, texture_size
+
+            # Export the level next to the model (with its own texture)
+            lod_file_path = get_lod_file_path(helper.dataset, level_index)
+            lod_chunk.exportModel(
+                path     = lod_file_path,
+                crs      = helper.coordinate_system,
+                progress = level_progress,
+                **get_metashape_constants(parameters['export_parameters'], ['texture_format', 'format'])
+            )
+            lod_face_count = len(lod_chunk.model.faces)
+            manifest_levels.append(get_manifest_level(lod_file_path, level_index, lod_face_count, texture_size, reused))
+            helper.logger.log(f"      Exported level {level_index}: {lod_face_count} faces, {texture_size} texture (reused: {', '.join(reused) or '-'})")
+    finally:
+        # Remove the copies, only the original model stays in the document
+        if len(lod_chunks) > 0:
+            helper.document.remove(lod_chunks)
+        helper.document.chunk = original_chunk
+
+    # Write the manifest for the viewer
+    write_lod_manifest(helper.dataset, len(original_chunk.model.faces), manifest_levels)
+
+def build_lod(source_chunk, source_texture_size, face_count, texture_size, progress):
+    """
+    This function returns the chunk of a level and what has been reused from the source chunk. The source chunk is
+    exported as it is if it has few enough faces and the same texture size. With few enough faces only the texture is
+    built again (the uv is reused), otherwise a copy of the model is decimated and gets a new uv and texture.
+    """
+    needs_decimation = len(source_chunk.model.faces) > face_count
+    if not needs_decimation and texture_size == source_texture_size:
+        return source_chunk, ['model', 'uv', 'texture']
+
+    # Copy only the model (the cameras are always copied and needed to build the texture)
+    lod_chunk = source_chunk.copy(items=[Metashape.ModelData], keypoints=False)
+    if needs_decimation:
+        lod_chunk.decimateModel(face_count=face_count, progress=progress)
+        lod_chunk.buildUV(mapping_mode=Metashape.GenericMapping, page_count=1, texture_size=texture_size, progress=progress)
+    lod_chunk.buildTexture(texture_size=texture_size, ghosting_filter=True, progress=progress)
+    return lod_chunk, [] if needs_decimation else ['model', 'uv']
+
+def get_level_progress(progress, level_index, level_count):
+    # Map the progress of a level (0 - 100) to its part of the stage progress
+    return lambda value: progress((level_index + value / 100) / level_count * 100)
+
+def get_lod_file_path(dataset, level_index):
+    # The levels are exported next to the model (level 0 has the most faces)
+    return f"{os.path.splitext(dataset.obj_file_path)[0]}_lod{level_index}.obj"
+
+def get_lod_manifest_file_path(dataset):
+    return f"{os.path.splitext(dataset.obj_file_path)[0]}_lods.json"
+
+def get_manifest_level(lod_file_path, level_index, face_count, texture_size, reused):
+    # List all files of the level (model, material and texture) with their sizes
+    folder_path = os.path.dirname(lod_file_path)
+    file_prefix = os.path.splitext(os.path.basename(lod_file_path))[0] + '.'
+    files = {
+        file_name: os.path.getsize(os.path.join(folder_path, file_name))
+        for file_name in sorted(os.listdir(folder_path))
+        if file_name.startswith(file_prefix)
+    }
+    return {
+        'level':        level_index,
+        'face_count':   face_count,
+        'texture_size': texture_size,
+        'model':        os.path.basename(lod_file_path),
+        'files':        files,
+        'size':         sum(files.values()),
+        'reused':       reused,
+    }
+
+def write_lod_manifest(dataset, face_count, manifest_levels):
+    """
+    This function writes the manifest of the levels. The levels are listed from the least to the most detailed level,
+    so a viewer can load them progressively (the first level is shown first, the following levels replace it).
+    """
+    manifest = {
+        'dataset':    dataset.name,
+        'face_count': face_count,
+        'levels':     sorted(manifest_levels, key=lambda manifest_level: manifest_level['level'], reverse=True),
+    }
+    with open(get_lod_manifest_file_path(dataset), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+stage_registry.register(Stage(
+    name       = 'export_lods',
+    label      = 'Export LODs',
+    run        = export_lods,
+    parameters = lambda helper: {
+        'levels':            settings.get('lod_levels'),
+        'texture_size':      settings.get('image_texture_size'),
+        'export_parameters': get_export_parameters(),
+    },
+    depends_on = ['build_texture'],
+    expensive  = True,
+    weight     = 0.5,
+))
+
+
+def process_textures(helper, parameters, progress):
+    # Create the mip levels and the alternative encodings of the exported textures with a process pool
+    texture_paths = get_exported_texture_paths(helper.dataset)
+    records = TextureProcessor(parameters).process_textures(texture_paths, progress=progress)
+
+    # Log the size saving and the encode time of every format
+    savings = get_texture_savings(records)
+    for texture_format in parameters['formats']:
+        format_records = [record for record in records if record['format'] == texture_format]
+        if len(format_records) == 0:
+            continue
+        helper.logger.log(
+            f"      {texture_format}: {len(format_records)} files encoded in {sum(record['encode_time'] for record in format_records):.1f} s"
+            + (f", {savings[texture_format] * 100:.0f}% smaller than the exported textures" if texture_format in savings else "")
+        )
+
+    # Record every file in the run history and add the textures to the manifest of the levels of detail
+    if helper.run_recorder is not None:
+        helper.run_recorder.record_textures(records)
+    add_textures_to_lod_manifest(helper.dataset, records)
+
+def get_exported_texture_paths(dataset):
+    # The png textures of the model and of the levels of detail (e.g. NAME.png, NAME_lod1.png, NAME_lod1_2.png for a second page)
+    folder_path = os.path.dirname(dataset.obj_file_path)
+    model_name  = os.path.splitext(os.path.basename(dataset.obj_file_path))[0]
+    texture_regex = re.compile(rf"^{re.escape(model_name)}(_lod[0-9]+)?(_[0-9]+)?\.png$", re.IGNORECASE)
+    return [
+        os.path.join(folder_path, file_name)
+        for file_name in sorted(os.listdir(folder_path))
+        if texture_regex.match(file_name)
+    ]
+
+def add_textures_to_lod_manifest(dataset, records):
+    # The viewer finds the encodings and mip levels of every level in the manifest (nothing to do without levels of detail)
+    manifest_file_path = get_lod_manifest_file_path(dataset)
+    if not os.path.isfile(manifest_file_path):
+        return
+    with open(manifest_file_path, 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    for manifest_level in manifest['levels']:
+        manifest_level['textures'] = [
+            {key: record[key] for key in ['file', 'format', 'mip_level', 'width', 'height', 'bytes']}
+            for record in records
+            if record['texture'] in manifest_level['files']
+        ]
+    with open(manifest_file_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+stage_registry.register(Stage(
+    name       = 'process_textures',
+    label      = 'Process Textures',
+    run        = process_textures,
+    parameters = lambda helper: {
+        'formats':       settings.get('texture_formats'),
+        'jpeg_quality':  settings.get('texture_jpeg_quality'),
+        'webp_quality':  settings.get('texture_webp_quality'),
+        'mip_levels':    settings.get('texture_mip_levels'),
+        'tile_size':     settings.get('texture_tile_size'),
+        'worker_count':  settings.get('texture_worker_count'),
+        'max_memory_mb': settings.get('texture_max_memory_mb'),
+    },
+    depends_on = ['export_model', 'export_lods'],
+    weight     = 0.5,
+))
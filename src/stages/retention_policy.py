@@ -0,0 +1,51 @@
+from typing import Dict, List
+
+from settings.settings import settings
+from stages.metashape_stages import intermediate_removers
+from stages.stage import Stage
+
+class RetentionPolicy():
+    def __init__(self, helper, stages: List[Stage]) -> None:
+        # The helper gives access to the document and the logger
+        self.helper = helper
+
+        # Intermediates that are removed after a stage (stage name -> intermediates)
+        self.removals: Dict[str, List[str]] = {}
+        for intermediate in settings.get('retention_prune_intermediates'):
+            last_consumer = get_last_consumer(stages, intermediate)
+            if last_consumer is not None:
+                self.removals.setdefault(last_consumer.name, []).append(intermediate)
+
+
+    def remove_intermediates(self, stage: Stage) -> None:
+        """
+        This method removes the intermediates that are not needed by any later stage of the run. It is called after
+        every stage before the document is saved, so the removed intermediates are not written to the disk.
+        """
+        for intermediate in self.removals.get(stage.name, []):
+            intermediate_removers[intermediate](self.helper)
+            self.helper.logger.log(f"      Removed the {intermediate.replace('_', ' ')} (not needed by the following stages)")
+
+
+def get_last_consumer(stages: List[Stage], intermediate: str):
+    # Return the last stage that needs the intermediate (None if no stage needs it)
+    consumers = [stage for stage in stages if intermediate in stage.consumes]
+    return consumers[-1] if len(consumers) > 0 else None
+
+
+def get_resumable_stage_count(stages: List[Stage], completed_stage_count: int, completed_stage_names: List[str]) -> int:
+    """
+    This function returns how many of the completed stages can be kept when resuming. If an intermediate has been removed
+    in an earlier run (its last consumer has been completed) but a stage that needs it must run again, the calculation
+    is resumed at the stage that creates the intermediate.
+    """
+    for intermediate in settings.get('retention_prune_intermediates'):
+        last_consumer = get_last_consumer(stages, intermediate)
+        if last_consumer is None or last_consumer.name not in completed_stage_names:
+            continue
+        if not any(intermediate in stage.consumes for stage in stages[completed_stage_count:]):
+            continue
+        producer_indices = [index for index, stage in enumerate(stages) if intermediate in stage.produces]
+        if len(producer_indices) > 0:
+            completed_stage_count = min(completed_stage_count, producer_indices[0])
+    return completed_stage_count
@@ -0,0 +1,62 @@
+from typing import Callable, List, Optional
+
+class Stage():
+    def __init__(
+            self,
+            name: str,
+            label: str,
+            run: Callable,
+            parameters: Optional[Callable] = None,
+            inputs: Optional[Callable] = None,
+            depends_on: Optional[List[str]] = None,
+            produces: Optional[List[str]] = None,
+            consumes: Optional[List[str]] = None,
+            condition: Optional[Callable] = None,
+            expensive: bool = False,
+            weight: float = 0.25,
+        ):
+        # Unique name (used in settings, checkpoints and logs) and label (shown in the window and logs)
+        self.name  = name
+        self.label = label
+
+        # Function that executes the stage: run(helper, parameters, progress)
+        self.run = run
+
+        # Function that returns the parameters of the stage: parameters(helper) -> dict.
+        # The parameters must be plain values (no Metashape objects), so they can be logged, hashed and planned.
+        self.parameters = parameters
+
+        # Function that returns additional dataset inputs which are not parameters (e.g. the images): inputs(helper) -> dict
+        self.inputs = inputs
+
+        # Stages that must have been executed before this stage (in this run or in an earlier run)
+        self.depends_on = depends_on if depends_on is not None else []
+
+        # Intermediate results in the chunk (e.g. 'depth_maps') the stage creates and needs. Intermediates can be removed
+        # after the last stage that needs them (see retention_prune_intermediates).
+        self.produces = produces if produces is not None else []
+        self.consumes = consumes if consumes is not None else []
+
+        # Function that decides if the stage is executed: condition(helper) -> bool (e.g. smoothing only if use_smooth)
+        self.condition = condition
+
+        # Whether the stage takes long to compute. With the expensive_stages save policy the document is saved after it, the
+        # measured duration in the run history takes precedence (this flag is the fallback for stages without history)
+        self.expensive = expensive
+
+        # Share of the workstation the stage uses (1.0 = all of it). When datasets are processed in parallel, a stage is
+        # only started if the weights of the running stages leave room for it (see parallel_max_weight).
+        self.weight = weight
+
+    def get_parameters(self, helper) -> dict:
+        # Return the parameters of the stage
+        return self.parameters(helper) if self.parameters is not None else {}
+
+    def get_inputs(self, helper) -> dict:
+        # Return the parameters and the dataset inputs (used to detect changes when resuming)
+        inputs = self.inputs(helper) if self.inputs is not None else {}
+        return {'parameters': self.get_parameters(helper), 'inputs': inputs}
+
+    def is_enabled(self, helper) -> bool:
+        # Return whether the stage is executed
+        return self.condition(helper) if self.condition is not None else True
@@ -0,0 +1,45 @@
+from typing import Dict, List
+
+from stages.stage import Stage
+
+class StageRegistry():
+    def __init__(self):
+        self.stages: Dict[str, Stage] = {}
+
+    def register(self, stage: Stage) -> Stage:
+        # Add the stage to the registry, stage names must be unique
+        if stage.name in self.stages:
+            raise ValueError(f"Stage '{stage.name}' is already registered!")
+        self.stages[stage.name] = stage
+        return stage
+
+    def get(self, stage_name: str) -> Stage:
+        # Return the stage with the given name
+        if stage_name not in self.stages:
+            raise ValueError(f"Stage '{stage_name}' does not exist!")
+        return self.stages[stage_name]
+
+    def get_names(self) -> List[str]:
+        # Return the names of all registered stages
+        return list(self.stages.keys())
+
+    def validate(self, stage_names: List[str]) -> None:
+        """
+        This method checks that all stages exist and that every dependency which is part of the list comes before
+        the stage depending on it. Dependencies that are not in the list must have been executed in an earlier run.
+        """
+        for index, stage_name in enumerate(stage_names):
+            stage = self.get(stage_name)
+            if stage_name in stage_names[:index]:
+                raise ValueError(f"Stage '{stage_name}' is listed more than once!")
+            for dependency in stage.depends_on:
+                if dependency in stage_names[index + 1:]:
+                    raise ValueError(f"Stage '{stage_name}' depends on '{dependency}' which comes after it!")
+
+    def resolve(self, stage_names: List[str], helper) -> List[Stage]:
+        """
+        This method returns the enabled stages of the given stage names in their order.
+        """
+        self.validate(stage_names)
+        stages = [self.get(stage_name) for stage_name in stage_names]
+        return [stage for stage in stages if stage.is_enabled(helper)]
@@ -0,0 +1,119 @@
+import time
+from typing import Callable, Dict, List
+
+from settings.settings import settings
+from stages.stage import Stage
+
+class StageRunner():
+    def __init__(self, helper):
+        # The helper gives the stages access to the document, the dataset, the window and the logger
+        self.helper = helper
+
+        # Hooks that are called before and after every stage and whenever the progress of a stage changes:
+        #   before_stage_hook(stage, parameters, stage_number, stage_amount)
+        #   after_stage_hook(stage, parameters, elapsed_time)
+        #   cleanup_hook(stage) -> called after the stage before the document is saved (e.g. to remove intermediate results)
+        #   progress_hook(value)
+        #   save_hook(saved_stages) -> called after the document has been saved with all stages completed since the last save
+        self.before_stage_hooks: List[Callable] = []
+        self.after_stage_hooks: List[Callable] = []
+        self.cleanup_hooks: List[Callable] = []
+        self.progress_hooks: List[Callable] = []
+        self.save_hooks: List[Callable] = []
+
+        # Stages that have been executed since the last save and their compute time
+        self.unsaved_stages: List[Stage] = []
+        self.unsaved_time = 0.0
+
+        # Average measured duration of the stages in the run history (seconds), see is_expensive
+        self.stage_durations: Dict[str, float] = {}
+
+    def run(self, stages: List[Stage], first_stage_number: int = 1, stage_amount: int = None) -> None:
+        """
+        This method executes the stages one after another. Every stage is timed, logged and saved in the same way.
+        The stage numbers start at first_stage_number (used when stages have been completed before).
+        When the document is saved depends on the save_policy setting, but it is always saved after the last stage.
+        """
+        if stage_amount is None:
+            stage_amount = first_stage_number - 1 + len(stages)
+
+        for stage_number, stage in enumerate(stages, first_stage_number):
+            parameters = stage.get_parameters(self.helper)
+
+            for before_stage_hook in self.before_stage_hooks:
+                before_stage_hook(stage, parameters, stage_number, stage_amount)
+
+            # Log the task start and the parameters
+            start_time = time.time()
+            self.helper.logger.log_task_start(stage.label)
+            if len(parameters) > 0:
+                self.helper.logger.log(f"      Parameters: {parameters}")
+
+            # Execute the stage
+            stage.run(self.helper, parameters, self.report_progress)
+
+            # Log task end (the compute time does not include saving)
+            elapsed_time = time.time() - start_time
+            self.helper.logger.log_task_finish(start_time)
+
+            # Clean up before saving, so the removed intermediates are not written
+            for cleanup_hook in self.cleanup_hooks:
+                cleanup_hook(stage)
+
+            # Save the document if the save policy requires it
+            self.unsaved_stages.append(stage)
+            self.unsaved_time += elapsed_time
+            if self.should_save(stage):
+                self.save()
+
+            for after_stage_hook in self.after_stage_hooks:
+                after_stage_hook(stage, parameters, elapsed_time)
+
+        # Save the remaining stages
+        if len(self.unsaved_stages) > 0:
+            self.save()
+
+    def should_save(self, stage: Stage) -> bool:
+        """
+        This method decides if the document is saved after the stage:
+            every_stage      -> after every stage
+            expensive_stages -> after expensive stages (see is_expensive)
+            end              -> only after the last stage
+            auto             -> as soon as the compute time since the last save is at least save_min_unsaved_seconds
+        """
+        save_policy = settings.get('save_policy')
+        if save_policy == 'every_stage':
+            return True
+        if save_policy == 'expensive_stages':
+            return self.is_expensive(stage)
+        if save_policy == 'auto':
+            return self.unsaved_time >= settings.get('save_min_unsaved_seconds')
+        return False
+
+    def is_expensive(self, stage: Stage) -> bool:
+        """
+        This method decides if the stage is expensive from its measured duration in the run history: it is expensive if
+        it took at least save_min_unsaved_seconds on average. Stages without run history fall back to their expensive flag.
+        """
+        stage_duration = self.stage_durations.get(stage.name)
+        if stage_duration is None:
+            return stage.expensive
+        return stage_duration >= settings.get('save_min_unsaved_seconds')
+
+    def save(self) -> None:
+        # Save the document and log the time spent saving separately from the compute time
+        start_time = time.time()
+        self.helper.document.save()
+        self.helper.logger.log_document_saved(start_time)
+
+        # Pass the saved stages to the save hooks (e.g. to record them in the checkpoint)
+        saved_stages = self.unsaved_stages
+        self.unsaved_stages = []
+        self.unsaved_time = 0.0
+        for save_hook in self.save_hooks:
+            save_hook(saved_stages)
+
+    def report_progress(self, value: float) -> None:
+        # Forward the progress of the current stage (0 - 100) to all progress hooks
+        for progress_hook in self.progress_hooks:
+            progress_hook(value)
@@ -0,0 +1,202 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Pillow is optional. It is only needed by the process_textures export stage.
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+    features = None
+
+# File extensions and Pillow format names of the texture formats
+TEXTURE_FORMATS = {
+    'png':  ('.png',  'PNG'),
+    'jpeg': ('.jpg',  'JPEG'),
+    'webp': ('.webp', 'WEBP'),
+}
+
+# Additional bytes per pixel of the encoders while a level is written: jpeg needs an RGB copy of RGBA textures,
+# webp converts the texture into its own ARGB and YUV buffers, png is written row by row
+ENCODER_BYTES_PER_PIXEL = {'png': 0.0, 'jpeg': 3.0, 'webp': 6.0}
+
+class TextureProcessor():
+    def __init__(self, parameters: dict) -> None:
+        # The parameters are passed to the worker processes (the settings of the worker processes are not changed at runtime)
+        self.formats       = parameters['formats']
+        self.qualities     = {'jpeg': parameters['jpeg_quality'], 'webp': parameters['webp_quality']}
+        self.mip_levels    = parameters['mip_levels']
+        self.tile_size     = parameters['tile_size']
+        self.worker_count  = parameters['worker_count']
+        self.max_memory    = parameters['max_memory_mb'] * 1024**2
+
+
+    def process_textures(self, texture_paths: List[str], progress: Optional[Callable] = None) -> List[dict]:
+        """
+        This method creates the mip levels and the alternative encodings of all textures with a process pool and returns
+        one record per written file (see process_texture). Every texture is one job. Jobs are only started while the
+        estimated peak memory of the running jobs (see estimate_job_memory, it includes the whole decoded texture) fits
+        into max_memory_mb (at least one job runs), so several 8k or 16k textures are not decoded at the same time. The
+        progress (0 - 100) is reported whenever a texture is finished.
+        """
+        if len(texture_paths) == 0:
+            return []
+
+        # Start with the largest textures, so the small ones fill the gaps
+        job_memories = {texture_path: self.estimate_job_memory(texture_path) for texture_path in texture_paths}
+        pending_paths = sorted(texture_paths, key=lambda texture_path: job_memories[texture_path], reverse=True)
+
+        results = {}
+        running_jobs = {}
+        worker_count = max(1, min(self.worker_count, len(texture_paths)))
+        with ProcessPoolExecutor(max_workers=worker_count) as executor:
+            while len(pending_paths) > 0 or len(running_jobs) > 0:
+                # Start the jobs that fit into the memory limit
+                used_memory = sum(job_memories[texture_path] for texture_path in running_jobs.values())
+                while len(pending_paths) > 0 and len(running_jobs) < worker_count:
+                    if len(running_jobs) > 0 and used_memory + job_memories[pending_paths[0]] > self.max_memory:
+                        break
+                    texture_path = pending_paths.pop(0)
+                    running_jobs[executor.submit(self.process_texture, texture_path)] = texture_path
+                    used_memory += job_memories[texture_path]
+
+                # Collect the finished jobs (errors are raised here)
+                finished_jobs, _ = wait(running_jobs, return_when=FIRST_COMPLETED)
+                for finished_job in finished_jobs:
+                    results[running_jobs.pop(finished_job)] = finished_job.result()
+                if progress is not None:
+                    progress(100 * len(results) / len(texture_paths))
+
+        # Return the records in the order of the textures
+        return [record for texture_path in texture_paths for record in results[texture_path]]
+
+
+    def estimate_job_memory(self, texture_path: str) -> float:
+        """
+        This method returns the estimated peak memory of processing the texture (bytes). Pillow can only decode a png
+        completely, so the whole decoded texture is in memory while its first level is encoded and downscaled. The peak
+        is the decoded texture plus the larger of the encoder buffers and the next mip level, plus the filter buffers
+        of one tile. The size and mode are read from the header (the texture is not decoded).
+        """
+        with Image.open(texture_path) as image:
+            width, height = image.size
+            channels = 3 if image.mode == 'RGB' else 4
+        encoder_bytes_per_pixel = max(
+            ENCODER_BYTES_PER_PIXEL[texture_format] if texture_format != 'jpeg' or channels == 4 else 0.0
+            for texture_format in self.formats
+        )
+        bytes_per_pixel = channels + max(encoder_bytes_per_pixel, channels / 4)
+        tile_bytes = 2 * self.tile_size**2 * channels * 2
+        return width * height * bytes_per_pixel + tile_bytes
+
+
+    def process_texture(self, texture_path: str) -> List[dict]:
+        """
+        This method writes the mip levels of the texture (every level has half the size of the previous level) in all
+        formats and returns a record per file with its size and encode time. The first level has the size of the texture,
+        the following levels are named NAME_mip1, NAME_mip2, ... The texture is decoded completely (Pillow cannot decode
+        a png partially), afterwards only one level and the next one are kept in memory.
+        """
+        # The textures are created by Metashape, so large textures are not a decompression bomb
+        Image.MAX_IMAGE_PIXELS = None
+
+        source_bytes = os.path.getsize(texture_path)
+        base_path, source_extension = os.path.splitext(texture_path)
+        records = []
+        # Decode the texture without a copy (load() closes the file)
+        image = Image.open(texture_path)
+        image.load()
+        if image.mode not in ['RGB', 'RGBA']:
+            image = image.convert('RGBA')
+
+        for mip_level in range(self.mip_levels):
+            # Write the level in every format (the texture itself is not written again)
+            for texture_format in self.formats:
+                extension, pillow_format = TEXTURE_FORMATS[texture_format]
+                file_path = base_path + (f"_mip{mip_level}" if mip_level > 0 else "") + extension
+                if mip_level == 0 and extension == source_extension.lower():
+                    continue
+
+                start_time = time.time()
+                self.save_image(image, file_path, texture_format, pillow_format)
+                records.append({
+                    'texture':      os.path.basename(texture_path),
+                    'file':         os.path.basename(file_path),
+                    'format':       texture_format,
+                    'mip_level':    mip_level,
+                    'width':        image.width,
+                    'height':       image.height,
+                    'source_bytes': source_bytes,
+                    'bytes':        os.path.getsize(file_path),
+                    'encode_time':  time.time() - start_time,
+                })
+
+            # Downscale to the next level (the smallest level has at least one pixel)
+            if mip_level < self.mip_levels - 1:
+                if image.width == 1 and image.height == 1:
+                    break
+                image = self.downscale(image)
+        return records
+
+
+    def save_image(self, image, file_path: str, texture_format: str, pillow_format: str) -> None:
+        # Jpeg has no alpha channel
+        if texture_format == 'jpeg' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        options = {
+            'png':  {'optimize': True},
+            'jpeg': {'quality': self.qualities['jpeg'], 'optimize': True},
+            'webp': {'quality': self.qualities['webp'], 'method': 4},
+        }[texture_format]
+
+        # The file is written under a temporary name first, so no half written files are left
+        temporary_file_path = f"{file_path}.tmp"
+        image.save(temporary_file_path, format=pillow_format, **options)
+        os.replace(temporary_file_path, file_path)
+
+
+    def downscale(self, image):
+        """
+        This method returns the image with half the width and height. It is downscaled tile by tile, so the temporary
+        buffers of the filter only need the memory of a tile instead of the whole texture. The filter also reads the
+        pixels around every tile, so the tiles have no seams.
+        """
+        width, height = max(1, image.width // 2), max(1, image.height // 2)
+        scale_x, scale_y = image.width / width, image.height / height
+        downscaled_image = Image.new(image.mode, (width, height))
+        for tile_x, tile_y, tile_width, tile_height in get_tiles(width, height, self.tile_size):
+            box = (tile_x * scale_x, tile_y * scale_y, (tile_x + tile_width) * scale_x, (tile_y + tile_height) * scale_y)
+            tile = image.resize((tile_width, tile_height), Image.Resampling.LANCZOS, box=box)
+            downscaled_image.paste(tile, (tile_x, tile_y))
+        return downscaled_image
+
+
+def get_tiles(width: int, height: int, tile_size: int) -> List[Tuple[int, int, int, int]]:
+    # Split the image into tiles (x, y, width, height), the tiles at the right and bottom border can be smaller
+    return [
+        (tile_x, tile_y, min(tile_size, width - tile_x), min(tile_size, height - tile_y))
+        for tile_y in range(0, height, tile_size)
+        for tile_x in range(0, width, tile_size)
+    ]
+
+
+def get_texture_savings(records: List[dict]) -> Dict[str, float]:
+    """
+    This function returns the size saving (0 - 1) of every format at the size of the textures (mip level 0) compared to
+    the exported textures.
+    """
+    savings = {}
+    for texture_format in sorted({record['format'] for record in records if record['mip_level'] == 0}):
+        format_records = [record for record in records if record['format'] == texture_format and record['mip_level'] == 0]
+        source_bytes = sum(record['source_bytes'] for record in format_records)
+        if source_bytes > 0:
+            savings[texture_format] = 1 - sum(record['bytes'] for record in format_records) / source_bytes
+    return savings
+
+
+def is_format_supported(texture_format: str) -> bool:
+    # Pillow can be built without webp support
+    if Image is None or texture_format not in TEXTURE_FORMATS:
+        return False
+    return texture_format != 'webp' or features.check('webp')